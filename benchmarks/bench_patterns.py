@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Pattern MCP Server
+
+Generates a synthetic Fabric-style and custom pattern tree and measures cold
+load, warm get_pattern, filtered list_patterns, search_patterns latency and
+peak RSS. Results are written as JSON so runs from different versions can be
+compared with --compare.
+
+Usage:
+    python benchmarks/bench_patterns.py --patterns 5000 --output after.json
+    python benchmarks/bench_patterns.py --patterns 5000 --compare before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pattern_mcp_server import PatternRoot, PatternServer  # noqa: E402
+
+# Vocabulary for generated bodies: a few common prompt words plus a long tail
+COMMON_WORDS = [
+    "analyze",
+    "summarize",
+    "extract",
+    "review",
+    "identify",
+    "output",
+    "steps",
+    "input",
+    "content",
+    "write",
+    "list",
+    "key",
+    "ideas",
+    "bullet",
+    "points",
+]
+TAGS = [
+    "analysis",
+    "summary",
+    "writing",
+    "code",
+    "security",
+    "research",
+    "extraction",
+    "learning",
+    "meetings",
+    "review",
+]
+
+
+def generate_body(rng: random.Random, vocabulary: List[str], words: int) -> str:
+    """Generate a markdown body shaped like a Fabric prompt"""
+    sections = []
+    for heading in ("IDENTITY and PURPOSE", "STEPS", "OUTPUT INSTRUCTIONS"):
+        count = max(words // 3, 1)
+        text = " ".join(rng.choice(vocabulary) for _ in range(count))
+        sections.append(f"# {heading}\n\n{text}\n")
+    sections.append("# INPUT\n\nINPUT:\n")
+    return "\n".join(sections)
+
+
+def generate_corpus(
+    root: Path,
+    fabric_count: int,
+    custom_count: int,
+    mean_words: int = 400,
+    seed: int = 0,
+) -> Dict[str, Path]:
+    """Create a synthetic pattern tree under ``root``.
+
+    Body sizes follow a log-normal distribution around ``mean_words`` so the
+    corpus has a realistic mix of short and very long prompts. Returns the
+    Fabric and custom pattern directories.
+    """
+    rng = random.Random(seed)
+    vocabulary = COMMON_WORDS * 20 + [f"term{i}" for i in range(20000)]
+
+    fabric_dir = root / "fabric" / "patterns"
+    custom_dir = root / "custom_patterns"
+    fabric_dir.mkdir(parents=True, exist_ok=True)
+    custom_dir.mkdir(parents=True, exist_ok=True)
+
+    def body_words() -> int:
+        return max(int(rng.lognormvariate(0, 0.8) * mean_words), 20)
+
+    for i in range(fabric_count):
+        pattern_dir = fabric_dir / f"fabric_pattern_{i:05d}"
+        pattern_dir.mkdir(exist_ok=True)
+        (pattern_dir / "system.md").write_text(
+            generate_body(rng, vocabulary, body_words()), encoding="utf-8"
+        )
+        if rng.random() < 0.3:
+            (pattern_dir / "user.md").write_text(
+                generate_body(rng, vocabulary, 30), encoding="utf-8"
+            )
+
+    for i in range(custom_count):
+        name = f"custom_pattern_{i:05d}"
+        (custom_dir / f"{name}.md").write_text(
+            generate_body(rng, vocabulary, body_words()), encoding="utf-8"
+        )
+        metadata = {
+            "description": " ".join(rng.choice(vocabulary) for _ in range(8)),
+            "tags": rng.sample(TAGS, rng.randint(1, 3)),
+        }
+        (custom_dir / f"{name}.json").write_text(json.dumps(metadata), encoding="utf-8")
+
+    return {"fabric": fabric_dir, "custom": custom_dir}
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summarize latency samples (seconds) as milliseconds"""
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        index = min(int(fraction * len(ordered)), len(ordered) - 1)
+        return round(ordered[index] * 1000, 4)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 4),
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p99_ms": at(0.99),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+async def time_calls(
+    call: Callable[[Any], Any], arguments: Iterable[Any]
+) -> Dict[str, float]:
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        await call(argument)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def make_server(dirs: Dict[str, Path], persist_catalog: bool) -> PatternServer:
+    return PatternServer(
+        log_level="WARNING",
+        refresh_interval=3600,
+        persist_catalog=persist_catalog,
+        roots=[
+            PatternRoot("custom", dirs["custom"]),
+            PatternRoot("fabric", dirs["fabric"]),
+        ],
+    )
+
+
+async def run_benchmark(
+    dirs: Dict[str, Path], iterations: int, seed: int = 0
+) -> Dict[str, Any]:
+    """Measure the server against an existing corpus"""
+    rng = random.Random(seed)
+    results: Dict[str, Any] = {}
+
+    server = make_server(dirs, persist_catalog=True)
+    start = time.perf_counter()
+    await server.load_patterns(force=True)
+    results["cold_load_s"] = round(time.perf_counter() - start, 4)
+    results["patterns"] = len(server.patterns_cache)
+    await server.save_snapshot()
+
+    # A second process would start from the snapshot written above
+    restarted = make_server(dirs, persist_catalog=True)
+    start = time.perf_counter()
+    await restarted.load_patterns(force=True)
+    results["snapshot_load_s"] = round(time.perf_counter() - start, 4)
+    await restarted.search_patterns("warmup")
+    results["snapshot_search_ready_s"] = round(time.perf_counter() - start, 4)
+
+    names = list(server.patterns_cache)
+    hot = [rng.choice(names) for _ in range(min(50, len(names)))]
+    results["get_pattern_uncached"] = await time_calls(server.get_pattern, hot)
+    results["get_pattern_warm"] = await time_calls(
+        server.get_pattern, [rng.choice(hot) for _ in range(iterations)]
+    )
+    results["list_patterns_all"] = await time_calls(
+        lambda _: server.list_patterns(), range(max(iterations // 20, 5))
+    )
+    results["list_patterns_tags"] = await time_calls(
+        lambda tags: server.list_patterns(tags=tags),
+        [[rng.choice(TAGS)] for _ in range(max(iterations // 20, 5))],
+    )
+
+    queries = [
+        " ".join(rng.sample(COMMON_WORDS, 2)) for _ in range(iterations // 2)
+    ] + [f"term{rng.randrange(20000)}" for _ in range(iterations // 2)]
+    results["search_patterns"] = await time_calls(server.search_patterns, queries)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Describe how each metric moved relative to a baseline run"""
+    lines = []
+    for key, value in current.items():
+        before = baseline.get(key)
+        if isinstance(value, dict) and isinstance(before, dict):
+            value, before = value.get("p50_ms"), before.get("p50_ms")
+            key = f"{key} p50_ms"
+        if not isinstance(value, (int, float)) or not isinstance(before, (int, float)):
+            continue
+        ratio = value / before if before else float("inf")
+        lines.append(f"{key:32} {before:>12} -> {value:>12}  ({ratio:.2f}x)")
+    return lines
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the Pattern MCP Server")
+    parser.add_argument(
+        "--patterns",
+        type=int,
+        default=1000,
+        help="Total number of patterns to generate (100 to 50000)",
+    )
+    parser.add_argument(
+        "--custom-ratio",
+        type=float,
+        default=0.5,
+        help="Fraction of generated patterns that are custom patterns",
+    )
+    parser.add_argument(
+        "--mean-words", type=int, default=400, help="Typical pattern body length"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=200, help="Samples per latency metric"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--corpus",
+        type=Path,
+        help="Directory for the generated corpus (kept; default: temporary)",
+    )
+    parser.add_argument("--output", type=Path, help="Write results JSON here")
+    parser.add_argument(
+        "--compare", type=Path, help="Results JSON of a previous run to compare"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    custom_count = int(args.patterns * args.custom_ratio)
+    fabric_count = args.patterns - custom_count
+
+    root = args.corpus or Path(tempfile.mkdtemp(prefix="pattern-bench-"))
+    try:
+        start = time.perf_counter()
+        dirs = generate_corpus(
+            root, fabric_count, custom_count, args.mean_words, args.seed
+        )
+        generate_s = time.perf_counter() - start
+
+        results = asyncio.run(run_benchmark(dirs, args.iterations, args.seed))
+    finally:
+        if args.corpus is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "config": {
+            "fabric_patterns": fabric_count,
+            "custom_patterns": custom_count,
+            "mean_words": args.mean_words,
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "generate_s": round(generate_s, 2),
+            "python": sys.version.split()[0],
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        print("\n".join(compare(results, baseline["results"])), file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -12,18 +12,1619 @@ License: MIT
 
 import logging
 
+import argparse
 import asyncio
+import base64
+import bisect
+import contextlib
+import ctypes
+import ctypes.util
+import functools
+import hashlib
+import heapq
+import itertools
 import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+import weakref
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
 
 import mcp
 from mcp.server import Server
+from mcp.server.lowlevel.helper_types import ReadResourceContents
 from mcp.types import Resource, TextContent, Tool
 
+# NumPy and SciPy are optional. similar_patterns needs both, find_duplicates
+# only NumPy.
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    np = None  # type: ignore[assignment]
+try:
+    from scipy import sparse
+except ImportError:  # pragma: no cover - exercised only without scipy
+    sparse = None
+
+# (st_mtime_ns, st_size, st_ino) of a pattern file; None when the file is absent
+FileSignature = Optional[Tuple[int, int, int]]
+
+# Stat signatures of the files backing a pattern, and its catalog record
+PatternEntry = Tuple[Tuple[FileSignature, ...], "PatternRecord"]
+
+# Queued pattern read: (root, entry key, file signatures)
+PendingRead = Tuple["PatternRoot", str, Tuple[FileSignature, ...]]
+
+# Completed pattern read: (entry key, file signatures, record, search fields)
+LoadedPattern = Tuple[str, Tuple[FileSignature, ...], "PatternRecord", Dict[str, str]]
+
+
+# First bytes of a PatternPack file
+PACK_MAGIC = b"PATPACK1"
+
+# Markdown ATX heading: level marks and title, ignoring closing hashes
+_HEADING_RE = re.compile(r"(#{1,6})[ \t]+(.*?)[ \t#]*$")
+
+# (level, title, start offset, end offset) of a markdown section
+Heading = Tuple[int, str, int, int]
+
+
+def _heading_table(markdown: str) -> List[Heading]:
+    """Locate every heading of a markdown document and the span it covers.
+
+    A section runs from its heading line to the next heading of the same or
+    a higher level. Lines inside fenced code blocks are not headings.
+    """
+    open_headings: List[List[Any]] = []
+    table: List[List[Any]] = []
+    fence = None
+    offset = 0
+    for line in markdown.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith(("```", "~~~")):
+            if fence is None:
+                fence = stripped[:3]
+            elif stripped.startswith(fence):
+                fence = None
+        elif fence is None:
+            match = _HEADING_RE.match(line.rstrip("\r\n"))
+            if match:
+                level = len(match.group(1))
+                while open_headings and open_headings[-1][0] >= level:
+                    open_headings.pop()[3] = offset
+                heading = [level, match.group(2), offset, len(markdown)]
+                open_headings.append(heading)
+                table.append(heading)
+        offset += len(line)
+    return [(level, title, start, end) for level, title, start, end in table]
+
+
+def _dump_json(data: Any, compact: bool = False) -> str:
+    """Serialize a tool response, pretty-printed unless ``compact``"""
+    if compact:
+        return json.dumps(data, separators=(",", ":"))
+    return json.dumps(data, indent=2)
+
+
+# Template placeholder such as {{input}} or {{ audience }}; Fabric plugin calls
+# like {{plugin:datetime:now}} are not variables and are left alone
+_PLACEHOLDER_RE = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_.-]*)\s*\}\}")
+
+
+# Include directive such as {{include:output_format}} or
+# {{include:fabric:extract_wisdom#OUTPUT INSTRUCTIONS}}: a pattern, optionally
+# qualified by root, and optionally one of its sections
+_INCLUDE_RE = re.compile(r"\{\{\s*include:\s*([^\s#}]+)\s*(?:#\s*([^}]*?))?\s*\}\}")
+
+
+class IncludeError(ValueError):
+    """An include directive names a missing pattern or section, or a cycle"""
+
+
+class PromptTemplate:
+    """A pattern compiled once into literal text and variable slots.
+
+    ``parts`` alternates literal text and variable names, starting and
+    ending with literal text, so rendering is a single join.
+    """
+
+    __slots__ = ("parts", "variables", "size")
+
+    def __init__(self, text: str):
+        self.parts = _PLACEHOLDER_RE.split(text)
+        self.variables = frozenset(self.parts[1::2])
+        self.size = len(text)
+
+    def render(self, values: Dict[str, str]) -> Tuple[str, List[str]]:
+        """Fill in ``values``; return the text and the names left unfilled.
+
+        Unfilled placeholders are kept in the text as ``{{name}}``.
+        """
+        parts = self.parts
+        out = [parts[0]]
+        missing = []
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            value = values.get(name)
+            if value is None:
+                missing.append(name)
+                out.append(f"{{{{{name}}}}}")
+            else:
+                out.append(value)
+            out.append(parts[i + 1])
+        return "".join(out), sorted(set(missing))
+
+
+def _file_signature(path: Path) -> FileSignature:
+    """Return the stat signature used to detect changes to a pattern file"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _write_atomic(path: Path, text: str):
+    """Replace ``path`` with ``text`` so readers see the old or new file whole"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+class PatternRoot:
+    """A named directory of patterns.
+
+    ``layout`` is ``"fabric"`` for one directory per pattern holding
+    ``system.md`` and/or ``user.md``, or ``"custom"`` for ``<name>.md`` files
+    with optional ``<name>.json`` metadata. With ``"pack"``, ``path`` is a
+    PatternPack file and the root serves the pack's section of the same
+    name. The name is reported as the ``source`` of the root's patterns and
+    qualifies them as ``<root>:<name>``.
+    """
+
+    __slots__ = ("name", "path", "layout")
+
+    LAYOUTS = ("fabric", "custom", "pack")
+
+    def __init__(self, name: str, path: Path, layout: Optional[str] = None):
+        if not name or ":" in name:
+            raise ValueError(f"Invalid pattern root name '{name}'")
+        layout = layout or ("fabric" if name == "fabric" else "custom")
+        if layout not in self.LAYOUTS:
+            raise ValueError(f"Unknown pattern root layout '{layout}'")
+        self.name = name
+        self.path = Path(path).expanduser()
+        self.layout = layout
+
+    def __repr__(self) -> str:
+        return f"PatternRoot({self.name!r}, {str(self.path)!r}, {self.layout!r})"
+
+    def entry_key(self, name: str) -> str:
+        """Catalog key the pattern ``name`` would have in this root"""
+        if self.layout == "fabric":
+            return str(self.path / name)
+        if self.layout == "pack":
+            return str(self.path / self.name / name)
+        return str(self.path / f"{name}.md")
+
+
+def default_pattern_roots() -> List[PatternRoot]:
+    """Custom patterns first, so they shadow Fabric patterns of the same name"""
+    config = Path.home() / ".config"
+    return [
+        PatternRoot("custom", config / "custom_patterns"),
+        PatternRoot("fabric", config / "fabric" / "patterns"),
+    ]
+
+
+def parse_pattern_roots(specs: Iterable[str]) -> List[PatternRoot]:
+    """Parse ``NAME[:LAYOUT]=PATH`` root specs, highest precedence first"""
+    roots: List[PatternRoot] = []
+    for spec in specs:
+        label, sep, path = spec.partition("=")
+        if not sep or not path:
+            raise ValueError(f"Pattern root '{spec}' is not NAME[:LAYOUT]=PATH")
+        name, _, layout = label.partition(":")
+        if any(root.name == name for root in roots):
+            raise ValueError(f"Duplicate pattern root '{name}'")
+        roots.append(PatternRoot(name, Path(path), layout or None))
+    return roots
+
+
+class PatternPack:
+    """A read-only archive of pattern roots, served from a memory map.
+
+    The file holds ``PACK_MAGIC``, the length of a JSON header as a 4-byte
+    little-endian integer, the header, then UTF-8 bodies. The header lists
+    each root's patterns as ``[name, metadata, {part: [offset, length]}]``
+    with offsets into the body section. Opening a pack parses only the
+    header; bodies are decoded from slices of the map on demand, and
+    processes serving the same pack share its pages in the page cache.
+    """
+
+    __slots__ = ("path", "signature", "sections", "_map", "_base")
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self._map[: len(PACK_MAGIC)]
+        if magic != PACK_MAGIC:
+            self._map.close()
+            raise ValueError(f"{self.path} is not a pattern pack")
+        start = len(PACK_MAGIC) + 4
+        (header_length,) = struct.unpack("<I", self._map[len(PACK_MAGIC) : start])
+        header = json.loads(self._map[start : start + header_length])
+        self._base = start + header_length
+
+        # Root name -> pattern name -> (metadata, {part: (offset, length)})
+        self.sections: Dict[str, Dict[str, Tuple[Any, Dict[str, List[int]]]]] = {}
+        for section in header["roots"]:
+            self.sections[section["name"]] = {
+                name: (metadata, parts) for name, metadata, parts in section["patterns"]
+            }
+
+    def __repr__(self) -> str:
+        return f"PatternPack({str(self.path)!r})"
+
+    def body(self, root: str, name: str) -> Dict[str, str]:
+        """Decode the prompt text of one pattern"""
+        _, parts = self.sections[root][name]
+        base = self._base
+        return {
+            part: self._map[base + offset : base + offset + length].decode("utf-8")
+            for part, (offset, length) in parts.items()
+        }
+
+    @staticmethod
+    def write(
+        path: Path,
+        sections: Iterable[
+            Tuple[str, Iterable[Tuple[str, Dict[str, Any], Dict[str, str]]]]
+        ],
+    ) -> int:
+        """Write (root name, [(name, metadata, body)]) sections to ``path``.
+
+        The file is replaced atomically, so servers with the old pack mapped
+        keep reading it undisturbed. Returns the size of the pack in bytes.
+        """
+        header_roots = []
+        chunks: List[bytes] = []
+        offset = 0
+        for root_name, patterns in sections:
+            entries = []
+            for name, metadata, body in patterns:
+                parts = {}
+                for part, text in body.items():
+                    encoded = text.encode("utf-8")
+                    parts[part] = [offset, len(encoded)]
+                    chunks.append(encoded)
+                    offset += len(encoded)
+                entries.append([name, metadata, parts])
+            header_roots.append({"name": root_name, "patterns": entries})
+        header = json.dumps({"roots": header_roots}, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(PACK_MAGIC)
+                f.write(struct.pack("<I", len(header)))
+                f.write(header)
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return len(PACK_MAGIC) + 4 + len(header) + offset
+
+
+def packed_roots(roots: Iterable[PatternRoot], path: Path) -> List[PatternRoot]:
+    """Serve each root from its section of the pack at ``path``.
+
+    Roots without a section keep reading their directory, and so does the
+    first custom root, so new patterns can still be written.
+    """
+    sections = PatternPack(path).sections
+    roots = list(roots)
+    custom = [root for root in roots if root.layout == "custom"]
+    writable = next((root for root in custom if root.name == "custom"), None)
+    if writable is None and custom:
+        writable = custom[0]
+    return [
+        (
+            PatternRoot(root.name, Path(path), "pack")
+            if root.name in sections and root is not writable
+            else root
+        )
+        for root in roots
+    ]
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Runs of letters, runs of digits, and single other non-space characters
+_TOKEN_PIECE_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of LLM tokens in ``text`` without a tokenizer.
+
+    Mimics byte-pair encodings on English prose and markdown: a word of up
+    to six letters is one token and longer words add one per six letters,
+    numbers take one token per three digits, and punctuation is a token
+    per character. Typically within 15% of real BPE counts.
+    """
+    tokens = 0
+    for match in _TOKEN_PIECE_RE.finditer(text):
+        piece = match.group()
+        if piece.isdigit():
+            tokens += 1 + (len(piece) - 1) // 3
+        else:
+            tokens += 1 + (len(piece) - 1) // 6
+    return tokens
+
+
+def _tokenize(text: str) -> List[str]:
+    """Split text into lowercase alphanumeric search terms"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """Inverted index over pattern fields with field-weighted BM25 ranking.
+
+    Each document is split into the fields in ``FIELD_WEIGHTS``. Postings are
+    kept per field so scores can be computed with BM25F: length-normalized
+    term frequencies are weighted and summed across fields before BM25
+    saturation is applied. Postings hold plain ints rather than tuples to keep
+    the garbage collector out of large indexes.
+    """
+
+    FIELD_WEIGHTS = {"name": 4.0, "description": 2.0, "tags": 2.0, "content": 1.0}
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        # field -> term -> doc id -> term frequency
+        self._postings: Dict[str, Dict[str, Dict[str, int]]] = {
+            field: {} for field in self.FIELD_WEIGHTS
+        }
+        # field -> doc id -> token count
+        self._lengths: Dict[str, Dict[str, int]] = {
+            field: {} for field in self.FIELD_WEIGHTS
+        }
+        self._length_totals: Dict[str, int] = dict.fromkeys(self.FIELD_WEIGHTS, 0)
+        # term -> number of documents containing it in any field
+        self._doc_freq: Dict[str, int] = {}
+        # doc id -> field -> distinct terms, for removal
+        self._doc_terms: Dict[str, Dict[str, List[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_terms
+
+    def add(self, doc_id: str, fields: Dict[str, str]):
+        """Index a document, replacing any previous version of it"""
+        self.remove(doc_id)
+
+        doc_terms: Dict[str, List[str]] = {}
+        seen: Set[str] = set()
+        for field in self.FIELD_WEIGHTS:
+            tokens = _tokenize(fields.get(field, ""))
+            self._lengths[field][doc_id] = len(tokens)
+            self._length_totals[field] += len(tokens)
+            if not tokens:
+                continue
+
+            postings = self._postings[field]
+            counts = Counter(tokens)
+            for term, tf in counts.items():
+                term_postings = postings.get(term)
+                if term_postings is None:
+                    term_postings = postings[term] = {}
+                term_postings[doc_id] = tf
+            doc_terms[field] = list(counts)
+            seen.update(counts)
+
+        for term in seen:
+            self._doc_freq[term] = self._doc_freq.get(term, 0) + 1
+        self._doc_terms[doc_id] = doc_terms
+
+    def remove(self, doc_id: str):
+        """Drop a document from the index if present"""
+        doc_terms = self._doc_terms.pop(doc_id, None)
+        if doc_terms is None:
+            return
+
+        seen: Set[str] = set()
+        for field in self.FIELD_WEIGHTS:
+            self._length_totals[field] -= self._lengths[field].pop(doc_id)
+            postings = self._postings[field]
+            for term in doc_terms.get(field, ()):
+                term_postings = postings[term]
+                del term_postings[doc_id]
+                if not term_postings:
+                    del postings[term]
+                seen.add(term)
+
+        for term in seen:
+            if self._doc_freq[term] == 1:
+                del self._doc_freq[term]
+            else:
+                self._doc_freq[term] -= 1
+
+    def to_state(self) -> Dict[str, Any]:
+        """Export the index as JSON-serializable data for a snapshot.
+
+        Document ids are replaced by their position in ``docs`` and each
+        term's postings are flattened into [doc, tf, doc, tf, ...].
+        """
+        docs = list(self._doc_terms)
+        ids = {doc_id: i for i, doc_id in enumerate(docs)}
+        fields = {}
+        for field in self.FIELD_WEIGHTS:
+            lengths = self._lengths[field]
+            fields[field] = {
+                "lengths": [lengths[doc_id] for doc_id in docs],
+                "postings": {
+                    term: [
+                        value
+                        for doc_id, tf in term_postings.items()
+                        for value in (ids[doc_id], tf)
+                    ]
+                    for term, term_postings in self._postings[field].items()
+                },
+            }
+        return {"docs": docs, "fields": fields, "doc_freq": self._doc_freq}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "SearchIndex":
+        """Rebuild an index exported with ``to_state``"""
+        index = cls()
+        docs = state["docs"]
+        doc_terms: Dict[str, Dict[str, List[str]]] = {doc_id: {} for doc_id in docs}
+        for field, field_state in state["fields"].items():
+            index._lengths[field] = dict(zip(docs, field_state["lengths"], strict=True))
+            index._length_totals[field] = sum(field_state["lengths"])
+            postings = index._postings[field]
+            for term, flat in field_state["postings"].items():
+                doc_ids = [docs[i] for i in flat[::2]]
+                postings[term] = dict(zip(doc_ids, flat[1::2], strict=True))
+                for doc_id in doc_ids:
+                    doc_terms[doc_id].setdefault(field, []).append(term)
+        index._doc_freq = state["doc_freq"]
+        index._doc_terms = doc_terms
+        return index
+
+    def __iter__(self):
+        return iter(self._doc_terms)
+
+    def term_counts(self, doc_id: str) -> Dict[str, float]:
+        """Term frequencies of a document, summed over fields by weight"""
+        counts: Dict[str, float] = {}
+        for field, terms in self._doc_terms[doc_id].items():
+            weight = self.FIELD_WEIGHTS[field]
+            postings = self._postings[field]
+            for term in terms:
+                counts[term] = counts.get(term, 0.0) + weight * postings[term][doc_id]
+        return counts
+
+    def weighted_postings(self) -> Iterable[Tuple[str, float, Dict[str, int]]]:
+        """Yield (term, field weight, doc id -> tf) for every field's terms"""
+        for field, weight in self.FIELD_WEIGHTS.items():
+            for term, postings in self._postings[field].items():
+                yield term, weight, postings
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        accept: Optional[Callable[[str], bool]] = None,
+    ) -> List[Tuple[str, float]]:
+        """Return up to ``limit`` (doc id, score) pairs, best first.
+
+        ``accept``, if given, is asked about each matching doc id and
+        rejected ones are left out before the top ``limit`` are picked.
+        """
+        doc_count = len(self._doc_terms)
+        if not doc_count or limit <= 0:
+            return []
+
+        scores: Dict[str, float] = {}
+        for term in set(_tokenize(query)):
+            df = self._doc_freq.get(term)
+            if not df:
+                continue
+            idf = math.log(1.0 + (doc_count - df + 0.5) / (df + 0.5))
+
+            weighted: Dict[str, float] = {}
+            for field, weight in self.FIELD_WEIGHTS.items():
+                postings = self._postings[field].get(term)
+                if not postings:
+                    continue
+                lengths = self._lengths[field]
+                average = max(self._length_totals[field] / doc_count, 1.0)
+                for doc_id, tf in postings.items():
+                    norm = 1.0 - self.B + self.B * lengths[doc_id] / average
+                    weighted[doc_id] = weighted.get(doc_id, 0.0) + weight * tf / norm
+
+            for doc_id, frequency in weighted.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency / (
+                    self.K1 + frequency
+                )
+
+        if accept is not None:
+            scores = {
+                doc_id: score for doc_id, score in scores.items() if accept(doc_id)
+            }
+
+        # Ties are broken by name so results are deterministic
+        return heapq.nsmallest(
+            limit, scores.items(), key=lambda item: (-item[1], item[0])
+        )
+
+
+class TfidfIndex:
+    """Sparse TF-IDF vectors for cosine similarity between patterns.
+
+    Rows are kept per document and only the changed ones are recomputed;
+    the CSR matrix and IDF weights are reassembled from them with a few
+    vectorized operations the first time a query follows a change. A query
+    is then a single sparse matrix-vector product. Requires numpy and scipy.
+    """
+
+    def __init__(self):
+        if np is None or sparse is None:
+            raise RuntimeError("TfidfIndex requires numpy and scipy")
+        self._vocabulary: Dict[str, int] = {}
+        # doc id -> (term ids, sublinear term frequencies)
+        self._rows: Dict[str, Tuple[Any, Any]] = {}
+        # (doc ids, L2-normalized TF-IDF matrix, idf), rebuilt after changes
+        self._matrix: Optional[Tuple[List[str], Any, Any]] = None
+        self._positions: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._rows
+
+    @classmethod
+    def from_search_index(cls, index: SearchIndex) -> "TfidfIndex":
+        """Build vectors for every document of a search index at once.
+
+        Walks the postings term by term rather than document by document,
+        which keeps the work in C-level list operations and is several times
+        faster than ``add`` on a large corpus.
+        """
+        tfidf = cls()
+        vocabulary = tfidf._vocabulary
+        doc_ids = list(index)
+        position = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        rows: List[int] = []
+        cols: List[int] = []
+        values: List[float] = []
+        weights: List[float] = []
+        for term, weight, postings in index.weighted_postings():
+            term_id = vocabulary.setdefault(term, len(vocabulary))
+            rows.extend(map(position.__getitem__, postings))
+            cols.extend(itertools.repeat(term_id, len(postings)))
+            values.extend(postings.values())
+            weights.extend(itertools.repeat(weight, len(postings)))
+
+        # Duplicate (doc, term) pairs from different fields are summed
+        data = np.array(values, dtype=np.float32) * np.array(weights, dtype=np.float32)
+        matrix = sparse.csr_matrix(
+            (data, (rows, cols)), shape=(len(doc_ids), len(vocabulary))
+        )
+        matrix.sum_duplicates()
+        indptr, indices, tf = matrix.indptr, matrix.indices, 1.0 + np.log(matrix.data)
+        for i, doc_id in enumerate(doc_ids):
+            start, end = indptr[i], indptr[i + 1]
+            tfidf._rows[doc_id] = (indices[start:end], tf[start:end])
+        return tfidf
+
+    def add(self, doc_id: str, counts: Dict[str, float]):
+        vocabulary = self._vocabulary
+        ids = np.array(
+            [vocabulary.setdefault(term, len(vocabulary)) for term in counts],
+            dtype=np.int32,
+        )
+        tf = np.array(list(counts.values()), dtype=np.float32)
+        self._rows[doc_id] = (ids, 1.0 + np.log(tf))
+        self._matrix = None
+
+    def remove(self, doc_id: str):
+        if self._rows.pop(doc_id, None) is not None:
+            self._matrix = None
+
+    def _build(self) -> Tuple[List[str], Any, Any]:
+        if self._matrix is not None:
+            return self._matrix
+        doc_ids = list(self._rows)
+        rows = [self._rows[doc_id] for doc_id in doc_ids]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids, _ in rows], out=indptr[1:])
+        indices = np.concatenate([ids for ids, _ in rows] or [np.zeros(0, np.int32)])
+        data = np.concatenate([tf for _, tf in rows] or [np.zeros(0, np.float32)])
+
+        # Smoothed IDF, as in scikit-learn
+        doc_freq = np.bincount(indices, minlength=len(self._vocabulary))
+        idf = (np.log((1.0 + len(rows)) / (1.0 + doc_freq)) + 1.0).astype(np.float32)
+        data = data * idf[indices]
+        row_of = np.repeat(np.arange(len(rows)), np.diff(indptr))
+        norms = np.sqrt(np.bincount(row_of, weights=data * data, minlength=len(rows)))
+        data /= np.maximum(norms, 1e-12)[row_of]
+
+        matrix = sparse.csr_matrix(
+            (data, indices, indptr), shape=(len(rows), len(self._vocabulary))
+        )
+        self._matrix = (doc_ids, matrix, idf)
+        self._positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        return self._matrix
+
+    def _top(
+        self, vector: Any, limit: int, exclude: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        doc_ids, matrix, _ = self._build()
+        if not doc_ids or limit <= 0:
+            return []
+        scores = matrix @ vector
+        count = min(limit + 1, len(scores))
+        best = np.argpartition(-scores, count - 1)[:count]
+        results = [
+            (doc_ids[i], float(scores[i]))
+            for i in best
+            if scores[i] > 0 and doc_ids[i] != exclude
+        ]
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:limit]
+
+    def similar_to_doc(self, doc_id: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Documents most similar to an indexed one, excluding itself"""
+        _, matrix, _ = self._build()
+        row = matrix.getrow(self._positions[doc_id]).toarray().ravel()
+        return self._top(row, limit, exclude=doc_id)
+
+    def similar_to_text(self, text: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Documents most similar to free text"""
+        _, _, idf = self._build()
+        vector = np.zeros(len(idf), dtype=np.float32)
+        for term, tf in Counter(_tokenize(text)).items():
+            term_id = self._vocabulary.get(term)
+            if term_id is not None and term_id < len(idf):
+                vector[term_id] = (1.0 + math.log(tf)) * idf[term_id]
+        norm = float(np.linalg.norm(vector))
+        if not norm:
+            return []
+        return self._top(vector / norm, limit)
+
+
+class MinHashIndex:
+    """MinHash signatures bucketed by locality-sensitive hashing.
+
+    A document is reduced to its shingles, runs of ``SHINGLE_SIZE`` words,
+    and its signature keeps the minimum of each of ``NUM_PERM`` random hash
+    functions over them. The fraction of positions where two signatures
+    agree estimates the Jaccard similarity of the shingle sets. Signatures
+    are cut into ``BANDS`` bands and documents sharing a band land in the
+    same bucket, so only those candidate pairs are ever compared. With 32
+    bands of 4 rows, pairs at 0.5 similarity are found 87% of the time and
+    pairs at 0.7 or above almost always. Requires numpy.
+    """
+
+    NUM_PERM = 128
+    BANDS = 32
+    SHINGLE_SIZE = 5
+
+    _CHUNK = 4096
+
+    def __init__(self, seed: int = 1):
+        if np is None:
+            raise RuntimeError("MinHashIndex requires numpy")
+        # Multiply-shift hashing: the high 32 bits of (a * x + b) mod 2**64,
+        # with a odd, are a universal family and need no modulo
+        rng = np.random.default_rng(seed)
+        high = np.iinfo(np.uint64).max
+        self._a = rng.integers(0, high, self.NUM_PERM, dtype=np.uint64, endpoint=True)
+        self._a |= np.uint64(1)
+        self._b = rng.integers(0, high, self.NUM_PERM, dtype=np.uint64, endpoint=True)
+        self._signatures: Dict[str, Any] = {}
+        # (band number, band bytes) -> doc ids
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._signatures
+
+    @classmethod
+    def shingles(cls, text: str) -> Set[int]:
+        """32-bit hashes of the word shingles of ``text``"""
+        words = _tokenize(text)
+        size = cls.SHINGLE_SIZE
+        if len(words) <= size:
+            grams = [" ".join(words)] if words else []
+        else:
+            grams = [
+                " ".join(words[i : i + size]) for i in range(len(words) - size + 1)
+            ]
+        return {zlib.crc32(gram.encode("utf-8")) for gram in grams}
+
+    def signature(self, text: str) -> Optional[Any]:
+        """The MinHash signature of ``text``, or None if it has no words"""
+        hashes = np.fromiter(self.shingles(text), dtype=np.uint64)
+        if not hashes.size:
+            return None
+        signature = np.full(self.NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+        # Chunked so a huge document does not build a huge matrix
+        for start in range(0, hashes.size, self._CHUNK):
+            chunk = hashes[start : start + self._CHUNK, None]
+            permuted = (chunk * self._a + self._b) >> np.uint64(32)
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+        return signature.astype(np.uint32)
+
+    def _bands(self, signature: Any) -> Iterable[Tuple[int, bytes]]:
+        rows = self.NUM_PERM // self.BANDS
+        for band in range(self.BANDS):
+            yield band, signature[band * rows : (band + 1) * rows].tobytes()
+
+    def add(self, doc_id: str, signature: Any):
+        self.remove(doc_id)
+        self._signatures[doc_id] = signature
+        for bucket in self._bands(signature):
+            self._buckets.setdefault(bucket, set()).add(doc_id)
+
+    def remove(self, doc_id: str):
+        signature = self._signatures.pop(doc_id, None)
+        if signature is None:
+            return
+        for bucket in self._bands(signature):
+            members = self._buckets[bucket]
+            members.discard(doc_id)
+            if not members:
+                del self._buckets[bucket]
+
+    def similarity(self, a: str, b: str) -> float:
+        """Estimated Jaccard similarity of two indexed documents"""
+        agree = np.count_nonzero(self._signatures[a] == self._signatures[b])
+        return float(agree) / self.NUM_PERM
+
+    def _scored(
+        self, pairs: Iterable[Tuple[str, str]], threshold: float
+    ) -> List[Tuple[str, str, float]]:
+        scored = []
+        for a, b in pairs:
+            similarity = self.similarity(a, b)
+            if similarity >= threshold:
+                scored.append((a, b, similarity))
+        scored.sort(key=lambda item: (-item[2], item[0], item[1]))
+        return scored
+
+    def pairs(self, threshold: float = 0.8) -> List[Tuple[str, str, float]]:
+        """Pairs of documents sharing a bucket whose similarity meets
+        ``threshold``, most similar first"""
+        candidates: Set[Tuple[str, str]] = set()
+        for members in self._buckets.values():
+            if len(members) > 1:
+                candidates.update(itertools.combinations(sorted(members), 2))
+        return self._scored(candidates, threshold)
+
+    def duplicates_of(
+        self, doc_id: str, threshold: float = 0.8
+    ) -> List[Tuple[str, str, float]]:
+        """Pairs of ``doc_id`` with documents sharing one of its buckets"""
+        candidates: Set[str] = set()
+        for bucket in self._bands(self._signatures[doc_id]):
+            candidates.update(self._buckets[bucket])
+        candidates.discard(doc_id)
+        return self._scored(((doc_id, other) for other in candidates), threshold)
+
+
+def _normalize_tag(tag: str) -> str:
+    return tag.strip().casefold()
+
+
+# Shared by every record without metadata; never mutated
+_NO_METADATA: Dict[str, Any] = {}
+
+
+def _intern_metadata(metadata: Any) -> Dict[str, Any]:
+    """Intern the keys and tag strings of a metadata dict.
+
+    Tags repeat across many patterns, so interning lets records share one
+    string per distinct tag instead of one per occurrence.
+    """
+    if not isinstance(metadata, dict) or not metadata:
+        return _NO_METADATA
+    interned = {}
+    for key, value in metadata.items():
+        if key == "tags" and isinstance(value, list):
+            value = [sys.intern(tag) if isinstance(tag, str) else tag for tag in value]
+        elif key == "tags" and isinstance(value, str):
+            value = sys.intern(value)
+        interned[sys.intern(key)] = value
+    return interned
+
+
+class PatternRecord:
+    """Catalog entry for one pattern; bodies are loaded separately.
+
+    Slotted to keep a large catalog small: a record costs a fixed-size object
+    instead of a dict. ``name`` and ``source`` are interned, and ``path`` is
+    the same string object as the record's catalog key. ``chars`` and
+    ``tokens`` measure the content get_pattern returns, the latter with
+    estimate_tokens. For a ``composed`` pattern, one with include
+    directives, they start out measuring its own text and are updated once
+    its includes have been expanded.
+    """
+
+    __slots__ = (
+        "name",
+        "source",
+        "path",
+        "metadata",
+        "size",
+        "mtime",
+        "chars",
+        "tokens",
+        "composed",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        source: str,
+        path: str,
+        metadata: Any,
+        size: int,
+        mtime: float,
+        chars: int = 0,
+        tokens: int = 0,
+        composed: bool = False,
+    ):
+        self.name = sys.intern(name)
+        self.source = sys.intern(source)
+        self.path = path
+        self.metadata = _intern_metadata(metadata)
+        self.size = size
+        self.mtime = mtime
+        self.chars = chars
+        self.tokens = tokens
+        self.composed = composed
+
+    def __repr__(self) -> str:
+        return f"PatternRecord({self.source}:{self.name})"
+
+    def to_state(self) -> List[Any]:
+        """Serialize for the catalog snapshot; the path is the entry key"""
+        return [
+            self.name,
+            self.source,
+            self.metadata,
+            self.size,
+            self.mtime,
+            self.chars,
+            self.tokens,
+            self.composed,
+        ]
+
+    @classmethod
+    def from_state(cls, path: str, state: List[Any]) -> "PatternRecord":
+        return cls(state[0], state[1], path, *state[2:])
+
+
+class _Body(dict):
+    """Prompt text of a pattern by part; weakly referenceable for sharing"""
+
+    __slots__ = ("__weakref__",)
+
+
+def _deep_sizeof(obj: Any, seen: Set[int]) -> int:
+    """Approximate memory held by ``obj`` and the containers it references.
+
+    Objects already in ``seen`` are not counted again, so shared strings and
+    dicts count once across calls that share ``seen``.
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_sizeof(key, seen) + _deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += _deep_sizeof(item, seen)
+    return size
+
+
+def _record_tags(record: PatternRecord) -> List[str]:
+    """The tags in a record's metadata, tolerating a bare string or junk"""
+    tags = record.metadata.get("tags", [])
+    if isinstance(tags, str):
+        tags = [tags]
+    elif not isinstance(tags, list):
+        return []
+    return [tag for tag in tags if isinstance(tag, str)]
+
+
+class CatalogIndex:
+    """Secondary indexes from source and normalized tag to pattern names.
+
+    Kept in step with ``patterns_cache`` so filtered listings cost in
+    proportion to the number of matches rather than the catalog size. Tags
+    are matched case-insensitively and ignoring surrounding whitespace.
+    """
+
+    def __init__(self):
+        self.by_source: Dict[str, Set[str]] = {}
+        self.by_tag: Dict[str, Set[str]] = {}
+
+    def add(self, record: PatternRecord):
+        name = record.name
+        self.by_source.setdefault(record.source, set()).add(name)
+        for tag in _record_tags(record):
+            self.by_tag.setdefault(_normalize_tag(tag), set()).add(name)
+
+    def remove(self, record: PatternRecord):
+        name = record.name
+        keys = [(self.by_source, record.source)]
+        keys.extend((self.by_tag, _normalize_tag(tag)) for tag in _record_tags(record))
+        for index, key in keys:
+            names = index.get(key)
+            if names is None:
+                continue
+            names.discard(name)
+            if not names:
+                del index[key]
+
+    def select(
+        self, source: str = "all", tags: Iterable[str] = (), match: str = "any"
+    ) -> Optional[Set[str]]:
+        """Names passing the source and tag filters, or None if unfiltered.
+
+        With ``match="any"`` a pattern needs one of ``tags``; with
+        ``match="all"`` it needs every one of them.
+        """
+        groups: List[Set[str]] = []
+        if source != "all":
+            groups.append(self.by_source.get(source, set()))
+
+        tag_sets = [self.by_tag.get(_normalize_tag(tag), set()) for tag in tags]
+        if tag_sets:
+            if match == "all":
+                groups.extend(tag_sets)
+            else:
+                groups.append(set().union(*tag_sets))
+
+        if not groups:
+            return None
+        # Intersect starting from the smallest set
+        groups.sort(key=len)
+        return groups[0].intersection(*groups[1:])
+
+
+def _edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between two strings"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+class TrigramIndex:
+    """Character trigram index over pattern names for typo-tolerant lookup.
+
+    Names are normalized to lowercase words, so ``summarise paper`` and
+    ``summarize_paper`` share most of their trigrams. Candidates come from
+    the postings of the query's trigrams and are ranked by Dice similarity;
+    only that shortlist is ever compared by edit distance.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(_tokenize(text))
+
+    @classmethod
+    def trigrams(cls, text: str) -> Set[str]:
+        padded = f"  {cls.normalize(text)} "
+        return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, name: str):
+        if name in self._grams:
+            return
+        grams = self.trigrams(name)
+        self._grams[name] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(name)
+
+    def remove(self, name: str):
+        grams = self._grams.pop(name, None)
+        for gram in grams or ():
+            names = self._postings[gram]
+            names.discard(name)
+            if not names:
+                del self._postings[gram]
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        min_similarity: float = 0.3,
+        accept: Optional[Callable[[str], bool]] = None,
+    ) -> List[Tuple[str, float]]:
+        """Return up to ``limit`` (name, similarity) pairs, most similar first"""
+        grams = self.trigrams(query)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for name in self._postings.get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+
+        scored = []
+        for name, count in shared.items():
+            if accept is not None and not accept(name):
+                continue
+            similarity = 2.0 * count / (len(grams) + len(self._grams[name]))
+            if similarity >= min_similarity:
+                scored.append((name, similarity))
+        return heapq.nsmallest(limit, scored, key=lambda item: (-item[1], item[0]))
+
+    def suggest(self, name: str, limit: int = 3) -> List[str]:
+        """Names closest to ``name``, for "did you mean" hints"""
+        target = self.normalize(name)
+        candidates = self.search(name, limit * 5)
+        candidates.sort(
+            key=lambda item: (
+                _edit_distance(target, self.normalize(item[0])),
+                -item[1],
+                item[0],
+            )
+        )
+        return [candidate for candidate, _ in candidates[:limit]]
+
+
+class ByteLRUCache:
+    """LRU cache bounded by the total size of its values rather than a count"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[Any, Tuple[Any, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._items
+
+    def get(self, key: Any) -> Any:
+        """Return the cached value and mark it recently used, or None"""
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key: Any, value: Any, size: int):
+        """Cache a value, evicting least recently used ones to fit the budget"""
+        self.pop(key)
+        if size > self.max_bytes:
+            return
+        self._items[key] = (value, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def values(self) -> Iterable[Any]:
+        """Cached values, without counting as lookups"""
+        return (value for value, _ in self._items.values())
+
+    def pop(self, key: Any):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.total_bytes -= item[1]
+
+    def clear(self):
+        self._items.clear()
+        self.total_bytes = 0
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; recording is O(1) and never allocates"""
+
+    __slots__ = ("buckets", "total", "count", "max", "errors")
+
+    # Upper bounds of the buckets in seconds; a final bucket catches the rest
+    BOUNDS = (
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    )
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.buckets[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    def percentile(self, fraction: float) -> float:
+        """Estimate a percentile as the upper bound of the bucket holding it"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, bucket in zip(self.BOUNDS, self.buckets, strict=False):
+            seen += bucket
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p90_ms": round(self.percentile(0.90) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class _Timer:
+    """Context manager recording the duration of one operation"""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: LatencyHistogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class _NullTimer:
+    """Shared no-op stand-in for _Timer while stats are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class ServerStats:
+    """Per-operation call counts and latencies plus I/O counters.
+
+    Operations are labelled by handler (``tool:get_pattern``,
+    ``read_resource``, ...). When disabled, ``timer`` hands out a shared
+    no-op context manager and ``count`` returns immediately.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started = time.time()
+        self.counters: Dict[str, int] = {}
+        self.operations: Dict[str, LatencyHistogram] = {}
+
+    def timer(self, label: str) -> Any:
+        """Time a ``with`` block under ``label``; exceptions count as errors"""
+        if not self.enabled:
+            return _NULL_TIMER
+        histogram = self.operations.get(label)
+        if histogram is None:
+            histogram = self.operations[label] = LatencyHistogram()
+        return _Timer(histogram)
+
+    def count(self, name: str, amount: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self) -> Dict[str, Any]:
+        uptime = time.time() - self.started
+        calls = sum(histogram.count for histogram in self.operations.values())
+        return {
+            "enabled": self.enabled,
+            "uptime_s": round(uptime, 3),
+            "calls_per_s": round(calls / uptime, 3) if uptime > 0 else 0.0,
+            "operations": {
+                label: histogram.summary()
+                for label, histogram in sorted(self.operations.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def to_prometheus(self, counters: Dict[str, int], gauges: Dict[str, float]) -> str:
+        """Render the stats in the Prometheus text exposition format.
+
+        ``counters`` and ``gauges`` are extra values owned by the caller,
+        such as cache hit counts and the catalog size.
+        """
+        prefix = "pattern_server"
+        lines = [f"# TYPE {prefix}_request_duration_seconds histogram"]
+        for label, histogram in sorted(self.operations.items()):
+            op = json.dumps(label)
+            cumulative = 0
+            for bound, bucket in zip(histogram.BOUNDS, histogram.buckets, strict=False):
+                cumulative += bucket
+                lines.append(
+                    f'{prefix}_request_duration_seconds_bucket{{op={op},le="{bound}"}}'
+                    f" {cumulative}"
+                )
+            lines.append(
+                f'{prefix}_request_duration_seconds_bucket{{op={op},le="+Inf"}}'
+                f" {histogram.count}"
+            )
+            lines.append(
+                f"{prefix}_request_duration_seconds_sum{{op={op}}} {histogram.total}"
+            )
+            lines.append(
+                f"{prefix}_request_duration_seconds_count{{op={op}}} {histogram.count}"
+            )
+        lines.append(f"# TYPE {prefix}_request_errors_total counter")
+        for label, histogram in sorted(self.operations.items()):
+            lines.append(
+                f"{prefix}_request_errors_total{{op={json.dumps(label)}}}"
+                f" {histogram.errors}"
+            )
+        for name, total in sorted({**self.counters, **counters}.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {total}")
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class _Inotify:
+    """Minimal ctypes binding for the Linux inotify API"""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_IGNORED = 0x00008000
+
+    MASK = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+    )
+
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, libc: Any, fd: int):
+        self._libc = libc
+        self.fd = fd
+        self._watches: Dict[str, int] = {}
+
+    @classmethod
+    def create(cls) -> Optional["_Inotify"]:
+        """Open an inotify instance, or return None where it is unavailable"""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        return cls(libc, fd)
+
+    def watch(self, directories: Iterable[Path]):
+        """Make the set of watched directories match ``directories``"""
+        wanted = {str(directory) for directory in directories}
+        for path in set(self._watches) - wanted:
+            self._libc.inotify_rm_watch(self.fd, self._watches.pop(path))
+        for path in wanted - set(self._watches):
+            wd = self._libc.inotify_add_watch(
+                self.fd, os.fsencode(path), ctypes.c_uint32(self.MASK)
+            )
+            if wd >= 0:
+                self._watches[path] = wd
+
+    def drain(self) -> Set[str]:
+        """Consume pending events and return the watched paths they concern"""
+        touched = set()
+        ignored = set()
+        while True:
+            try:
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not buffer:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = self._EVENT_HEADER.unpack_from(buffer, offset)
+                offset += self._EVENT_HEADER.size + length
+                touched.add(wd)
+                if mask & self.IN_IGNORED:
+                    ignored.add(wd)
+
+        # The kernel drops watches on deleted directories; forget them so a
+        # directory recreated under the same path gets watched again
+        paths = {path for path, wd in self._watches.items() if wd in touched}
+        if ignored:
+            self._watches = {
+                path: wd for path, wd in self._watches.items() if wd not in ignored
+            }
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PatternWatcher:
+    """Keep a PatternServer's cache current in the background.
+
+    Filesystem events come from inotify where available and from periodic
+    polling otherwise. Events are debounced: a burst of changes, such as a
+    ``git pull`` of the Fabric repo, triggers a single incremental refresh
+    once it has been quiet for ``debounce`` seconds, and only rescans the roots
+    the events came from. In inotify mode a full rescan still runs every
+    ``rescan_interval`` seconds as a safety net for missed events and roots
+    that did not exist yet.
+    """
+
+    def __init__(
+        self,
+        server: "PatternServer",
+        debounce: float = 0.5,
+        poll_interval: float = 2.0,
+        rescan_interval: float = 60.0,
+        use_inotify: bool = True,
+    ):
+        self.server = server
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.use_inotify = use_inotify
+        self.refresh_count = 0
+        self._inotify: Optional[_Inotify] = None
+        self._changed: Optional[asyncio.Event] = None
+        # Watched directory -> root name, and the roots with pending events
+        self._watch_roots: Dict[str, Set[str]] = {}
+        self._dirty_roots: Set[str] = set()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._inotify is not None else "polling"
+
+    async def start(self):
+        """Load the catalog and start applying changes in the background"""
+        if self.running:
+            return
+
+        await self.server.load_patterns(force=True)
+        self._changed = asyncio.Event()
+
+        if self.use_inotify:
+            self._inotify = _Inotify.create()
+        if self._inotify is not None:
+            self._sync_watches()
+            asyncio.get_event_loop().add_reader(
+                self._inotify.fd, self._on_inotify_readable
+            )
+
+        self._task = asyncio.ensure_future(self._run())
+        self.server.logger.info(f"Watching pattern directories ({self.mode})")
+
+    async def stop(self):
+        """Stop watching and release the inotify instance"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._inotify is not None:
+            asyncio.get_event_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+
+    def _watched_directories(self) -> List[Path]:
+        self._watch_roots = {}
+        fabric_roots = set()
+        for root in self.server.roots:
+            if root.path.is_dir():
+                self._watch_roots.setdefault(str(root.path), set()).add(root.name)
+            elif root.layout == "pack" and root.path.parent.is_dir():
+                # Packs are replaced by renaming, an event on the directory.
+                # Several roots may share a pack or its directory.
+                directory = str(root.path.parent)
+                self._watch_roots.setdefault(directory, set()).add(root.name)
+            if root.layout == "fabric":
+                fabric_roots.add(root.name)
+        # Fabric keeps each pattern's files one level down
+        for key, (_, data) in self.server._pattern_files.items():
+            if data.source in fabric_roots:
+                self._watch_roots.setdefault(key, set()).add(data.source)
+        return [Path(directory) for directory in self._watch_roots]
+
+    def _sync_watches(self):
+        if self._inotify is not None:
+            self._inotify.watch(self._watched_directories())
+
+    def _on_inotify_readable(self):
+        if self._inotify is None:
+            return
+        paths = self._inotify.drain()
+        if paths:
+            for path in paths:
+                self._dirty_roots.update(self._watch_roots.get(path, ()))
+            assert self._changed is not None
+            self._changed.set()
+
+    async def _wait_for_change(self):
+        assert self._changed is not None
+        if self._inotify is None:
+            await asyncio.sleep(self.poll_interval)
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), self.rescan_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        assert self._changed is not None
+        while True:
+            await self._wait_for_change()
+
+            # Debounce: keep waiting until events stop arriving
+            while self._changed.is_set():
+                self._changed.clear()
+                await asyncio.sleep(self.debounce)
+
+            # Only roots with events are rescanned; polling and the periodic
+            # safety net rescan everything
+            roots = self._dirty_roots or None
+            self._dirty_roots = set()
+            try:
+                await self.server.load_patterns(force=True, roots=roots)
+                self.refresh_count += 1
+                self._sync_watches()
+            except Exception as e:
+                self.server.logger.error(f"Background pattern refresh failed: {e}")
+
 
 class PatternServer:
-    def __init__(self, log_level: str = "INFO"):
+    SNAPSHOT_MAGIC = b"PMCSNAP\0"
+    SNAPSHOT_VERSION = 4
+    SNAPSHOT_NAME = ".pattern_catalog.snapshot"
+    # Seconds to wait after a catalog change before saving the snapshot
+    SNAPSHOT_DELAY = 1.0
+
+    # Parts of a pattern that get_patterns can return
+    PATTERN_SECTIONS = ("content", "system", "user", "metadata")
+
+    # Patterns read per thread pool task during a refresh
+    LOAD_BATCH_SIZE = 32
+    # Patterns indexed between yields to the event loop during a refresh
+    INDEX_BATCH_SIZE = 64
+
+    # Seconds between rewrites of the stats file
+    STATS_FILE_INTERVAL = 10.0
+
+    def __init__(
+        self,
+        log_level: str = "INFO",
+        refresh_interval: float = 1.0,
+        watch: bool = False,
+        load_workers: int = 8,
+        body_cache_bytes: int = 32 * 1024 * 1024,
+        render_cache_bytes: int = 32 * 1024 * 1024,
+        template_cache_bytes: int = 8 * 1024 * 1024,
+        persist_catalog: bool = True,
+        resource_page_size: int = 500,
+        enable_stats: bool = True,
+        stats_file: Optional[Path] = None,
+        max_concurrency: Optional[int] = None,
+        roots: Optional[List[PatternRoot]] = None,
+    ):
         # Setup logging
         logging.basicConfig(
             level=getattr(logging, log_level.upper()),
@@ -32,19 +1633,129 @@ class PatternServer:
         self.logger = logging.getLogger(__name__)
 
         self.server = Server("pattern-content-server")
-        self.fabric_patterns_dir = Path.home() / ".config" / "fabric" / "patterns"
-        self.custom_patterns_dir = Path.home() / ".config" / "custom_patterns"
+
+        # Pattern roots, highest precedence first: a pattern shadows those of
+        # the same name in later roots. New patterns go to the root named
+        # "custom", or else the first root with the custom layout.
+        self.roots: List[PatternRoot] = list(roots or default_pattern_roots())
+        names = [root.name for root in self.roots]
+        if not names or len(set(names)) != len(names):
+            raise ValueError("Pattern roots must be non-empty with unique names")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
 
         # Ensure custom directory exists
-        try:
-            self.custom_patterns_dir.mkdir(parents=True, exist_ok=True)
-            self.logger.info(f"Custom patterns directory: {self.custom_patterns_dir}")
-        except Exception as e:
-            self.logger.error(f"Failed to create custom patterns directory: {e}")
-            raise
+        if self.custom_patterns_dir is not None:
+            try:
+                self.custom_patterns_dir.mkdir(parents=True, exist_ok=True)
+                self.logger.info(
+                    f"Custom patterns directory: {self.custom_patterns_dir}"
+                )
+            except Exception as e:
+                self.logger.error(f"Failed to create custom patterns directory: {e}")
+                raise
+
+        # Catalog of lightweight pattern records (name, source, path,
+        # metadata, size, mtime). Bodies are loaded on demand into body_cache.
+        self.patterns_cache: Dict[str, PatternRecord] = {}
+        self.body_cache = ByteLRUCache(body_cache_bytes)
+
+        # Every body held by body_cache, by content digest, so identical
+        # bodies are stored once; entries vanish with their last reference
+        self._bodies: weakref.WeakValueDictionary[bytes, _Body] = (
+            weakref.WeakValueDictionary()
+        )
+
+        # Formatted get_pattern/read_resource payloads, keyed like body_cache
+        self.render_cache = ByteLRUCache(render_cache_bytes)
 
-        # Cache for patterns
-        self.patterns_cache: Dict[str, Dict[str, str]] = {}
+        # Compiled render_pattern templates, keyed and versioned likewise
+        self.template_cache = ByteLRUCache(template_cache_bytes)
+
+        # Include graph of composed patterns: entry key -> (name, references)
+        # and referenced name -> keys of the patterns including it. Rendered
+        # output of a composed pattern is dropped when anything upstream of
+        # it changes; the generation counts those invalidations.
+        self._include_graph: Dict[str, Tuple[str, FrozenSet[str]]] = {}
+        self._includers: Dict[str, Set[str]] = {}
+        self._include_generation = 0
+
+        # Keys of composed patterns whose size estimates do not yet cover
+        # their expanded includes; settled before listings report them
+        self._unsettled_estimates: Set[str] = set()
+
+        # Source and tag lookups for filtered listings, kept in step with
+        # patterns_cache by _install_catalog
+        self.catalog_index = CatalogIndex()
+        self.name_index = TrigramIndex()
+
+        # Bumped whenever patterns_cache changes; pagination cursors embed it
+        self.catalog_generation = 0
+        self._sorted_names: Optional[Tuple[int, List[str]]] = None
+        self.resource_page_size = resource_page_size
+
+        # Search index over every loaded entry, keyed by entry path
+        self.search_index = SearchIndex()
+
+        # TF-IDF vectors for similar_patterns, derived lazily from the search
+        # index; None until first use or when numpy/scipy are missing
+        self.tfidf_index: Optional[TfidfIndex] = None
+        self._tfidf_source: Optional[SearchIndex] = None
+
+        # MinHash signatures for find_duplicates, built on first use and
+        # kept current by entry key and content version
+        self.minhash_index: Optional[MinHashIndex] = None
+        self._minhash_versions: Dict[str, Any] = {}
+
+        # Stat-based bookkeeping for incremental refreshes. Each root is
+        # trusted without touching the disk for ``refresh_interval`` seconds
+        # after its last scan: root name -> (path, layout, scan time).
+        self.refresh_interval = refresh_interval
+        self._pattern_files: Dict[str, PatternEntry] = {}
+        self._scanned_roots: Dict[str, Tuple[Path, str, float]] = {}
+
+        # Open pattern packs by path, reopened when the file is replaced
+        self._packs: Dict[str, PatternPack] = {}
+
+        # Refreshes and snapshot saves are serialized; both touch the index
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+        # The refresh in progress, shared by every caller that needs it:
+        # (sequence number, roots or None for all, forced, task)
+        self._refresh_flight: Optional[
+            Tuple[int, Optional[FrozenSet[str]], bool, asyncio.Future[None]]
+        ] = None
+        self._refreshes_started = 0
+
+        # Writers to the same custom pattern take turns; locks disappear
+        # once no writer holds or waits for them
+        self._name_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+
+        # On-disk snapshot of the catalog and search index for fast startup
+        self.persist_catalog = persist_catalog
+        self._snapshot_checked = False
+        self._snapshot_task: Optional[asyncio.Task[None]] = None
+        self._index_restore: Optional[asyncio.Future[SearchIndex]] = None
+
+        # Directory scans and file reads run here, off the event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=load_workers, thread_name_prefix="pattern-loader"
+        )
+
+        # Handler latencies and I/O counters, reported by the server_stats
+        # tool and optionally written to ``stats_file`` in Prometheus format
+        self.stats = ServerStats(enabled=enable_stats)
+        self.stats_file = Path(stats_file) if stats_file else None
+
+        # Upper bound on requests handled at once across all clients;
+        # the semaphore is created lazily to bind to the running loop
+        self.max_concurrency = max_concurrency
+        self._request_semaphore: Optional[asyncio.Semaphore] = None
+
+        # Optional background watcher; while it runs, requests never scan
+        self.watcher: Optional[PatternWatcher] = PatternWatcher(self) if watch else None
 
         # Setup handlers
         self.setup_handlers()
@@ -52,375 +1763,2078 @@ class PatternServer:
     def setup_handlers(self):
         """Setup MCP protocol handlers"""
 
-        @self.server.list_tools()
-        async def list_tools():
-            """List available tools"""
-            return [
-                Tool(
-                    name="list_patterns",
-                    description="List all available patterns from Fabric and custom directories",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "source": {
+        tools = [
+            Tool(
+                name="list_patterns",
+                description="List all available patterns from Fabric and custom directories",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "source": {
+                            "type": "string",
+                            "description": "Filter patterns by source: 'all' or a pattern root name such as 'fabric' or 'custom'",
+                            "default": "all",
+                        },
+                        "tags": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Filter patterns by tags (if metadata available)",
+                        },
+                        "tag_match": {
+                            "type": "string",
+                            "enum": ["any", "all"],
+                            "description": "Match patterns with any or all of the tags",
+                            "default": "any",
+                        },
+                        "max_tokens": {
+                            "type": "integer",
+                            "description": "Only list patterns estimated to fit in this many tokens",
+                        },
+                        "page_size": {
+                            "type": "integer",
+                            "description": "Maximum number of patterns per page (default: no paging)",
+                        },
+                        "cursor": {
+                            "type": "string",
+                            "description": "next_cursor from a previous page",
+                        },
+                        "compact": {
+                            "type": "boolean",
+                            "description": "Return JSON without indentation",
+                            "default": False,
+                        },
+                    },
+                },
+            ),
+            Tool(
+                name="get_pattern",
+                description="Get the content of a specific pattern",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "Name of the pattern to retrieve, or root:name for the version in a specific pattern root",
+                        },
+                        "section": {
+                            "type": "string",
+                            "description": "Return only this markdown section, e.g. 'STEPS'",
+                        },
+                        "start": {
+                            "type": "integer",
+                            "description": "First character to return (within the section, if given)",
+                        },
+                        "end": {
+                            "type": "integer",
+                            "description": "Character offset to stop before (within the section, if given)",
+                        },
+                    },
+                    "required": ["name"],
+                },
+            ),
+            Tool(
+                name="get_patterns",
+                description="Get the content of several patterns in one call",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "names": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Names of the patterns to retrieve",
+                        },
+                        "sections": {
+                            "type": "array",
+                            "items": {
                                 "type": "string",
-                                "enum": ["all", "fabric", "custom"],
-                                "description": "Filter patterns by source",
-                                "default": "all",
-                            },
-                            "tags": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "Filter patterns by tags (if metadata available)",
+                                "enum": list(self.PATTERN_SECTIONS),
                             },
+                            "description": "Parts to return for each pattern (default: content and metadata)",
+                        },
+                        "compact": {
+                            "type": "boolean",
+                            "description": "Return JSON without indentation",
+                            "default": False,
                         },
                     },
-                ),
-                Tool(
-                    name="get_pattern",
-                    description="Get the content of a specific pattern",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "name": {
-                                "type": "string",
-                                "description": "Name of the pattern to retrieve",
-                            }
+                    "required": ["names"],
+                },
+            ),
+            Tool(
+                name="render_pattern",
+                description="Fill a pattern's {{variable}} placeholders and return the ready-to-use prompt",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "Name of the pattern to render, or root:name",
+                        },
+                        "variables": {
+                            "type": "object",
+                            "additionalProperties": {"type": "string"},
+                            "description": "Values for {{variable}} placeholders",
+                        },
+                        "input": {
+                            "type": "string",
+                            "description": "Fills {{input}}, or is appended if the pattern has no such placeholder",
+                        },
+                        "strict": {
+                            "type": "boolean",
+                            "description": "Fail if any placeholder is left unfilled",
+                            "default": False,
                         },
-                        "required": ["name"],
                     },
-                ),
-                Tool(
-                    name="search_patterns",
-                    description="Search patterns by content or description",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "Search query to find in pattern content or metadata",
-                            },
-                            "limit": {
-                                "type": "integer",
-                                "description": "Maximum number of results to return",
-                                "default": 10,
-                            },
+                    "required": ["name"],
+                },
+            ),
+            Tool(
+                name="search_patterns",
+                description="Search patterns by content or description",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "Search query to find in pattern content or metadata",
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "Maximum number of results to return",
+                            "default": 10,
+                        },
+                        "fuzzy": {
+                            "type": "boolean",
+                            "description": "Match the query against pattern names, tolerating typos",
+                            "default": False,
+                        },
+                        "max_tokens": {
+                            "type": "integer",
+                            "description": "Only return patterns estimated to fit in this many tokens",
                         },
-                        "required": ["query"],
                     },
-                ),
-                Tool(
-                    name="create_pattern",
-                    description="Create a new custom pattern",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "name": {
-                                "type": "string",
-                                "description": "Name for the new pattern",
-                            },
-                            "content": {
-                                "type": "string",
-                                "description": "The pattern content/prompt",
-                            },
-                            "metadata": {
-                                "type": "object",
-                                "description": "Optional metadata (tags, description, etc.)",
-                            },
+                    "required": ["query"],
+                },
+            ),
+            Tool(
+                name="create_pattern",
+                description="Create a new custom pattern",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "Name for the new pattern",
+                        },
+                        "content": {
+                            "type": "string",
+                            "description": "The pattern content/prompt",
+                        },
+                        "metadata": {
+                            "type": "object",
+                            "description": "Optional metadata (tags, description, etc.)",
                         },
-                        "required": ["name", "content"],
                     },
-                ),
-            ]
+                    "required": ["name", "content"],
+                },
+            ),
+            Tool(
+                name="update_pattern",
+                description="Replace the content and/or metadata of a custom pattern",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "Name of the custom pattern",
+                        },
+                        "content": {
+                            "type": "string",
+                            "description": "New pattern content (unchanged if omitted)",
+                        },
+                        "metadata": {
+                            "type": "object",
+                            "description": "New metadata (unchanged if omitted, removed if empty)",
+                        },
+                    },
+                    "required": ["name"],
+                },
+            ),
+            Tool(
+                name="delete_pattern",
+                description="Delete a custom pattern",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "Name of the custom pattern",
+                        },
+                    },
+                    "required": ["name"],
+                },
+            ),
+            Tool(
+                name="similar_patterns",
+                description="Find patterns related to a pattern or to free text by TF-IDF cosine similarity",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "Pattern to find related patterns for",
+                        },
+                        "text": {
+                            "type": "string",
+                            "description": "Free text to find related patterns for",
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "Maximum number of results to return",
+                            "default": 10,
+                        },
+                    },
+                },
+            ),
+            Tool(
+                name="find_duplicates",
+                description="Find near-identical patterns by MinHash similarity of their content",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "threshold": {
+                            "type": "number",
+                            "description": "Minimum estimated Jaccard similarity, from 0 to 1",
+                            "default": 0.8,
+                        },
+                        "name": {
+                            "type": "string",
+                            "description": "Only report duplicates of this pattern",
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "Maximum number of pairs to return",
+                            "default": 50,
+                        },
+                    },
+                },
+            ),
+            Tool(
+                name="server_stats",
+                description="Report call counts, latencies, I/O and cache hit ratios",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "format": {
+                            "type": "string",
+                            "enum": ["json", "prometheus"],
+                            "description": "Output format",
+                            "default": "json",
+                        },
+                        "memory": {
+                            "type": "boolean",
+                            "description": "Include an estimate of catalog and body cache memory (JSON only)",
+                            "default": False,
+                        },
+                    },
+                },
+            ),
+        ]
+        tool_names = {tool.name for tool in tools}
+
+        @self.server.list_tools()
+        async def list_tools():
+            """List available tools"""
+            with self.stats.timer("list_tools"):
+                return tools
+
+        @self.server.call_tool()
+        async def call_tool(name: str, arguments: Dict):
+            """Handle tool calls"""
+            label = name if name in tool_names else "unknown"
+            with self.stats.timer(f"tool:{label}"):
+                async with self._request_slot():
+                    return await dispatch_tool(name, arguments)
+
+        async def dispatch_tool(name: str, arguments: Dict):
+            if name == "list_patterns":
+                result = await self.list_patterns(
+                    source=arguments.get("source", "all"),
+                    tags=arguments.get("tags", []),
+                    page_size=arguments.get("page_size"),
+                    cursor=arguments.get("cursor"),
+                    compact=arguments.get("compact", False),
+                    tag_match=arguments.get("tag_match", "any"),
+                    max_tokens=arguments.get("max_tokens"),
+                )
+                return [result]
+
+            elif name == "get_pattern":
+                result = await self.get_pattern(
+                    arguments["name"],
+                    section=arguments.get("section"),
+                    start=arguments.get("start"),
+                    end=arguments.get("end"),
+                )
+                return [result]
+
+            elif name == "get_patterns":
+                result = await self.get_patterns(
+                    arguments["names"],
+                    sections=arguments.get("sections"),
+                    compact=arguments.get("compact", False),
+                )
+                return [result]
+
+            elif name == "render_pattern":
+                result = await self.render_pattern(
+                    arguments["name"],
+                    variables=arguments.get("variables"),
+                    input=arguments.get("input"),
+                    strict=arguments.get("strict", False),
+                )
+                return [result]
+
+            elif name == "search_patterns":
+                result = await self.search_patterns(
+                    arguments["query"],
+                    arguments.get("limit", 10),
+                    fuzzy=arguments.get("fuzzy", False),
+                    max_tokens=arguments.get("max_tokens"),
+                )
+                return [result]
+
+            elif name == "create_pattern":
+                result = await self.create_pattern(
+                    arguments["name"],
+                    arguments["content"],
+                    arguments.get("metadata", {}),
+                )
+                return [result]
+
+            elif name == "update_pattern":
+                result = await self.update_pattern(
+                    arguments["name"],
+                    content=arguments.get("content"),
+                    metadata=arguments.get("metadata"),
+                )
+                return [result]
+
+            elif name == "delete_pattern":
+                result = await self.delete_pattern(arguments["name"])
+                return [result]
+
+            elif name == "similar_patterns":
+                result = await self.similar_patterns(
+                    name=arguments.get("name"),
+                    text=arguments.get("text"),
+                    limit=arguments.get("limit", 10),
+                )
+                return [result]
+
+            elif name == "find_duplicates":
+                result = await self.find_duplicates(
+                    threshold=arguments.get("threshold", 0.8),
+                    name=arguments.get("name"),
+                    limit=arguments.get("limit", 50),
+                )
+                return [result]
+
+            elif name == "server_stats":
+                result = await self.server_stats(
+                    arguments.get("format", "json"), arguments.get("memory", False)
+                )
+                return [result]
+
+            else:
+                raise ValueError(f"Unknown tool: {name}")
+
+        @self.server.list_resources()
+        async def list_resources(request: mcp.types.ListResourcesRequest):
+            """List patterns as browsable resources, one page at a time"""
+            with self.stats.timer("list_resources"):
+                async with self._request_slot():
+                    await self.load_patterns()
+
+                    cursor = request.params.cursor if request.params else None
+                    names, next_cursor = self._page_names(
+                        cursor, self.resource_page_size, self._sorted_pattern_names()
+                    )
+                    resources = [
+                        Resource(
+                            uri=mcp.types.AnyUrl(f"pattern://{pattern_name}"),
+                            name=pattern_name,
+                            mimeType="text/markdown",
+                            description=f"Pattern: {pattern_name}",
+                        )
+                        for pattern_name in names
+                    ]
+
+                    return mcp.types.ListResourcesResult(
+                        resources=resources, nextCursor=next_cursor
+                    )
+
+        @self.server.read_resource()
+        async def read_resource(uri: mcp.types.AnyUrl):
+            """Read a pattern resource"""
+            with self.stats.timer("read_resource"):
+                async with self._request_slot():
+                    uri_str = str(uri)
+                    if uri_str.startswith("pattern://"):
+                        pattern_name = uri_str.replace("pattern://", "")
+                        await self.load_patterns()
+
+                        record = self._resolve(pattern_name)
+                        if record is None:
+                            raise ValueError(f"Pattern '{pattern_name}' not found")
+                        rendered = await self._rendered_pattern(record)
+
+                        return [
+                            ReadResourceContents(
+                                content=rendered["markdown"], mime_type="text/markdown"
+                            )
+                        ]
+
+                    raise ValueError(f"Unknown resource URI: {uri}")
+
+    def _root(self, name: str) -> Optional[PatternRoot]:
+        for root in self.roots:
+            if root.name == name:
+                return root
+        return None
+
+    @property
+    def write_root(self) -> Optional[PatternRoot]:
+        """The root that create, update and delete operate on"""
+        root = self._root("custom")
+        if root is not None and root.layout == "custom":
+            return root
+        for root in self.roots:
+            if root.layout == "custom":
+                return root
+        return None
+
+    @property
+    def fabric_patterns_dir(self) -> Optional[Path]:
+        root = self._root("fabric")
+        return root.path if root is not None else None
+
+    @fabric_patterns_dir.setter
+    def fabric_patterns_dir(self, path: Path):
+        root = self._root("fabric")
+        if root is None:
+            self.roots.append(PatternRoot("fabric", path, "fabric"))
+        else:
+            root.path = Path(path)
+
+    @property
+    def custom_patterns_dir(self) -> Optional[Path]:
+        root = self.write_root
+        return root.path if root is not None else None
+
+    @custom_patterns_dir.setter
+    def custom_patterns_dir(self, path: Path):
+        root = self.write_root
+        if root is None:
+            self.roots.insert(0, PatternRoot("custom", path, "custom"))
+        else:
+            root.path = Path(path)
+
+    def _root_is_fresh(self, root: PatternRoot) -> bool:
+        """Whether a root's last scan is recent enough to skip the disk"""
+        scanned = self._scanned_roots.get(root.name)
+        if scanned is None or scanned[:2] != (root.path, root.layout):
+            return False
+        if self.watcher is not None and self.watcher.running:
+            return True
+        return time.monotonic() - scanned[2] < self.refresh_interval
+
+    def _stale_roots(self) -> List[PatternRoot]:
+        return [root for root in self.roots if not self._root_is_fresh(root)]
+
+    def _catalog_is_fresh(self) -> bool:
+        """Whether every root is fresh and no removed root is still loaded"""
+        if set(self._scanned_roots) - {root.name for root in self.roots}:
+            return False
+        return not self._stale_roots()
+
+    def _pattern_roots(self) -> List[Path]:
+        return [root.path for root in self.roots]
+
+    def _winning_records(
+        self, entries: Iterable[PatternEntry]
+    ) -> Dict[str, PatternRecord]:
+        """Pick the record each name resolves to, by root precedence"""
+        rank = {root.name: i for i, root in enumerate(self.roots)}
+        patterns: Dict[str, PatternRecord] = {}
+        for _, record in entries:
+            if record.source not in rank:
+                continue
+            best = patterns.get(record.name)
+            if best is None or rank[record.source] < rank[best.source]:
+                patterns[record.name] = record
+        return patterns
+
+    def _winning_record(self, name: str) -> Optional[PatternRecord]:
+        """The record ``name`` resolves to, looking each root up directly"""
+        for root in self.roots:
+            entry = self._pattern_files.get(root.entry_key(name))
+            if entry is not None:
+                return entry[1]
+        return None
+
+    def _shadowed_sources(self, record: PatternRecord) -> List[str]:
+        """Roots holding patterns that ``record`` shadows"""
+        found = False
+        shadowed = []
+        for root in self.roots:
+            if root.name == record.source:
+                found = True
+            elif found and root.entry_key(record.name) in self._pattern_files:
+                shadowed.append(root.name)
+        return shadowed
+
+    def _resolve(self, name: str) -> Optional[PatternRecord]:
+        """Look up a pattern by name, or a specific version as ``root:name``"""
+        record = self.patterns_cache.get(name)
+        if record is not None or ":" not in name:
+            return record
+        root_name, _, bare = name.partition(":")
+        root = self._root(root_name)
+        if root is None or not bare or Path(bare).name != bare:
+            return None
+        entry = self._pattern_files.get(root.entry_key(bare))
+        return entry[1] if entry is not None else None
+
+    def _scan_fabric_dir(
+        self, root: Path
+    ) -> List[Tuple[str, Tuple[FileSignature, ...]]]:
+        """List Fabric pattern directories with the signatures of their files"""
+        found: List[Tuple[str, Tuple[FileSignature, ...]]] = []
+        try:
+            if not root.exists():
+                self.logger.debug("Fabric patterns directory not found")
+                return found
+            for pattern_dir in root.iterdir():
+                try:
+                    if not pattern_dir.is_dir():
+                        continue
+                    signature = (
+                        _file_signature(pattern_dir / "system.md"),
+                        _file_signature(pattern_dir / "user.md"),
+                    )
+                    if signature != (None, None):
+                        found.append((str(pattern_dir), signature))
+                except Exception as e:
+                    self.logger.warning(
+                        f"Failed to load Fabric pattern {pattern_dir.name}: {e}"
+                    )
+        except Exception as e:
+            self.logger.error(f"Error loading Fabric patterns: {e}")
+        return found
+
+    def _scan_custom_dir(
+        self, root: Path
+    ) -> List[Tuple[str, Tuple[FileSignature, ...]]]:
+        """List custom pattern files with the signatures of their files"""
+        found: List[Tuple[str, Tuple[FileSignature, ...]]] = []
+        try:
+            if not root.exists():
+                return found
+            for pattern_file in root.glob("*.md"):
+                signature = (
+                    _file_signature(pattern_file),
+                    _file_signature(pattern_file.with_suffix(".json")),
+                )
+                if signature[0] is not None:
+                    found.append((str(pattern_file), signature))
+        except Exception as e:
+            self.logger.error(f"Error loading custom patterns: {e}")
+        return found
+
+    def _open_pack(self, path: Path) -> PatternPack:
+        """Return the pack at ``path``, mapping it again if it was replaced.
+
+        A replaced pack is not closed: reads in flight keep their map, which
+        is released with its last reference.
+        """
+        pack = self._packs.get(str(path))
+        if pack is None or pack.signature != _file_signature(path):
+            pack = PatternPack(path)
+            self._packs[str(path)] = pack
+        return pack
+
+    def _scan_pack(
+        self, root: PatternRoot
+    ) -> List[Tuple[str, Tuple[FileSignature, ...]]]:
+        """List a root's patterns in a pack, with signatures from its header.
+
+        Each pattern is signed with the pack's mtime and inode plus its own
+        size, so replacing the pack re-reads every pattern, which only
+        costs slicing the new map.
+        """
+        found: List[Tuple[str, Tuple[FileSignature, ...]]] = []
+        try:
+            if not root.path.exists():
+                self.logger.debug(f"Pattern pack {root.path} not found")
+                return found
+            pack = self._open_pack(root.path)
+            mtime_ns, _, inode = pack.signature
+            for name, (_, parts) in pack.sections.get(root.name, {}).items():
+                size = sum(length for _, length in parts.values())
+                found.append((root.entry_key(name), ((mtime_ns, size, inode),)))
+        except Exception as e:
+            self.logger.error(f"Error loading pattern pack {root.path}: {e}")
+        return found
+
+    def _scan_root(
+        self, root: PatternRoot
+    ) -> List[Tuple[str, Tuple[FileSignature, ...]]]:
+        if root.layout == "fabric":
+            return self._scan_fabric_dir(root.path)
+        if root.layout == "pack":
+            return self._scan_pack(root)
+        return self._scan_custom_dir(root.path)
+
+    def _read_body(self, layout: str, key: str) -> Dict[str, str]:
+        """Read the prompt text of a pattern from disk or its pack"""
+        path = Path(key)
+        if layout == "pack":
+            # Pack keys are <pack>/<root>/<name>
+            pack = self._open_pack(path.parent.parent)
+            return pack.body(path.parent.name, path.name)
+        if layout != "fabric":
+            return {"content": path.read_text(encoding="utf-8")}
+
+        body = {}
+        for part in ("system", "user"):
+            try:
+                body[part] = (path / f"{part}.md").read_text(encoding="utf-8")
+            except FileNotFoundError:
+                pass
+        if not body:
+            raise FileNotFoundError(f"No system.md or user.md in {key}")
+        return body
+
+    def _read_hashed_body(self, layout: str, key: str) -> Tuple[_Body, bytes]:
+        """Read a pattern body along with a digest of its content"""
+        body = _Body(self._read_body(layout, key))
+        digest = hashlib.blake2b(digest_size=16)
+        for part, text in sorted(body.items()):
+            encoded = text.encode("utf-8")
+            digest.update(f"{part}:{len(encoded)}:".encode("ascii"))
+            digest.update(encoded)
+        return body, digest.digest()
+
+    def _read_pattern(
+        self, root: PatternRoot, key: str, signature: Tuple[FileSignature, ...]
+    ) -> Optional[Tuple[PatternRecord, Dict[str, str]]]:
+        """Read one pattern into a catalog record plus its searchable text.
+
+        Runs on the loader thread pool. The body is only used for indexing
+        and is not kept on the record.
+        """
+        path = Path(key)
+        custom = root.layout == "custom"
+        try:
+            body = self._read_body(root.layout, key)
+            metadata = {}
+            if root.layout == "pack":
+                pack = self._open_pack(root.path)
+                metadata = pack.sections[root.name][path.name][0]
+            elif custom and signature[1] is not None:
+                metadata = json.loads(
+                    path.with_suffix(".json").read_text(encoding="utf-8")
+                )
+
+            present = [file for file in signature if file is not None]
+            record = PatternRecord(
+                path.stem if custom else path.name,
+                root.name,
+                key,
+                metadata,
+                sum(file[1] for file in present),
+                max(file[0] for file in present) / 1e9,
+            )
+            content = self._format_content(record, body)
+            record.chars = len(content)
+            record.tokens = estimate_tokens(content)
+            record.composed = _INCLUDE_RE.search(content) is not None
+            return record, self._search_fields(record, body)
+        except Exception as e:
+            self.logger.warning(
+                f"Failed to load pattern {path.name} from {root.name}: {e}"
+            )
+            return None
+
+    def _read_patterns(self, batch: List[PendingRead]) -> List[LoadedPattern]:
+        loaded = []
+        for root, key, signature in batch:
+            result = self._read_pattern(root, key, signature)
+            if result is not None:
+                loaded.append((key, signature, result[0], result[1]))
+        return loaded
+
+    async def load_patterns(
+        self, force: bool = False, roots: Optional[Iterable[str]] = None
+    ):
+        """Bring the pattern cache up to date with the pattern directories.
+
+        Only files whose stat signature changed since the previous scan are
+        re-read; unchanged entries are carried over as-is. Each root is
+        skipped entirely while its last scan is younger than
+        ``refresh_interval`` seconds, unless ``force`` is set. ``roots``
+        limits the refresh to the named roots; the others are not touched.
+
+        Directory listing and file reads run on a bounded thread pool, so the
+        event loop keeps serving other requests during a rescan. Bodies read
+        during a refresh are indexed batch by batch and then dropped.
+
+        Only one refresh runs at a time, and concurrent callers share it
+        instead of queueing up scans of their own. A forced refresh only
+        joins one that started after it was requested, so it never misses a
+        change made just before the call. The new catalog is swapped in whole
+        when the refresh finishes; readers never see it half built.
+        """
+        if not force and self._catalog_is_fresh():
+            return
+
+        wanted_names = None if roots is None else frozenset(roots)
+        requested = self._refreshes_started
+        while True:
+            flight = self._refresh_flight
+            if flight is None:
+                break
+            started, flight_roots, flight_forced, future = flight
+            covers = flight_roots is None or (
+                wanted_names is not None and wanted_names <= flight_roots
+            )
+            if covers and (not force or (flight_forced and started > requested)):
+                self.stats.count("refreshes_coalesced")
+                await asyncio.shield(future)
+                return
+            # Either too narrow, or started too early to see changes this
+            # caller knows about: let it finish, then refresh again
+            with contextlib.suppress(Exception):
+                await asyncio.shield(future)
+            if not force and self._catalog_is_fresh():
+                return
+
+        self._refreshes_started += 1
+        future = asyncio.ensure_future(self._run_refresh(force, wanted_names))
+        self._refresh_flight = (self._refreshes_started, wanted_names, force, future)
+        future.add_done_callback(self._end_refresh_flight)
+        await asyncio.shield(future)
+
+    def _end_refresh_flight(self, future: "asyncio.Future[None]"):
+        if self._refresh_flight is not None and self._refresh_flight[3] is future:
+            self._refresh_flight = None
+        if not future.cancelled() and future.exception() is not None:
+            # Callers see the error; retrieving it here keeps asyncio from
+            # warning about it when every caller has gone away
+            self.logger.debug(f"Pattern refresh failed: {future.exception()}")
+
+    async def _run_refresh(self, force: bool, names: Optional[FrozenSet[str]]):
+        # Created lazily so the lock binds to the running event loop
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            wanted = self.roots
+            if names is not None:
+                wanted = [root for root in self.roots if root.name in names]
+            if not force:
+                wanted = [root for root in wanted if not self._root_is_fresh(root)]
+                if not wanted and self._catalog_is_fresh():
+                    return
+            with self.stats.timer("load_patterns"):
+                await self._refresh_patterns(wanted)
+
+    async def _refresh_patterns(self, roots: Optional[List[PatternRoot]] = None):
+        if self.persist_catalog and not self._snapshot_checked:
+            self._snapshot_checked = True
+            await self._restore_snapshot()
+
+        self.logger.debug("Refreshing patterns...")
+        loop = asyncio.get_event_loop()
+        if roots is None:
+            roots = self.roots
+        previous = self._pattern_files
+
+        # Scan the selected roots concurrently
+        scans = await asyncio.gather(
+            *(
+                loop.run_in_executor(self._executor, self._scan_root, root)
+                for root in roots
+            )
+        )
+
+        # Entries of unscanned roots are kept as they are; entries of roots
+        # that are no longer configured are dropped
+        configured = {root.name for root in self.roots}
+        rescanned = {root.name for root in roots}
+        entries: Dict[str, Optional[PatternEntry]] = {
+            key: entry
+            for key, entry in previous.items()
+            if entry[1].source in configured and entry[1].source not in rescanned
+        }
+        pending: List[PendingRead] = []
+        for root, found in zip(roots, scans, strict=True):
+            for key, signature in found:
+                cached = previous.get(key)
+                if (
+                    cached is not None
+                    and cached[0] == signature
+                    and cached[1].source == root.name
+                ):
+                    entries[key] = cached
+                else:
+                    entries[key] = None
+                    pending.append((root, key, signature))
+
+        # Changes are applied to the index, which may still be restoring
+        changed = bool(pending) or any(key not in entries for key in previous)
+        if changed and self._index_restore is not None:
+            await self._index_restore
+            if self._pattern_files is not previous:
+                # The restore failed and reset the catalog; a full reload
+                # has been scheduled in its place
+                return
+
+        # Drop cached bodies of entries that disappeared or are about to be
+        # replaced. Their index documents stay until the new version replaces
+        # them, so searches during the refresh still see every pattern.
+        for key, (_, record) in previous.items():
+            if entries.get(key, None) is None:
+                self._drop_rendered(key, record.name)
+
+        # Read new and modified patterns concurrently, in batches so a cold
+        # load does not flood the loop with thousands of futures, and index
+        # each batch as soon as it arrives
+        batch_size = self.LOAD_BATCH_SIZE
+        batches = [
+            loop.run_in_executor(
+                self._executor, self._read_patterns, pending[start : start + batch_size]
+            )
+            for start in range(0, len(pending), batch_size)
+        ]
+        indexed = files_read = bytes_read = 0
+        for next_batch in asyncio.as_completed(batches):
+            for key, signature, record, fields in await next_batch:
+                entries[key] = (signature, record)
+                self.search_index.add(key, fields)
+                if self.tfidf_index is not None:
+                    # Re-derived from the new version on next use
+                    self.tfidf_index.remove(key)
+                files_read += sum(1 for part in signature if part is not None)
+                bytes_read += record.size
+                indexed += 1
+                if indexed % self.INDEX_BATCH_SIZE == 0:
+                    await asyncio.sleep(0)
+        self.stats.count("files_read", files_read)
+        self.stats.count("bytes_read", bytes_read)
+        current = {key: entry for key, entry in entries.items() if entry is not None}
+        for key in previous:
+            if key not in current:
+                self.search_index.remove(key)
+                if self.tfidf_index is not None:
+                    self.tfidf_index.remove(key)
+
+        # New or modified entries are pending; removals shrink the map
+        if pending or len(current) != len(previous):
+            self._install_catalog(self._winning_records(current.values()))
+            self.logger.info(
+                f"Loaded {len(self.patterns_cache)} patterns total "
+                f"({len(pending)} re-read)"
+            )
+        self._pattern_files = current
+        now = time.monotonic()
+        self._scanned_roots = {
+            name: scanned
+            for name, scanned in self._scanned_roots.items()
+            if name in configured
+        }
+        for root in roots:
+            self._scanned_roots[root.name] = (root.path, root.layout, now)
+
+        if changed and self.persist_catalog:
+            self._schedule_snapshot()
+
+    def _install_catalog(self, patterns: Dict[str, PatternRecord]):
+        # Only records that were added, replaced or dropped touch the
+        # secondary indexes; unchanged ones are the same objects
+        previous = self.patterns_cache
+        for name, record in previous.items():
+            if name not in patterns:
+                self._catalog_record_changed(name, record, None)
+        for name, record in patterns.items():
+            old = previous.get(name)
+            if old is not record:
+                self._catalog_record_changed(name, old, record)
+        self.patterns_cache = patterns
+        self.catalog_generation += 1
+
+    def _catalog_record_changed(
+        self,
+        name: str,
+        old: Optional[PatternRecord],
+        new: Optional[PatternRecord],
+    ):
+        """Update the secondary indexes for one catalog entry"""
+        # Patterns including this name now resolve it to another record
+        self._invalidate_includers(name)
+        if new is not None and new.composed:
+            self._unsettled_estimates.add(new.path)
+        if old is not None:
+            self.catalog_index.remove(old)
+        if new is not None:
+            self.catalog_index.add(new)
+        if old is None:
+            self.name_index.add(name)
+        elif new is None:
+            self.name_index.remove(name)
+
+    def _set_catalog_record(self, name: str, record: Optional[PatternRecord]):
+        """Add, replace or drop one catalog entry in place.
+
+        Unlike _install_catalog this touches only the given name, keeping
+        the cached sorted name list current rather than re-sorting it.
+        """
+        old = self.patterns_cache.get(name)
+        if old is record:
+            return
+        if record is None:
+            del self.patterns_cache[name]
+        else:
+            self.patterns_cache[name] = record
+        self._catalog_record_changed(name, old, record)
+
+        sorted_names = self._sorted_names
+        self.catalog_generation += 1
+        if sorted_names is not None and sorted_names[0] == self.catalog_generation - 1:
+            names = sorted_names[1]
+            if old is None:
+                bisect.insort(names, name)
+            elif record is None:
+                del names[bisect.bisect_left(names, name)]
+            self._sorted_names = (self.catalog_generation, names)
+
+    def _sorted_pattern_names(self) -> List[str]:
+        """Pattern names in listing order, sorted once per catalog generation"""
+        if (
+            self._sorted_names is None
+            or self._sorted_names[0] != self.catalog_generation
+        ):
+            self._sorted_names = (self.catalog_generation, sorted(self.patterns_cache))
+        return self._sorted_names[1]
+
+    def _encode_cursor(self, last_name: str) -> str:
+        payload = json.dumps([self.catalog_generation, last_name])
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+    def _decode_cursor(self, cursor: str) -> str:
+        """Return the name a cursor continues after.
+
+        Raises ValueError for malformed cursors and for cursors issued before
+        the catalog last changed.
+        """
+        try:
+            generation, last_name = json.loads(base64.urlsafe_b64decode(cursor))
+        except Exception:
+            raise ValueError("Invalid cursor") from None
+        if not isinstance(last_name, str):
+            raise ValueError("Invalid cursor")
+        if generation != self.catalog_generation:
+            raise ValueError(
+                "Cursor is stale: the pattern catalog changed, restart the listing"
+            )
+        return last_name
+
+    def _page_names(
+        self,
+        cursor: Optional[str],
+        page_size: Optional[int],
+        names: List[str],
+    ) -> Tuple[List[str], Optional[str]]:
+        """Select one page of the sorted ``names``.
+
+        Returns the names and the cursor for the following page, if any.
+        """
+        start = 0
+        if cursor:
+            start = bisect.bisect_right(names, self._decode_cursor(cursor))
+        if page_size is None or start + page_size >= len(names):
+            return names[start:], None
+        page = names[start : start + page_size]
+        return page, self._encode_cursor(page[-1])
+
+    @property
+    def snapshot_path(self) -> Path:
+        """Where the catalog snapshot is saved.
+
+        That is the writable custom root when there is one. Otherwise it is
+        a file under ``~/.cache/pattern-mcp-server`` named after the
+        configured roots, so read-only pattern directories are never written.
+        """
+        root = self.write_root
+        if root is not None and os.access(root.path, os.W_OK):
+            return root.path / self.SNAPSHOT_NAME
+        roots = json.dumps(self._snapshot_roots()).encode("utf-8")
+        digest = hashlib.blake2b(roots, digest_size=8).hexdigest()
+        cache_dir = Path.home() / ".cache" / "pattern-mcp-server"
+        return cache_dir / f"catalog-{digest}.snapshot"
+
+    def _snapshot_roots(self) -> List[List[str]]:
+        return [[root.name, root.layout, str(root.path)] for root in self.roots]
+
+    def _encode_snapshot(self) -> bytes:
+        """Serialize the catalog and search index; runs on the loader pool.
+
+        The catalog and index are compressed separately so startup can load
+        the catalog without waiting for the much larger index.
+        """
+        catalog = {
+            "roots": self._snapshot_roots(),
+            "entries": [
+                [key, signature, record.to_state()]
+                for key, (signature, record) in self._pattern_files.items()
+            ],
+        }
+        catalog_blob = zlib.compress(
+            json.dumps(catalog, separators=(",", ":")).encode("utf-8"), 1
+        )
+        index_blob = zlib.compress(
+            json.dumps(self.search_index.to_state(), separators=(",", ":")).encode(
+                "utf-8"
+            ),
+            1,
+        )
+        header = self.SNAPSHOT_MAGIC + struct.pack(
+            ">IQ", self.SNAPSHOT_VERSION, len(catalog_blob)
+        )
+        return header + catalog_blob + index_blob
+
+    def _write_snapshot(self, path: Path):
+        data = self._encode_snapshot()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _read_snapshot(
+        self, path: Path
+    ) -> Optional[Tuple[Dict[str, PatternEntry], bytes]]:
+        """Load the catalog from a snapshot file and return it with the still
+        compressed index, or None when the snapshot is missing or unusable"""
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        header_size = len(self.SNAPSHOT_MAGIC) + 12
+        if data[: len(self.SNAPSHOT_MAGIC)] != self.SNAPSHOT_MAGIC:
+            self.logger.warning(f"Ignoring unrecognized catalog snapshot {path}")
+            return None
+        version, catalog_size = struct.unpack(
+            ">IQ", data[len(self.SNAPSHOT_MAGIC) : header_size]
+        )
+        if version != self.SNAPSHOT_VERSION:
+            self.logger.info(f"Ignoring catalog snapshot version {version}")
+            return None
+
+        catalog = json.loads(
+            zlib.decompress(data[header_size : header_size + catalog_size])
+        )
+        if catalog["roots"] != self._snapshot_roots():
+            self.logger.info("Ignoring catalog snapshot for other pattern roots")
+            return None
+
+        entries: Dict[str, PatternEntry] = {}
+        for key, signature, record in catalog["entries"]:
+            entries[key] = (
+                tuple(tuple(file) if file else None for file in signature),
+                PatternRecord.from_state(key, record),
+            )
+        return entries, data[header_size + catalog_size :]
+
+    def _decode_index(self, blob: bytes) -> SearchIndex:
+        return SearchIndex.from_state(json.loads(zlib.decompress(blob)))
+
+    async def _restore_snapshot(self):
+        """Seed the catalog from the snapshot so only changes are re-read.
+
+        The catalog is installed immediately; the search index is rebuilt on
+        the loader pool in the background and swapped in when ready.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            snapshot = await loop.run_in_executor(
+                self._executor, self._read_snapshot, self.snapshot_path
+            )
+        except Exception as e:
+            self.logger.warning(f"Failed to read catalog snapshot: {e}")
+            return
+        if snapshot is None:
+            return
+
+        entries, index_blob = snapshot
+        self._pattern_files = entries
+        self._install_catalog(self._winning_records(entries.values()))
+        self.logger.info(f"Restored {len(entries)} patterns from catalog snapshot")
+
+        restore = loop.run_in_executor(self._executor, self._decode_index, index_blob)
+        self._index_restore = asyncio.ensure_future(self._install_index(restore))
+
+    async def _install_index(
+        self, restore: "asyncio.Future[SearchIndex]"
+    ) -> SearchIndex:
+        try:
+            self.search_index = await restore
+        except Exception as e:
+            # Re-read everything so the index is rebuilt from the files
+            self.logger.warning(f"Failed to restore search index: {e}")
+            self._pattern_files = {}
+            self._scanned_roots = {}
+            asyncio.ensure_future(self.load_patterns(force=True))
+        self._index_restore = None
+        return self.search_index
+
+    def _schedule_snapshot(self):
+        if self._snapshot_task is None or self._snapshot_task.done():
+            self._snapshot_task = asyncio.ensure_future(self._delayed_snapshot())
+
+    async def _delayed_snapshot(self):
+        # Coalesce bursts of changes into one write
+        await asyncio.sleep(self.SNAPSHOT_DELAY)
+        await self.save_snapshot()
+
+    async def save_snapshot(self):
+        """Write the catalog and search index snapshot to disk"""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        # Holding the refresh lock keeps the index still while it is encoded
+        async with self._refresh_lock:
+            if self._index_restore is not None:
+                await self._index_restore
+            loop = asyncio.get_event_loop()
+            try:
+                await loop.run_in_executor(
+                    self._executor, self._write_snapshot, self.snapshot_path
+                )
+                self.logger.debug(f"Saved catalog snapshot to {self.snapshot_path}")
+            except Exception as e:
+                self.logger.warning(f"Failed to save catalog snapshot: {e}")
+
+    async def export_pack(self, path: Path) -> Dict[str, Any]:
+        """Write every configured root into one PatternPack file at ``path``.
+
+        Shadowed patterns are packed too, so the pack can stand in for any
+        of its roots. Returns the number of patterns per root and the size.
+        """
+        await self.load_patterns(force=True)
+        by_root: Dict[str, List[PatternRecord]] = {root.name: [] for root in self.roots}
+        for _, record in self._pattern_files.values():
+            if record.source in by_root:
+                by_root[record.source].append(record)
+        for records in by_root.values():
+            records.sort(key=lambda record: record.name)
+
+        def sections():
+            for root in self.roots:
+                read = functools.partial(self._read_body, root.layout)
+                yield root.name, (
+                    (record.name, record.metadata, read(record.path))
+                    for record in by_root[root.name]
+                )
+
+        loop = asyncio.get_event_loop()
+        size = await loop.run_in_executor(
+            self._executor, PatternPack.write, Path(path), sections()
+        )
+        counts = {name: len(records) for name, records in by_root.items()}
+        self.logger.info(
+            f"Packed {sum(counts.values())} patterns into {path} ({size} bytes)"
+        )
+        return {"path": str(path), "roots": counts, "bytes": size}
+
+    @staticmethod
+    def _search_fields(record: PatternRecord, body: Dict[str, str]) -> Dict[str, str]:
+        """Extract the searchable text of a pattern"""
+        return {
+            "name": record.name,
+            "description": str(record.metadata.get("description") or ""),
+            "tags": " ".join(_record_tags(record)),
+            "content": "\n".join(body.values()),
+        }
+
+    def _entry_signature(self, record: PatternRecord) -> Any:
+        """The content version of a record: the stat signature of its files"""
+        entry = self._pattern_files.get(record.path)
+        return entry[0] if entry is not None else None
 
-        @self.server.call_tool()
-        async def call_tool(name: str, arguments: Dict):
-            """Handle tool calls"""
+    async def _pattern_body(self, record: PatternRecord) -> Dict[str, str]:
+        """Return the prompt text of a pattern, from body_cache when possible"""
+        key = record.path
+        signature = self._entry_signature(record)
 
-            if name == "list_patterns":
-                result = await self.list_patterns(
-                    source=arguments.get("source", "all"),
-                    tags=arguments.get("tags", []),
-                )
-                return [result]
+        cached = self.body_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cast(Dict[str, str], cached[1])
 
-            elif name == "get_pattern":
-                result = await self.get_pattern(arguments["name"])
-                return [result]
+        loop = asyncio.get_event_loop()
+        root = self._root(record.source)
+        body, digest = await loop.run_in_executor(
+            self._executor,
+            self._read_hashed_body,
+            root.layout if root is not None else "custom",
+            key,
+        )
+        self.stats.count("files_read", len(body))
+        self.stats.count("bytes_read", record.size)
 
-            elif name == "search_patterns":
-                result = await self.search_patterns(
-                    arguments["query"], arguments.get("limit", 10)
-                )
-                return [result]
+        # Patterns with identical text share one body object
+        shared = self._bodies.get(digest)
+        if shared is not None:
+            self.stats.count("bodies_shared")
+            body = shared
+        else:
+            self._bodies[digest] = body
+        self.body_cache.put(key, (signature, body), record.size)
+        return body
 
-            elif name == "create_pattern":
-                result = await self.create_pattern(
-                    arguments["name"],
-                    arguments["content"],
-                    arguments.get("metadata", {}),
-                )
-                return [result]
+    @staticmethod
+    def _format_content(record: PatternRecord, body: Dict[str, str]) -> str:
+        """Render a pattern body as a single markdown document"""
+        if "content" in body:
+            return body["content"]
 
-            else:
-                raise ValueError(f"Unknown tool: {name}")
+        content = ""
+        if "system" in body:
+            content += f"# System Prompt\n\n{body['system']}\n\n"
+        if "user" in body:
+            content += f"# User Prompt\n\n{body['user']}"
+        return content
 
-        @self.server.list_resources()
-        async def list_resources():
-            """List patterns as browsable resources"""
-            resources = []
-
-            # Load all patterns
-            await self.load_patterns()
-
-            for pattern_name in self.patterns_cache:
-                resources.append(
-                    Resource(
-                        uri=mcp.types.AnyUrl(f"pattern://{pattern_name}"),
-                        name=pattern_name,
-                        mimeType="text/markdown",
-                        description=f"Pattern: {pattern_name}",
-                    )
-                )
+    def _set_includes(self, key: str, name: str, refs: FrozenSet[str]):
+        """Record the patterns the entry ``key`` includes, replacing old edges"""
+        old = self._include_graph.pop(key, None)
+        if old is not None:
+            for ref in old[1]:
+                includers = self._includers.get(ref.rpartition(":")[2])
+                if includers is not None:
+                    includers.discard(key)
+                    if not includers:
+                        del self._includers[ref.rpartition(":")[2]]
+        if refs:
+            self._include_graph[key] = (name, refs)
+            for ref in refs:
+                self._includers.setdefault(ref.rpartition(":")[2], set()).add(key)
 
-            return resources
+    def _invalidate_includers(self, name: str):
+        """Drop rendered output of every pattern that includes ``name``,
+        directly or through other includes"""
+        dropped: Set[str] = set()
+        pending = [name]
+        while pending:
+            for key in self._includers.get(pending.pop(), ()):
+                if key not in dropped:
+                    dropped.add(key)
+                    self.render_cache.pop(key)
+                    self.template_cache.pop(key)
+                    self._unsettled_estimates.add(key)
+                    pending.append(self._include_graph[key][0])
+        if dropped:
+            self._include_generation += 1
+            self.stats.count("include_invalidations", len(dropped))
 
-        @self.server.read_resource()
-        async def read_resource(uri: mcp.types.AnyUrl):
-            """Read a pattern resource"""
-            uri_str = str(uri)
-            if uri_str.startswith("pattern://"):
-                pattern_name = uri_str.replace("pattern://", "")
-                result = await self.get_pattern(pattern_name)
-
-                return [
-                    mcp.types.ReadResourceContents(
-                        type="text", text=result.content[0].text
+    def _drop_rendered(self, key: str, name: str):
+        """Forget cached output of an entry that changed or disappeared"""
+        self.body_cache.pop(key)
+        self.render_cache.pop(key)
+        self.template_cache.pop(key)
+        self._set_includes(key, name, frozenset())
+        self._invalidate_includers(name)
+
+    async def _expand_includes(
+        self,
+        record: PatternRecord,
+        markdown: str,
+        including: Tuple[PatternRecord, ...],
+    ) -> str:
+        """Replace include directives with the included patterns or sections.
+
+        Included patterns are rendered through _rendered_pattern, so each is
+        expanded once and served from render_cache afterwards. ``including``
+        is the chain of patterns being expanded, to detect cycles.
+        """
+        parts = _INCLUDE_RE.split(markdown)
+        chain = including + (record,)
+        out = [parts[0]]
+        for i in range(1, len(parts), 3):
+            ref, section = parts[i], parts[i + 1]
+            target = self._resolve(ref)
+            if target is None:
+                raise IncludeError(
+                    f"Pattern '{record.name}' includes unknown pattern '{ref}'"
+                )
+            if any(step.path == target.path for step in chain):
+                names = [step.name for step in chain] + [target.name]
+                raise IncludeError(f"Include cycle: {' -> '.join(names)}")
+
+            included = await self._rendered_pattern(target, chain)
+            text = included["markdown"]
+            if section:
+                wanted = section.strip().lstrip("#").strip().casefold()
+                for _, title, start, end in included["headings"]:
+                    if title.casefold() == wanted:
+                        text = text[start:end]
+                        break
+                else:
+                    raise IncludeError(
+                        f"Section '{section}' not found in '{ref}', "
+                        f"included by '{record.name}'"
                     )
-                ]
+            out.append(text.strip("\n"))
+            out.append(parts[i + 2])
+        return "".join(out)
 
-            raise ValueError(f"Unknown resource URI: {uri}")
+    async def _settle_estimates(self):
+        """Expand composed patterns whose size estimates are out of date.
 
-    async def load_patterns(self):
-        """Load all patterns into cache"""
-        self.logger.info("Loading patterns...")
-        self.patterns_cache.clear()
-        pattern_count = 0
+        Each expansion is cached, so this only costs anything after a
+        composed pattern or something it includes has changed.
+        """
+        for key in list(self._unsettled_estimates):
+            self._unsettled_estimates.discard(key)
+            entry = self._pattern_files.get(key)
+            if entry is None:
+                continue
+            try:
+                await self._rendered_pattern(entry[1])
+            except (IncludeError, OSError) as e:
+                # Left measuring the pattern's own text; get_pattern reports it
+                self.logger.debug(f"Cannot expand {entry[1].name}: {e}")
 
-        # Load Fabric patterns
-        try:
-            if self.fabric_patterns_dir.exists():
-                self.logger.info(
-                    f"Loading Fabric patterns from {self.fabric_patterns_dir}"
-                )
-                for pattern_dir in self.fabric_patterns_dir.iterdir():
-                    try:
-                        if pattern_dir.is_dir():
-                            system_file = pattern_dir / "system.md"
-                            user_file = pattern_dir / "user.md"
-
-                            if system_file.exists() or user_file.exists():
-                                pattern_data = {
-                                    "name": pattern_dir.name,
-                                    "source": "fabric",
-                                    "path": str(pattern_dir),
-                                }
-
-                                if system_file.exists():
-                                    pattern_data["system"] = system_file.read_text(
-                                        encoding="utf-8"
-                                    )
-
-                                if user_file.exists():
-                                    pattern_data["user"] = user_file.read_text(
-                                        encoding="utf-8"
-                                    )
-
-                                self.patterns_cache[pattern_dir.name] = pattern_data
-                                pattern_count += 1
-                    except Exception as e:
-                        self.logger.warning(
-                            f"Failed to load Fabric pattern {pattern_dir.name}: {e}"
-                        )
+    async def _rendered_pattern(
+        self, record: PatternRecord, including: Tuple[PatternRecord, ...] = ()
+    ) -> Dict[str, Any]:
+        """Return the formatted markdown, get_pattern JSON and heading table.
+
+        Results are cached per content version, so serving a hot pattern does
+        no formatting or serialization work. Include directives are expanded
+        first; a composed result stays cached until the pattern or anything
+        it includes changes.
+        """
+        key = record.path
+        signature = self._entry_signature(record)
+
+        cached = self.render_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cast(Dict[str, Any], cached[1])
+
+        markdown = self._format_content(record, await self._pattern_body(record))
+        refs = frozenset(match.group(1) for match in _INCLUDE_RE.finditer(markdown))
+        if refs or key in self._include_graph:
+            self._set_includes(key, record.name, refs)
+        generation = self._include_generation
+        if refs:
+            markdown = await self._expand_includes(record, markdown, including)
+            if self._include_generation == generation:
+                record.chars = len(markdown)
+                record.tokens = estimate_tokens(markdown)
+                self._unsettled_estimates.discard(key)
             else:
-                self.logger.info("Fabric patterns directory not found")
-        except Exception as e:
-            self.logger.error(f"Error loading Fabric patterns: {e}")
+                self._unsettled_estimates.add(key)
+        payload = json.dumps(
+            {
+                "name": record.name,
+                "source": record.source,
+                "content": markdown,
+                "content_length": len(markdown),
+                "metadata": record.metadata,
+            },
+            indent=2,
+        )
+        headings = _heading_table(markdown)
+        rendered = {"markdown": markdown, "json": payload, "headings": headings}
+        size = len(markdown) + len(payload) + sum(len(h[1]) + 64 for h in headings)
+        # Something upstream changed while expanding: serve, but do not keep
+        if self._include_generation == generation:
+            self.render_cache.put(key, (signature, rendered), size)
+        return rendered
+
+    async def list_patterns(
+        self,
+        source: str = "all",
+        tags: Optional[List[str]] = None,
+        page_size: Optional[int] = None,
+        cursor: Optional[str] = None,
+        compact: bool = False,
+        tag_match: str = "any",
+        max_tokens: Optional[int] = None,
+    ):
+        """List available patterns, optionally one page at a time.
+
+        Tags match case-insensitively; ``tag_match`` is ``"any"`` to accept
+        patterns with at least one of ``tags`` or ``"all"`` to require each.
+        ``max_tokens`` leaves out patterns estimated to be larger.
+        """
+        await self.load_patterns()
+        await self._settle_estimates()
+
+        if tag_match not in ("any", "all"):
+            return TextContent(
+                type="text",
+                text=json.dumps({"error": f"Unknown tag_match '{tag_match}'"}),
+            )
+        if page_size is not None and page_size < 1:
+            return TextContent(
+                type="text",
+                text=json.dumps({"error": "page_size must be at least 1"}),
+            )
+        selected = self.catalog_index.select(source, tags or (), tag_match)
+        if selected is None:
+            candidates = self._sorted_pattern_names()
+        else:
+            candidates = sorted(selected)
+        if max_tokens is not None:
+            cache = self.patterns_cache
+            candidates = [
+                name for name in candidates if cache[name].tokens <= max_tokens
+            ]
 
-        # Load custom patterns
         try:
-            if self.custom_patterns_dir.exists():
-                self.logger.info(
-                    f"Loading custom patterns from {self.custom_patterns_dir}"
-                )
-                for pattern_file in self.custom_patterns_dir.glob("*.md"):
-                    try:
-                        pattern_name = pattern_file.stem
+            names, next_cursor = self._page_names(cursor, page_size, candidates)
+        except ValueError as e:
+            return TextContent(type="text", text=json.dumps({"error": str(e)}))
 
-                        # Check for metadata file
-                        metadata_file = (
-                            self.custom_patterns_dir / f"{pattern_name}.json"
-                        )
-                        metadata = {}
-                        if metadata_file.exists():
-                            metadata = json.loads(
-                                metadata_file.read_text(encoding="utf-8")
-                            )
+        patterns = []
+        for name in names:
+            data = self.patterns_cache[name]
+            item = {
+                "name": name,
+                "source": data.source,
+                "description": data.metadata.get("description", ""),
+                "tags": data.metadata.get("tags", []),
+                "chars": data.chars,
+                "tokens": data.tokens,
+            }
+            shadows = self._shadowed_sources(data) if len(self.roots) > 1 else []
+            if shadows:
+                item["shadows"] = shadows
+            patterns.append(item)
 
-                        self.patterns_cache[pattern_name] = {
-                            "name": pattern_name,
-                            "source": "custom",
-                            "path": str(pattern_file),
-                            "content": pattern_file.read_text(encoding="utf-8"),
-                            "metadata": metadata,
-                        }
-                        pattern_count += 1
-                    except Exception as e:
-                        self.logger.warning(
-                            f"Failed to load custom pattern {pattern_file.name}: {e}"
-                        )
-        except Exception as e:
-            self.logger.error(f"Error loading custom patterns: {e}")
+        # ``total`` counts every match, not just the patterns on this page
+        response: Dict[str, Any] = {"patterns": patterns, "total": len(candidates)}
+        if next_cursor is not None:
+            response["next_cursor"] = next_cursor
+        return TextContent(type="text", text=_dump_json(response, compact))
 
-        self.logger.info(f"Loaded {pattern_count} patterns total")
+    def _not_found(self, name: str) -> Dict[str, Any]:
+        """Error for an unknown pattern, with the closest names if any"""
+        error: Dict[str, Any] = {"error": f"Pattern '{name}' not found"}
+        suggestions = self.name_index.suggest(name)
+        if suggestions:
+            error["error"] += f"; did you mean '{suggestions[0]}'?"
+            error["suggestions"] = suggestions
+        return error
 
-    async def list_patterns(self, source: str = "all", tags: List[str] = None):
-        """List available patterns"""
+    async def get_pattern(
+        self,
+        name: str,
+        section: Optional[str] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ):
+        """Get pattern content, or one markdown section or character range.
+
+        ``section`` names a heading (case-insensitive, leading ``#`` optional)
+        and selects everything up to the next heading of the same or higher
+        level. ``start`` and ``end`` are character offsets, applied within the
+        section if one is given. ``content_length`` always reports the length
+        of the whole pattern.
+        """
         await self.load_patterns()
 
-        patterns = []
-        for name, data in self.patterns_cache.items():
-            # Filter by source
-            if source != "all" and data["source"] != source:
-                continue
+        record = self._resolve(name)
+        if record is None:
+            return TextContent(type="text", text=json.dumps(self._not_found(name)))
 
-            # Filter by tags if provided
-            if tags:
-                pattern_tags = data.get("metadata", {}).get("tags", [])
-                if not any(tag in pattern_tags for tag in tags):
-                    continue
+        try:
+            rendered = await self._rendered_pattern(record)
+        except IncludeError as e:
+            return TextContent(type="text", text=json.dumps({"error": str(e)}))
+        except OSError as e:
+            return TextContent(
+                type="text",
+                text=json.dumps({"error": f"Failed to read pattern '{name}': {e}"}),
+            )
 
-            patterns.append(
-                {
-                    "name": name,
-                    "source": data["source"],
-                    "description": data.get("metadata", {}).get("description", ""),
-                    "tags": data.get("metadata", {}).get("tags", []),
-                }
+        if section is None and start is None and end is None:
+            return TextContent(type="text", text=rendered["json"])
+
+        markdown = rendered["markdown"]
+        response: Dict[str, Any] = {"name": name, "source": record.source}
+        low, high = 0, len(markdown)
+        if section is not None:
+            wanted = section.strip().lstrip("#").strip().casefold()
+            for _, title, section_start, section_end in rendered["headings"]:
+                if title.casefold() == wanted:
+                    low, high = section_start, section_end
+                    response["section"] = title
+                    break
+            else:
+                return TextContent(
+                    type="text",
+                    text=json.dumps(
+                        {
+                            "error": f"Section '{section}' not found in '{name}'",
+                            "sections": [h[1] for h in rendered["headings"]],
+                        }
+                    ),
+                )
+
+        # Offsets are relative to the section and clamped to it
+        span = high - low
+        first = min(max(start or 0, 0), span)
+        last = span if end is None else min(max(end, first), span)
+        response["content"] = markdown[low + first : low + last]
+        response["range"] = [low + first, low + last]
+        response["content_length"] = len(markdown)
+        return TextContent(type="text", text=json.dumps(response, indent=2))
+
+    async def get_patterns(
+        self,
+        names: List[str],
+        sections: Optional[List[str]] = None,
+        compact: bool = False,
+    ):
+        """Get several patterns at once.
+
+        All names are resolved against the same catalog, and problems are
+        reported per pattern instead of failing the whole batch. ``sections``
+        selects which parts to return: the rendered ``content``, the raw
+        Fabric ``system`` and ``user`` prompts, and ``metadata``.
+        """
+        await self.load_patterns()
+        catalog = self.patterns_cache
+        wanted = sections or ["content", "metadata"]
+
+        unknown = [
+            section for section in wanted if section not in self.PATTERN_SECTIONS
+        ]
+        if unknown:
+            return TextContent(
+                type="text",
+                text=json.dumps({"error": f"Unknown sections: {', '.join(unknown)}"}),
             )
 
+        async def fetch(name: str) -> Dict[str, Any]:
+            record = catalog.get(name) or self._resolve(name)
+            if record is None:
+                return {"name": name, **self._not_found(name)}
+
+            item: Dict[str, Any] = {"name": name, "source": record.source}
+            try:
+                if "content" in wanted:
+                    rendered = await self._rendered_pattern(record)
+                    item["content"] = rendered["markdown"]
+                if "system" in wanted or "user" in wanted:
+                    body = await self._pattern_body(record)
+                    for part in ("system", "user"):
+                        if part in wanted and part in body:
+                            item[part] = body[part]
+            except IncludeError as e:
+                return {"name": name, "error": str(e)}
+            except OSError as e:
+                return {"name": name, "error": f"Failed to read pattern '{name}': {e}"}
+            if "metadata" in wanted:
+                item["metadata"] = record.metadata
+            return item
+
+        patterns = await asyncio.gather(*(fetch(name) for name in names))
+        found = sum(1 for item in patterns if "error" not in item)
         return TextContent(
             type="text",
-            text=json.dumps({"patterns": patterns, "total": len(patterns)}, indent=2),
+            text=_dump_json(
+                {
+                    "patterns": patterns,
+                    "found": found,
+                    "missing": len(patterns) - found,
+                },
+                compact,
+            ),
         )
 
-    async def get_pattern(self, name: str):
-        """Get pattern content"""
+    async def _compiled_template(self, record: PatternRecord) -> PromptTemplate:
+        """Return the pattern compiled for render_pattern, cached per version"""
+        key = record.path
+        signature = self._entry_signature(record)
+
+        cached = self.template_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cast(PromptTemplate, cached[1])
+
+        generation = self._include_generation
+        rendered = await self._rendered_pattern(record)
+        template = PromptTemplate(rendered["markdown"])
+        if self._include_generation == generation:
+            self.template_cache.put(key, (signature, template), template.size)
+        return template
+
+    async def render_pattern(
+        self,
+        name: str,
+        variables: Optional[Dict[str, Any]] = None,
+        input: Optional[str] = None,
+        strict: bool = False,
+    ):
+        """Fill a pattern's ``{{variable}}`` placeholders and return the prompt.
+
+        ``input`` fills ``{{input}}``; a pattern without that placeholder gets
+        the input appended after it, as Fabric does. Unfilled placeholders
+        are kept and listed under ``missing``, or are an error with
+        ``strict``.
+        """
         await self.load_patterns()
 
-        if name not in self.patterns_cache:
+        record = self._resolve(name)
+        if record is None:
+            return TextContent(type="text", text=json.dumps(self._not_found(name)))
+        try:
+            template = await self._compiled_template(record)
+        except IncludeError as e:
+            return TextContent(type="text", text=json.dumps({"error": str(e)}))
+        except OSError as e:
             return TextContent(
-                type="text", text=json.dumps({"error": f"Pattern '{name}' not found"})
+                type="text",
+                text=json.dumps({"error": f"Failed to read pattern '{name}': {e}"}),
             )
 
-        pattern = self.patterns_cache[name]
-
-        # Format content based on pattern type
-        if pattern["source"] == "fabric":
-            content = ""
-            if "system" in pattern:
-                content += f"# System Prompt\n\n{pattern['system']}\n\n"
-            if "user" in pattern:
-                content += f"# User Prompt\n\n{pattern['user']}"
-        else:
-            content = pattern["content"]
+        values = {key: str(value) for key, value in (variables or {}).items()}
+        if input is not None:
+            values["input"] = input
+        content, missing = template.render(values)
+        if strict and missing:
+            return TextContent(
+                type="text",
+                text=json.dumps(
+                    {
+                        "error": f"Missing variables for '{name}': {', '.join(missing)}",
+                        "missing": missing,
+                    }
+                ),
+            )
+        if "input" in values and "input" not in template.variables:
+            content = f"{content.rstrip()}\n\n{values['input']}"
 
         return TextContent(
             type="text",
             text=json.dumps(
                 {
-                    "name": name,
-                    "source": pattern["source"],
+                    "name": record.name,
+                    "source": record.source,
                     "content": content,
-                    "metadata": pattern.get("metadata", {}),
+                    "content_length": len(content),
+                    "variables": sorted(template.variables),
+                    "missing": missing,
                 },
                 indent=2,
             ),
         )
 
-    async def search_patterns(self, query: str, limit: int = 10):
-        """Search patterns by content"""
+    @staticmethod
+    def _search_result(data: PatternRecord, score: float) -> Dict[str, Any]:
+        return {
+            "name": data.name,
+            "source": data.source,
+            "score": round(score, 4),
+            "description": data.metadata.get("description", ""),
+            "chars": data.chars,
+            "tokens": data.tokens,
+        }
+
+    async def search_patterns(
+        self,
+        query: str,
+        limit: int = 10,
+        fuzzy: bool = False,
+        max_tokens: Optional[int] = None,
+    ):
+        """Search patterns by content, ranked with BM25.
+
+        With ``fuzzy`` the query is instead matched against pattern names by
+        trigram similarity, which tolerates misspellings. ``max_tokens``
+        leaves out patterns estimated to be larger, before ``limit`` applies.
+        """
         await self.load_patterns()
+        await self._settle_estimates()
 
-        results = []
-        query_lower = query.lower()
+        def within_budget(data: PatternRecord) -> bool:
+            return max_tokens is None or data.tokens <= max_tokens
 
-        for name, data in self.patterns_cache.items():
-            score = 0
+        if fuzzy:
+            cache = self.patterns_cache
 
-            # Check name
-            if query_lower in name.lower():
-                score += 10
+            def name_within_budget(name: str) -> bool:
+                return within_budget(cache[name])
 
-            # Check content
-            content = ""
-            if data["source"] == "fabric":
-                content = data.get("system", "") + data.get("user", "")
-            else:
-                content = data.get("content", "")
+            results = [
+                self._search_result(cache[name], similarity)
+                for name, similarity in self.name_index.search(
+                    query,
+                    limit,
+                    accept=None if max_tokens is None else name_within_budget,
+                )
+            ]
+            return TextContent(
+                type="text",
+                text=json.dumps({"results": results, "total": len(results)}, indent=2),
+            )
+
+        if self._index_restore is not None:
+            await self._index_restore
+
+        def is_current(key: str) -> bool:
+            # Skip shadowed entries and ones indexed while a refresh is still
+            # in progress
+            entry = self._pattern_files.get(key)
+            return (
+                entry is not None and self.patterns_cache.get(entry[1].name) is entry[1]
+            )
 
-            if query_lower in content.lower():
-                score += 5
+        def accept(key: str) -> bool:
+            return is_current(key) and within_budget(self._pattern_files[key][1])
 
-            # Check metadata
-            if data.get("metadata"):
-                desc = data["metadata"].get("description", "").lower()
-                if query_lower in desc:
-                    score += 3
+        results = [
+            self._search_result(self._pattern_files[key][1], score)
+            for key, score in self.search_index.search(query, limit, accept=accept)
+        ]
 
-                tags = data["metadata"].get("tags", [])
-                if any(query_lower in tag.lower() for tag in tags):
-                    score += 2
+        return TextContent(
+            type="text",
+            text=json.dumps({"results": results, "total": len(results)}, indent=2),
+        )
 
-            if score > 0:
-                results.append(
+    async def _sync_tfidf(self) -> TfidfIndex:
+        """Bring the TF-IDF vectors up to date with the search index"""
+        index = self.search_index
+        if self.tfidf_index is None or self._tfidf_source is not index:
+            # First use, or the index was swapped in from a snapshot. Holding
+            # the refresh lock keeps the index still while the pool reads it.
+            if self._refresh_lock is None:
+                self._refresh_lock = asyncio.Lock()
+            async with self._refresh_lock:
+                loop = asyncio.get_event_loop()
+                self.tfidf_index = await loop.run_in_executor(
+                    self._executor, TfidfIndex.from_search_index, index
+                )
+            self._tfidf_source = index
+        tfidf = self.tfidf_index
+
+        # Removals are applied as they happen, so only additions are missing
+        if len(tfidf) != len(index):
+            missing = [doc_id for doc_id in index if doc_id not in tfidf]
+            for i, doc_id in enumerate(missing, 1):
+                if doc_id in index:
+                    tfidf.add(doc_id, index.term_counts(doc_id))
+                if i % self.INDEX_BATCH_SIZE == 0:
+                    await asyncio.sleep(0)
+        return tfidf
+
+    async def similar_patterns(
+        self,
+        name: Optional[str] = None,
+        text: Optional[str] = None,
+        limit: int = 10,
+    ):
+        """Find patterns related to a pattern or free text by cosine similarity"""
+        if np is None or sparse is None:
+            return TextContent(
+                type="text",
+                text=json.dumps(
                     {
-                        "name": name,
-                        "source": data["source"],
-                        "score": score,
-                        "description": data.get("metadata", {}).get("description", ""),
+                        "error": "similar_patterns requires numpy and scipy to be installed"
                     }
-                )
+                ),
+            )
+        if (name is None) == (text is None):
+            return TextContent(
+                type="text",
+                text=json.dumps({"error": "Provide exactly one of 'name' or 'text'"}),
+            )
+
+        await self.load_patterns()
+        if self._index_restore is not None:
+            await self._index_restore
+
+        record = None
+        if name is not None:
+            record = self._resolve(name)
+            if record is None:
+                return TextContent(type="text", text=json.dumps(self._not_found(name)))
+
+        tfidf = await self._sync_tfidf()
+        # Over-fetch past shadowed entries, as search_patterns does
+        fetch = limit + len(self._pattern_files) - len(self.patterns_cache)
+        if record is not None:
+            if record.path not in tfidf:
+                # Re-read by a refresh that is still in progress
+                matches = []
+            else:
+                matches = tfidf.similar_to_doc(record.path, fetch)
+        else:
+            matches = tfidf.similar_to_text(text or "", fetch)
 
-        # Sort by score and limit
-        results.sort(key=lambda x: x["score"], reverse=True)
-        results = results[:limit]
+        results = []
+        for key, score in matches:
+            entry = self._pattern_files.get(key)
+            if entry is None or self.patterns_cache.get(entry[1].name) is not entry[1]:
+                continue
+            if record is not None and entry[1].name == record.name:
+                continue
+            results.append(self._search_result(entry[1], score))
+            if len(results) == limit:
+                break
 
         return TextContent(
             type="text",
             text=json.dumps({"results": results, "total": len(results)}, indent=2),
         )
 
-    async def create_pattern(self, name: str, content: str, metadata: Dict):
-        """Create a new custom pattern"""
-        pattern_file = self.custom_patterns_dir / f"{name}.md"
+    def _minhash_signatures(
+        self, batch: List[Tuple[str, str, PatternRecord]]
+    ) -> List[Tuple[str, Any]]:
+        """Read patterns and compute their MinHash signatures, off the loop"""
+        assert self.minhash_index is not None
+        signatures = []
+        for layout, key, record in batch:
+            try:
+                body = self._read_body(layout, key)
+            except OSError as e:
+                self.logger.warning(f"Failed to read pattern {record.name}: {e}")
+                continue
+            content = self._format_content(record, body)
+            signatures.append((key, self.minhash_index.signature(content)))
+        return signatures
+
+    async def _sync_minhash(self) -> MinHashIndex:
+        """Bring the MinHash index up to date with the catalog.
+
+        Only patterns added or changed since the last call are read and
+        hashed, in batches on the loader pool; removed ones are dropped.
+        """
+        if self.minhash_index is None:
+            self.minhash_index = MinHashIndex()
+        index = self.minhash_index
+        versions = self._minhash_versions
+
+        current: Dict[str, Tuple[Any, PatternRecord]] = {
+            record.path: (self._entry_signature(record), record)
+            for record in self.patterns_cache.values()
+        }
+        for key in [key for key in versions if key not in current]:
+            del versions[key]
+            index.remove(key)
+
+        pending = []
+        for key, (version, record) in current.items():
+            if key not in versions or versions[key] != version:
+                root = self._root(record.source)
+                layout = root.layout if root is not None else "custom"
+                pending.append((layout, key, record))
+
+        loop = asyncio.get_event_loop()
+        batch_size = self.LOAD_BATCH_SIZE
+        batches = [
+            loop.run_in_executor(
+                self._executor,
+                self._minhash_signatures,
+                pending[start : start + batch_size],
+            )
+            for start in range(0, len(pending), batch_size)
+        ]
+        for next_batch in asyncio.as_completed(batches):
+            for key, signature in await next_batch:
+                versions[key] = current[key][0]
+                if signature is None:
+                    index.remove(key)
+                else:
+                    index.add(key, signature)
+        self.stats.count("minhash_signatures", len(pending))
+        return index
+
+    async def find_duplicates(
+        self,
+        threshold: float = 0.8,
+        name: Optional[str] = None,
+        limit: int = 50,
+    ):
+        """Find pairs of near-identical patterns by MinHash similarity.
 
-        if pattern_file.exists():
+        Candidate pairs come from LSH buckets rather than comparing every
+        pair. With ``name`` only that pattern's duplicates are reported.
+        """
+        if np is None:
+            return TextContent(
+                type="text",
+                text=json.dumps(
+                    {"error": "find_duplicates requires numpy to be installed"}
+                ),
+            )
+        if not 0.0 < threshold <= 1.0:
             return TextContent(
                 type="text",
-                text=json.dumps({"error": f"Pattern '{name}' already exists"}),
+                text=json.dumps({"error": "threshold must be in (0, 1]"}),
+            )
+        if limit < 1:
+            return TextContent(
+                type="text", text=json.dumps({"error": "limit must be at least 1"})
             )
 
-        # Save pattern content
-        pattern_file.write_text(content)
+        await self.load_patterns()
+        record = None
+        if name is not None:
+            record = self._resolve(name)
+            if record is None:
+                return TextContent(type="text", text=json.dumps(self._not_found(name)))
 
-        # Save metadata if provided
-        if metadata:
-            metadata_file = self.custom_patterns_dir / f"{name}.json"
-            metadata_file.write_text(json.dumps(metadata, indent=2))
+        index = await self._sync_minhash()
+        if record is None:
+            pairs = index.pairs(threshold)
+        elif record.path in index:
+            pairs = index.duplicates_of(record.path, threshold)
+        else:
+            # Shadowed, or has no words to compare
+            pairs = []
 
-        # Reload cache
-        await self.load_patterns()
+        results: List[Dict[str, Any]] = []
+        total = 0
+        for a, b, similarity in pairs:
+            first_entry = self._pattern_files.get(a)
+            second_entry = self._pattern_files.get(b)
+            if first_entry is None or second_entry is None:
+                # Removed by a refresh while signatures were being computed
+                continue
+            total += 1
+            if len(results) == limit:
+                continue
+            first, second = first_entry[1], second_entry[1]
+            results.append(
+                {
+                    "patterns": [first.name, second.name],
+                    "sources": [first.source, second.source],
+                    "similarity": round(similarity, 4),
+                }
+            )
+
+        return TextContent(
+            type="text",
+            text=json.dumps(
+                {"duplicates": results, "total": total, "compared": len(index)},
+                indent=2,
+            ),
+        )
+
+    def _custom_pattern_file(self, name: str) -> Path:
+        """Path of a custom pattern's markdown file; rejects unsafe names"""
+        if not name or name.startswith(".") or ":" in name or Path(name).name != name:
+            raise ValueError(f"Invalid pattern name '{name}'")
+        if self.custom_patterns_dir is None:
+            raise ValueError("No writable pattern root is configured")
+        return self.custom_patterns_dir / f"{name}.md"
+
+    def _name_lock(self, name: str) -> asyncio.Lock:
+        lock = self._name_locks.get(name)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._name_locks[name] = lock
+        return lock
+
+    def _write_custom_pattern(
+        self,
+        pattern_file: Path,
+        content: Optional[str],
+        metadata: Optional[Dict],
+    ) -> Optional[LoadedPattern]:
+        """Write a custom pattern's files and read back its catalog entry.
+
+        Runs on the loader pool. ``None`` leaves a file as it is; empty
+        metadata removes the .json file. Metadata is written before the
+        markdown so a scan never sees a new pattern without its metadata.
+        """
+        metadata_file = pattern_file.with_suffix(".json")
+        if metadata is not None:
+            if metadata:
+                _write_atomic(metadata_file, json.dumps(metadata, indent=2))
+            else:
+                metadata_file.unlink(missing_ok=True)
+        if content is not None:
+            _write_atomic(pattern_file, content)
+
+        key = str(pattern_file)
+        signature = (_file_signature(pattern_file), _file_signature(metadata_file))
+        root = self.write_root
+        assert root is not None
+        loaded = self._read_pattern(root, key, signature)
+        if loaded is None:
+            return None
+        return (key, signature, loaded[0], loaded[1])
+
+    async def _apply_custom_change(
+        self, name: str, key: str, loaded: Optional[LoadedPattern]
+    ):
+        """Apply one custom pattern's new state to the catalog and indexes.
+
+        Only the entry itself is touched, so a write costs the same no
+        matter how many patterns are loaded. ``loaded`` is None when the
+        pattern was deleted.
+        """
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            if self._index_restore is not None:
+                await self._index_restore
+
+            if self._pattern_files.pop(key, None) is not None:
+                self.search_index.remove(key)
+                if self.tfidf_index is not None:
+                    self.tfidf_index.remove(key)
+                self._drop_rendered(key, name)
+
+            if loaded is not None:
+                _, signature, record, fields = loaded
+                self._pattern_files[key] = (signature, record)
+                self.search_index.add(key, fields)
+            # The name may resolve to another root's pattern: one this pattern
+            # stopped shadowing, or one that takes precedence over it
+            self._set_catalog_record(name, self._winning_record(name))
+
+            if self.persist_catalog:
+                self._schedule_snapshot()
+
+    async def create_pattern(self, name: str, content: str, metadata: Dict):
+        """Create a new custom pattern"""
+        try:
+            pattern_file = self._custom_pattern_file(name)
+        except ValueError as e:
+            return TextContent(type="text", text=json.dumps({"error": str(e)}))
+
+        async with self._name_lock(name):
+            if pattern_file.exists():
+                return TextContent(
+                    type="text",
+                    text=json.dumps({"error": f"Pattern '{name}' already exists"}),
+                )
+
+            loop = asyncio.get_event_loop()
+            loaded = await loop.run_in_executor(
+                self._executor,
+                self._write_custom_pattern,
+                pattern_file,
+                content,
+                metadata or None,
+            )
+            await self._apply_custom_change(name, str(pattern_file), loaded)
 
         return TextContent(
             type="text",
@@ -432,17 +3846,384 @@ class PatternServer:
             ),
         )
 
-    async def run(self):
-        """Run the MCP server"""
-        async with mcp.stdio_server() as (read_stream, write_stream):
-            await self.server.run(
-                read_stream, write_stream, self.server.create_initialization_options()
+    async def update_pattern(
+        self,
+        name: str,
+        content: Optional[str] = None,
+        metadata: Optional[Dict] = None,
+    ):
+        """Replace the content and/or metadata of a custom pattern"""
+        try:
+            pattern_file = self._custom_pattern_file(name)
+        except ValueError as e:
+            return TextContent(type="text", text=json.dumps({"error": str(e)}))
+        if content is None and metadata is None:
+            return TextContent(
+                type="text",
+                text=json.dumps({"error": "Nothing to update"}),
+            )
+
+        async with self._name_lock(name):
+            if not pattern_file.exists():
+                return TextContent(
+                    type="text",
+                    text=json.dumps({"error": f"Custom pattern '{name}' not found"}),
+                )
+
+            loop = asyncio.get_event_loop()
+            loaded = await loop.run_in_executor(
+                self._executor,
+                self._write_custom_pattern,
+                pattern_file,
+                content,
+                metadata,
+            )
+            await self._apply_custom_change(name, str(pattern_file), loaded)
+
+        return TextContent(
+            type="text",
+            text=json.dumps(
+                {
+                    "message": f"Pattern '{name}' updated successfully",
+                    "path": str(pattern_file),
+                }
+            ),
+        )
+
+    async def delete_pattern(self, name: str):
+        """Delete a custom pattern and its metadata"""
+        try:
+            pattern_file = self._custom_pattern_file(name)
+        except ValueError as e:
+            return TextContent(type="text", text=json.dumps({"error": str(e)}))
+
+        async with self._name_lock(name):
+            try:
+                # The markdown goes first; without it the pattern is gone
+                pattern_file.unlink()
+            except FileNotFoundError:
+                return TextContent(
+                    type="text",
+                    text=json.dumps({"error": f"Custom pattern '{name}' not found"}),
+                )
+            pattern_file.with_suffix(".json").unlink(missing_ok=True)
+            await self._apply_custom_change(name, str(pattern_file), None)
+
+        return TextContent(
+            type="text",
+            text=json.dumps({"message": f"Pattern '{name}' deleted successfully"}),
+        )
+
+    def _cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        caches = {}
+        for label, cache in (
+            ("body", self.body_cache),
+            ("render", self.render_cache),
+            ("template", self.template_cache),
+        ):
+            lookups = cache.hits + cache.misses
+            caches[label] = {
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "hit_ratio": round(cache.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(cache),
+                "bytes": cache.total_bytes,
+            }
+        return caches
+
+    def memory_report(self) -> Dict[str, Any]:
+        """Estimate the memory held by the catalog and cached bodies.
+
+        Walks every record, so it costs time in proportion to the catalog
+        size; it is only computed on request.
+        """
+        seen: Set[int] = set()
+        records = [record for _, record in self._pattern_files.values()]
+        record_bytes = sum(sys.getsizeof(record) for record in records)
+        string_bytes = sum(
+            _deep_sizeof(text, seen)
+            for record in records
+            for text in (record.name, record.source, record.path)
+        )
+        metadata_bytes = sum(_deep_sizeof(record.metadata, seen) for record in records)
+        signature_bytes = sum(
+            _deep_sizeof(signature, seen)
+            for signature, _ in self._pattern_files.values()
+        )
+        catalog_bytes = record_bytes + string_bytes + metadata_bytes + signature_bytes
+
+        bodies = [body for _, body in self.body_cache.values()]
+        distinct = {id(body): body for body in bodies}
+        body_seen: Set[int] = set()
+        tags = {id(tag) for record in records for tag in _record_tags(record)}
+        return {
+            "catalog": {
+                "entries": len(records),
+                "record_bytes": record_bytes,
+                "string_bytes": string_bytes,
+                "metadata_bytes": metadata_bytes,
+                "signature_bytes": signature_bytes,
+                "total_bytes": catalog_bytes,
+                "bytes_per_entry": (
+                    round(catalog_bytes / len(records), 1) if records else 0.0
+                ),
+            },
+            "interned": {
+                "sources": len({id(record.source) for record in records}),
+                "tag_strings": len(tags),
+            },
+            "bodies": {
+                "cached": len(bodies),
+                "distinct": len(distinct),
+                "charged_bytes": self.body_cache.total_bytes,
+                "resident_bytes": sum(
+                    _deep_sizeof(body, body_seen) for body in distinct.values()
+                ),
+            },
+        }
+
+    def stats_report(self) -> Dict[str, Any]:
+        """Collect server stats together with cache and catalog figures"""
+        report = self.stats.report()
+        report["caches"] = self._cache_stats()
+        report["catalog"] = {
+            "patterns": len(self.patterns_cache),
+            "entries": len(self._pattern_files),
+            "generation": self.catalog_generation,
+        }
+        return report
+
+    def stats_prometheus(self) -> str:
+        counters = {}
+        gauges: Dict[str, float] = {
+            "patterns": len(self.patterns_cache),
+            "uptime_seconds": round(time.time() - self.stats.started, 3),
+        }
+        for label, cache in self._cache_stats().items():
+            counters[f"{label}_cache_hits"] = cache["hits"]
+            counters[f"{label}_cache_misses"] = cache["misses"]
+            gauges[f"{label}_cache_bytes"] = cache["bytes"]
+        return self.stats.to_prometheus(counters, gauges)
+
+    def write_stats_file(self):
+        """Atomically replace ``stats_file`` with the current stats"""
+        if self.stats_file is None:
+            return
+        tmp = self.stats_file.with_name(self.stats_file.name + ".tmp")
+        tmp.write_text(self.stats_prometheus(), encoding="utf-8")
+        os.replace(tmp, self.stats_file)
+
+    async def _stats_file_loop(self):
+        while True:
+            await asyncio.sleep(self.STATS_FILE_INTERVAL)
+            try:
+                self.write_stats_file()
+            except OSError as e:
+                self.logger.warning(f"Failed to write stats file: {e}")
+
+    async def server_stats(self, format: str = "json", memory: bool = False):
+        """Report handler latencies, I/O counters and cache hit ratios.
+
+        With ``memory`` the JSON report also estimates the memory held by
+        the catalog and body cache.
+        """
+        if format == "prometheus":
+            return TextContent(type="text", text=self.stats_prometheus())
+        if format != "json":
+            return TextContent(
+                type="text",
+                text=json.dumps({"error": f"Unknown stats format '{format}'"}),
             )
+        report = self.stats_report()
+        if memory:
+            report["memory"] = self.memory_report()
+        return TextContent(type="text", text=json.dumps(report, indent=2))
+
+    @contextlib.asynccontextmanager
+    async def _request_slot(self):
+        """Hold one of ``max_concurrency`` request slots, if limited"""
+        if self.max_concurrency is None:
+            yield
+            return
+        if self._request_semaphore is None:
+            self._request_semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._request_semaphore.locked():
+            self.stats.count("requests_queued")
+        async with self._request_semaphore:
+            yield
+
+    @contextlib.asynccontextmanager
+    async def _serving(self, warm: bool = False):
+        """Start background services for the lifetime of a transport.
+
+        With ``warm`` the catalog is loaded in the background right away, so
+        the first client does not pay for the cold load.
+        """
+        if self.watcher is not None:
+            await self.watcher.start()
+        stats_task = None
+        if self.stats_file is not None and self.stats.enabled:
+            stats_task = asyncio.ensure_future(self._stats_file_loop())
+        warm_task = asyncio.ensure_future(self.load_patterns()) if warm else None
+        try:
+            yield
+        finally:
+            if warm_task is not None and not warm_task.done():
+                warm_task.cancel()
+            if self.watcher is not None:
+                await self.watcher.stop()
+            if stats_task is not None:
+                stats_task.cancel()
+                try:
+                    self.write_stats_file()
+                except OSError as e:
+                    self.logger.warning(f"Failed to write stats file: {e}")
+            if self._snapshot_task is not None and not self._snapshot_task.done():
+                self._snapshot_task.cancel()
+                await self.save_snapshot()
+
+    async def run(self):
+        """Run the MCP server over stdio"""
+        async with self._serving():
+            async with mcp.stdio_server() as (read_stream, write_stream):
+                await self.server.run(
+                    read_stream,
+                    write_stream,
+                    self.server.create_initialization_options(),
+                )
+
+    def http_app(self, path: str = "/mcp", stateless: bool = False) -> Any:
+        """Build an ASGI app serving MCP over streamable HTTP at ``path``.
+
+        Every client session is handled by this one PatternServer, so all of
+        them share the same warm catalog, indexes and caches.
+        """
+        from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+
+        manager = StreamableHTTPSessionManager(app=self.server, stateless=stateless)
+
+        class Endpoint:
+            # Starlette passes raw ASGI calls to endpoints that are not functions
+            async def __call__(self, scope, receive, send):
+                await manager.handle_request(scope, receive, send)
+
+        @contextlib.asynccontextmanager
+        async def lifespan(app):
+            async with manager.run():
+                async with self._serving(warm=True):
+                    yield
+
+        return Starlette(routes=[Route(path, endpoint=Endpoint())], lifespan=lifespan)
+
+    async def run_http(self, host: str = "127.0.0.1", port: int = 8000):
+        """Run the MCP server over streamable HTTP for many concurrent clients"""
+        import uvicorn
+
+        config = uvicorn.Config(
+            self.http_app(), host=host, port=port, log_level="warning"
+        )
+        self.logger.info(f"Serving MCP over HTTP at http://{host}:{port}/mcp")
+        await uvicorn.Server(config).serve()
+
+
+def _positive_int(value: str) -> int:
+    """argparse type for options that need a count of one or more"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'") from None
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pattern Content MCP Server")
+    parser.add_argument("--log-level", default="INFO", help="Logging level")
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep the pattern cache current with a background filesystem watcher",
+    )
+    parser.add_argument(
+        "--no-stats",
+        action="store_true",
+        help="Disable latency and I/O instrumentation",
+    )
+    parser.add_argument(
+        "--stats-file",
+        type=Path,
+        help="Periodically write stats here in Prometheus text format",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=["stdio", "http"],
+        default="stdio",
+        help="Serve one client over stdio, or many over streamable HTTP",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="HTTP bind address")
+    parser.add_argument("--port", type=int, default=8000, help="HTTP port")
+    parser.add_argument(
+        "--root",
+        action="append",
+        metavar="NAME[:LAYOUT]=PATH",
+        help=(
+            "Pattern root, highest precedence first; repeat for more roots. "
+            "LAYOUT is 'fabric' or 'custom' (default: 'fabric' for a root "
+            "named fabric). Defaults to $PATTERN_ROOTS, a comma-separated "
+            "list of the same form, or the custom and Fabric directories "
+            "under ~/.config"
+        ),
+    )
+    parser.add_argument(
+        "--pack",
+        type=Path,
+        metavar="PATH",
+        help=(
+            "Serve the roots packed in this file from a memory map instead of "
+            "their directories; the writable custom root stays on disk"
+        ),
+    )
+    parser.add_argument(
+        "--export-pack",
+        type=Path,
+        metavar="PATH",
+        help="Pack every pattern root into PATH for use with --pack, then exit",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=_positive_int,
+        help="Maximum number of requests handled at once (default: unlimited)",
+    )
+    return parser.parse_args(argv)
 
 
 async def main():
-    server = PatternServer()
-    await server.run()
+    args = parse_args()
+    specs = args.root
+    if not specs and os.environ.get("PATTERN_ROOTS"):
+        specs = [spec for spec in os.environ["PATTERN_ROOTS"].split(",") if spec]
+    roots = parse_pattern_roots(specs) if specs else default_pattern_roots()
+    if args.pack and not args.export_pack:
+        roots = packed_roots(roots, args.pack)
+    server = PatternServer(
+        log_level=args.log_level,
+        watch=args.watch,
+        enable_stats=not args.no_stats,
+        stats_file=args.stats_file,
+        max_concurrency=args.max_concurrency,
+        roots=roots,
+    )
+    if args.export_pack:
+        summary = await server.export_pack(args.export_pack)
+        print(json.dumps(summary, indent=2))
+        return
+    if args.transport == "http":
+        await server.run_http(args.host, args.port)
+    else:
+        await server.run()
 
 
 if __name__ == "__main__":
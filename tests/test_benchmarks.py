@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Tests for the benchmark harness
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_patterns import generate_corpus, main, percentiles
+
+
+def test_generate_corpus(tmp_path):
+    """Test that the generator writes Fabric and custom patterns"""
+    dirs = generate_corpus(tmp_path, fabric_count=3, custom_count=2)
+
+    fabric = sorted(path.name for path in dirs["fabric"].iterdir())
+    assert len(fabric) == 3
+    assert (dirs["fabric"] / fabric[0] / "system.md").exists()
+    assert len(list(dirs["custom"].glob("*.md"))) == 2
+    metadata = json.loads(next(dirs["custom"].glob("*.json")).read_text())
+    assert metadata["tags"]
+
+
+def test_percentiles():
+    """Test latency summaries"""
+    summary = percentiles([0.001 * i for i in range(1, 101)])
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == 51.0
+    assert summary["max_ms"] == 100.0
+
+
+def test_benchmark_smoke(tmp_path, capsys, monkeypatch):
+    """Test a tiny end-to-end benchmark run"""
+    home = tmp_path / "home"
+    monkeypatch.setattr(Path, "home", lambda: home)
+    output = tmp_path / "results.json"
+    report = main(["--patterns", "20", "--iterations", "10", "--output", str(output)])
+
+    assert report["results"]["patterns"] == 20
+    assert json.loads(output.read_text()) == report
+    assert report["results"]["search_patterns"]["count"] == 10
+    # Only the generated corpus is touched, never the user's pattern roots
+    assert not home.exists()
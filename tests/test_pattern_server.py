@@ -3,19 +3,46 @@
 Tests for Pattern MCP Server
 """
 
+import asyncio
 import json
 import os
 import sys
+import threading
+import time
 from pathlib import Path
+from typing import Any, List
 
 import pytest
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from mcp.types import TextContent
+from mcp.types import (
+    AnyUrl,
+    CallToolRequest,
+    CallToolRequestParams,
+    ListResourcesRequest,
+    PaginatedRequestParams,
+    ReadResourceRequest,
+    ReadResourceRequestParams,
+    TextContent,
+)
 
-from pattern_mcp_server import PatternServer
+from pattern_mcp_server import (
+    ByteLRUCache,
+    PatternPack,
+    PatternRoot,
+    PatternServer,
+    PatternWatcher,
+    PromptTemplate,
+    SearchIndex,
+    ServerStats,
+    TrigramIndex,
+    estimate_tokens,
+    packed_roots,
+    parse_args,
+    parse_pattern_roots,
+)
 
 
 @pytest.fixture
@@ -56,6 +83,29 @@ def mock_patterns_dir(tmp_path):
     return tmp_path
 
 
+@pytest.fixture
+def make_server(mock_patterns_dir):
+    """Factory for servers over the mock pattern directories.
+
+    Keyword arguments are passed to PatternServer; ``refresh_interval``
+    defaults to 0 and ``roots`` to the mock custom and Fabric directories.
+    """
+    config = mock_patterns_dir / ".config"
+
+    def make(**kwargs: Any) -> PatternServer:
+        kwargs.setdefault("refresh_interval", 0)
+        kwargs.setdefault(
+            "roots",
+            [
+                PatternRoot("custom", config / "custom_patterns"),
+                PatternRoot("fabric", config / "fabric" / "patterns"),
+            ],
+        )
+        return PatternServer(**kwargs)
+
+    return make
+
+
 class TestPatternServer:
     """Test cases for PatternServer class"""
 
@@ -89,15 +139,21 @@ class TestPatternServer:
 
         # Check fabric pattern
         fabric_pattern = pattern_server.patterns_cache["test_pattern"]
-        assert fabric_pattern["source"] == "fabric"
-        assert fabric_pattern["system"] == "System prompt content"
-        assert fabric_pattern["user"] == "User prompt content"
+        assert fabric_pattern.source == "fabric"
+        assert fabric_pattern.size == len("System prompt content") + len(
+            "User prompt content"
+        )
+        assert not hasattr(fabric_pattern, "system")
+        body = await pattern_server._pattern_body(fabric_pattern)
+        assert body["system"] == "System prompt content"
+        assert body["user"] == "User prompt content"
 
         # Check custom pattern
         custom_pattern = pattern_server.patterns_cache["custom_test"]
-        assert custom_pattern["source"] == "custom"
-        assert custom_pattern["content"] == "Custom pattern content"
-        assert custom_pattern["metadata"]["description"] == "Test custom pattern"
+        assert custom_pattern.source == "custom"
+        assert custom_pattern.metadata["description"] == "Test custom pattern"
+        body = await pattern_server._pattern_body(custom_pattern)
+        assert body["content"] == "Custom pattern content"
 
     @pytest.mark.asyncio
     async def test_list_patterns(self, pattern_server, mock_patterns_dir, monkeypatch):
@@ -218,6 +274,1665 @@ class TestPatternServer:
         assert "already exists" in data["error"]
 
 
+class TestPatternWrites:
+    """Test create, update and delete applied without a catalog reload"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server(refresh_interval=3600)
+
+    @pytest.mark.asyncio
+    async def test_writes_update_indexes_in_place(self, server, monkeypatch):
+        """Test that writes reach every index without rescanning"""
+        await server.load_patterns()
+        listing = json.loads((await server.list_patterns()).text)
+        assert listing["total"] == 2
+
+        def no_scan(root):
+            raise AssertionError("catalog was rescanned")
+
+        monkeypatch.setattr(server, "_scan_custom_dir", no_scan)
+        monkeypatch.setattr(server, "_scan_fabric_dir", no_scan)
+
+        await server.create_pattern(
+            "haiku", "Write a haiku about the input", {"tags": ["Poetry"]}
+        )
+        names = json.loads((await server.list_patterns(tags=["poetry"])).text)
+        assert [p["name"] for p in names["patterns"]] == ["haiku"]
+        assert json.loads((await server.list_patterns()).text)["total"] == 3
+        results = json.loads((await server.search_patterns("haiku")).text)
+        assert results["results"][0]["name"] == "haiku"
+
+        await server.update_pattern("haiku", content="Write a limerick instead")
+        result = json.loads((await server.get_pattern("haiku")).text)
+        assert result["content"] == "Write a limerick instead"
+        assert result["metadata"] == {"tags": ["Poetry"]}
+        results = json.loads((await server.search_patterns("limerick")).text)
+        assert [r["name"] for r in results["results"]] == ["haiku"]
+
+        await server.update_pattern("haiku", metadata={})
+        assert not (server.custom_patterns_dir / "haiku.json").exists()
+        assert "poetry" not in server.catalog_index.by_tag
+
+        await server.delete_pattern("haiku")
+        assert "haiku" not in server.patterns_cache
+        assert len(server.search_index) == len(server._pattern_files) == 2
+        result = json.loads((await server.get_pattern("haiku")).text)
+        assert "not found" in result["error"]
+        assert not list(server.custom_patterns_dir.glob(".*.tmp"))
+
+    @pytest.mark.asyncio
+    async def test_delete_unshadows_fabric_pattern(self, server):
+        """Test that deleting a custom override brings back the Fabric one"""
+        await server.load_patterns()
+        await server.create_pattern("test_pattern", "Custom override", {})
+        assert server.patterns_cache["test_pattern"].source == "custom"
+
+        await server.delete_pattern("test_pattern")
+        assert server.patterns_cache["test_pattern"].source == "fabric"
+        result = json.loads((await server.get_pattern("test_pattern")).text)
+        assert "System prompt content" in result["content"]
+
+        # A full refresh agrees with the incremental bookkeeping
+        catalog = dict(server.patterns_cache)
+        await server.load_patterns(force=True)
+        assert server.patterns_cache == catalog
+
+    @pytest.mark.asyncio
+    async def test_concurrent_writers_serialized(self, server):
+        """Test that concurrent updates to one pattern leave one entry"""
+        await server.create_pattern("shared", "version 0", {})
+        await asyncio.gather(
+            *(
+                server.update_pattern("shared", content=f"version {i}")
+                for i in range(1, 11)
+            )
+        )
+        content = (server.custom_patterns_dir / "shared.md").read_text()
+        result = json.loads((await server.get_pattern("shared")).text)
+        assert result["content"] == content
+        assert len(server.search_index) == len(server._pattern_files)
+        assert not server._name_locks
+
+    @pytest.mark.asyncio
+    async def test_invalid_and_missing_names(self, server):
+        """Test that unsafe names and unknown patterns are refused"""
+        for name in ("../escape", ".hidden", ""):
+            result = await server.create_pattern(name, "content", {})
+            assert "Invalid pattern name" in json.loads(result.text)["error"]
+
+        result = await server.update_pattern("missing", content="x")
+        assert "not found" in json.loads(result.text)["error"]
+        result = await server.delete_pattern("test_pattern")
+        assert "not found" in json.loads(result.text)["error"]
+        result = await server.update_pattern("custom_test")
+        assert "Nothing to update" in json.loads(result.text)["error"]
+
+
+class TestIncrementalCache:
+    """Test stat-based incremental refreshes of the pattern cache"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server()
+
+    @pytest.mark.asyncio
+    async def test_unchanged_files_are_not_reread(self, server, monkeypatch):
+        """Test that a warm refresh only stats files"""
+        await server.get_pattern("test_pattern")
+
+        reads = []
+        original_read_text = Path.read_text
+
+        def counting_read_text(self, *args, **kwargs):
+            reads.append(self)
+            return original_read_text(self, *args, **kwargs)
+
+        monkeypatch.setattr(Path, "read_text", counting_read_text)
+
+        result = await server.get_pattern("test_pattern")
+        assert json.loads(result.text)["name"] == "test_pattern"
+        assert reads == []
+
+    @pytest.mark.asyncio
+    async def test_changes_are_picked_up(self, server):
+        """Test that modified, added and removed patterns are reflected"""
+        await server.load_patterns()
+
+        custom_dir = server.custom_patterns_dir
+        (custom_dir / "custom_test.md").write_text("Edited custom content")
+        (custom_dir / "another.md").write_text("Another pattern")
+        (server.fabric_patterns_dir / "test_pattern" / "user.md").unlink()
+        (server.fabric_patterns_dir / "test_pattern" / "system.md").unlink()
+
+        await server.load_patterns()
+
+        assert "test_pattern" not in server.patterns_cache
+        result = await server.get_pattern("another")
+        assert json.loads(result.text)["content"] == "Another pattern"
+        result = await server.get_pattern("custom_test")
+        assert json.loads(result.text)["content"] == "Edited custom content"
+
+    @pytest.mark.asyncio
+    async def test_staleness_window(self, server):
+        """Test that the disk is not checked within the refresh interval"""
+        server.refresh_interval = 3600
+        await server.load_patterns()
+
+        (server.custom_patterns_dir / "late.md").write_text("Late pattern")
+        await server.load_patterns()
+        assert "late" not in server.patterns_cache
+
+        await server.load_patterns(force=True)
+        assert "late" in server.patterns_cache
+
+
+class TestBackgroundLoading:
+    """Test that pattern loading happens off the event loop"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server()
+
+    @pytest.mark.asyncio
+    async def test_files_read_on_thread_pool(self, server, monkeypatch):
+        """Test that pattern files are read by the loader threads"""
+        threads = []
+        original_read_pattern = server._read_pattern
+
+        def recording_read_pattern(*args):
+            threads.append(threading.current_thread().name)
+            return original_read_pattern(*args)
+
+        monkeypatch.setattr(server, "_read_pattern", recording_read_pattern)
+        await server.load_patterns()
+
+        assert len(threads) == 2
+        assert all(name.startswith("pattern-loader") for name in threads)
+
+    @pytest.mark.asyncio
+    async def test_event_loop_responsive_during_load(self, server, monkeypatch):
+        """Test that other coroutines run while a slow scan is in progress"""
+        original_read_pattern = server._read_pattern
+
+        def slow_read_pattern(*args):
+            time.sleep(0.2)
+            return original_read_pattern(*args)
+
+        monkeypatch.setattr(server, "_read_pattern", slow_read_pattern)
+        load = asyncio.ensure_future(server.load_patterns())
+
+        ticks = 0
+        while not load.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        await load
+
+        assert ticks > 5
+        assert len(server.patterns_cache) == 2
+
+
+class TestRefreshCoalescing:
+    """Test that concurrent callers share one refresh"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server(persist_catalog=False)
+
+    def slow_scans(self, server, monkeypatch):
+        scans = []
+        original = server._scan_root
+
+        def slow_scan(root):
+            scans.append(root.name)
+            time.sleep(0.05)
+            return original(root)
+
+        monkeypatch.setattr(server, "_scan_root", slow_scan)
+        return scans
+
+    @pytest.mark.asyncio
+    async def test_burst_shares_one_scan(self, server, monkeypatch):
+        """Test that a burst of requests scans each root once"""
+        scans = self.slow_scans(server, monkeypatch)
+        results = await asyncio.gather(
+            *(server.get_pattern("test_pattern") for _ in range(10))
+        )
+
+        assert sorted(scans) == ["custom", "fabric"]
+        assert all("error" not in json.loads(r.text) for r in results)
+        assert server.stats.counters["refreshes_coalesced"] == 9
+
+    @pytest.mark.asyncio
+    async def test_forced_refresh_waits_for_a_fresh_scan(self, server, monkeypatch):
+        """Test that a forced refresh does not join an earlier scan"""
+        scans = self.slow_scans(server, monkeypatch)
+        first = asyncio.ensure_future(server.load_patterns(force=True))
+        await asyncio.sleep(0.01)
+        (server.custom_patterns_dir / "late.md").write_text("Late")
+        await asyncio.gather(
+            server.load_patterns(force=True), server.load_patterns(force=True)
+        )
+        await first
+
+        assert "late" in server.patterns_cache
+        assert len(scans) == 4
+
+    @pytest.mark.asyncio
+    async def test_reads_consistent_during_refresh(self, server, monkeypatch):
+        """Test that a pattern being re-read stays searchable and listed"""
+        await server.load_patterns()
+        (server.custom_patterns_dir / "custom_test.md").write_text("Rewritten")
+        original = server._read_pattern
+
+        def slow_read(*args):
+            time.sleep(0.1)
+            return original(*args)
+
+        monkeypatch.setattr(server, "_read_pattern", slow_read)
+        refresh = asyncio.ensure_future(server.load_patterns(force=True))
+        await asyncio.sleep(0.02)
+
+        catalog = server.patterns_cache
+        result = json.loads((await server.search_patterns("custom")).text)
+        assert [r["name"] for r in result["results"]] == ["custom_test"]
+        await refresh
+        assert set(catalog) == {"custom_test", "test_pattern"}
+        assert server.patterns_cache is not catalog
+
+
+class TestLazyBodies:
+    """Test on-demand body loading through the byte-budgeted LRU"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server(body_cache_bytes=64)
+
+    def test_lru_respects_byte_budget(self):
+        """Test that least recently used values are evicted to fit the budget"""
+        cache = ByteLRUCache(10)
+        cache.put("a", "aaaa", 4)
+        cache.put("b", "bbbb", 4)
+        assert cache.get("a") == "aaaa"
+        cache.put("c", "cccc", 4)
+
+        assert "b" not in cache
+        assert cache.get("a") == "aaaa"
+        assert cache.total_bytes == 8
+
+        cache.put("huge", "x" * 11, 11)
+        assert "huge" not in cache
+        assert cache.get("huge") is None
+
+    @pytest.mark.asyncio
+    async def test_bodies_loaded_on_demand(self, server):
+        """Test that listing keeps no bodies and get_pattern caches them"""
+        await server.list_patterns()
+        assert len(server.body_cache) == 0
+
+        await server.get_pattern("test_pattern")
+        assert server.body_cache.misses == 1
+        body = await server._pattern_body(server.patterns_cache["test_pattern"])
+        assert body["system"] == "System prompt content"
+        assert server.body_cache.hits == 1
+
+        # Both bodies do not fit in 64 bytes together
+        await server.get_pattern("custom_test")
+        assert len(server.body_cache) == 1
+        assert server.body_cache.total_bytes <= 64
+
+    @pytest.mark.asyncio
+    async def test_modified_body_not_served_from_cache(self, server):
+        """Test that a cached body is dropped when its file changes"""
+        await server.get_pattern("custom_test")
+        (server.custom_patterns_dir / "custom_test.md").write_text("Changed")
+
+        result = await server.get_pattern("custom_test")
+        assert json.loads(result.text)["content"] == "Changed"
+
+
+class TestCompactRecords:
+    """Test slotted records, interned strings and shared bodies"""
+
+    @pytest.fixture
+    def server(self, make_server, mock_patterns_dir):
+        custom_dir = mock_patterns_dir / ".config" / "custom_patterns"
+        for name in ("first", "second"):
+            (custom_dir / f"{name}.md").write_text("Identical body")
+            (custom_dir / f"{name}.json").write_text(json.dumps({"tags": ["shared"]}))
+        return make_server()
+
+    @pytest.mark.asyncio
+    async def test_records_share_strings(self, server):
+        """Test that records are slotted and reuse source and tag strings"""
+        await server.load_patterns()
+        first = server.patterns_cache["first"]
+        second = server.patterns_cache["second"]
+        assert not hasattr(first, "__dict__")
+        assert first.source is second.source
+        assert first.metadata["tags"][0] is second.metadata["tags"][0]
+        assert server.patterns_cache["test_pattern"].metadata == {}
+
+    @pytest.mark.asyncio
+    async def test_identical_bodies_stored_once(self, server):
+        """Test that patterns with the same text share one cached body"""
+        await server.get_patterns(["first", "second", "custom_test"])
+        first = await server._pattern_body(server.patterns_cache["first"])
+        second = await server._pattern_body(server.patterns_cache["second"])
+        assert first is second
+        assert server.stats.counters["bodies_shared"] == 1
+
+        result = await server.server_stats(memory=True)
+        memory = json.loads(result.text)["memory"]
+        assert memory["catalog"]["entries"] == 4
+        assert memory["catalog"]["total_bytes"] > 0
+        assert memory["interned"]["sources"] == 2
+        assert memory["bodies"]["cached"] == 3
+        assert memory["bodies"]["distinct"] == 2
+        assert "memory" not in json.loads((await server.server_stats()).text)
+
+
+class TestCatalogSnapshot:
+    """Test the persistent catalog snapshot used for fast startup"""
+
+    def count_reads(self, server, monkeypatch):
+        reads = []
+        original_read_pattern = server._read_pattern
+
+        def counting_read_pattern(source, key, signature):
+            reads.append(Path(key).name)
+            return original_read_pattern(source, key, signature)
+
+        monkeypatch.setattr(server, "_read_pattern", counting_read_pattern)
+        return reads
+
+    @pytest.mark.asyncio
+    async def test_restart_reads_only_changed_patterns(self, make_server, monkeypatch):
+        """Test that a new server starts from the snapshot"""
+        first = make_server()
+        await first.load_patterns()
+        await first.save_snapshot()
+        assert first.snapshot_path.exists()
+
+        (first.custom_patterns_dir / "custom_test.md").write_text("Edited content")
+
+        second = make_server()
+        reads = self.count_reads(second, monkeypatch)
+        await second.load_patterns()
+        assert reads == ["custom_test.md"]
+        assert set(second.patterns_cache) == {"test_pattern", "custom_test"}
+
+        result = await second.search_patterns("prompt")
+        names = [r["name"] for r in json.loads(result.text)["results"]]
+        assert names == ["test_pattern"]
+        result = await second.search_patterns("edited")
+        names = [r["name"] for r in json.loads(result.text)["results"]]
+        assert names == ["custom_test"]
+
+    @pytest.mark.asyncio
+    async def test_snapshot_for_other_roots_ignored(
+        self, make_server, tmp_path, monkeypatch
+    ):
+        """Test that a snapshot is only used for the roots it was built from"""
+        first = make_server()
+        await first.load_patterns()
+        await first.save_snapshot()
+
+        second = make_server()
+        second.fabric_patterns_dir = tmp_path / "elsewhere"
+        reads = self.count_reads(second, monkeypatch)
+        await second.load_patterns()
+        assert reads == ["custom_test.md"]
+        assert set(second.patterns_cache) == {"custom_test"}
+
+    @pytest.mark.asyncio
+    async def test_snapshot_cached_without_writable_root(
+        self, make_server, mock_patterns_dir, tmp_path, monkeypatch
+    ):
+        """Test that pattern roots are left alone when none is writable"""
+        monkeypatch.setattr(Path, "home", lambda: tmp_path / "home")
+        fabric = mock_patterns_dir / ".config" / "fabric" / "patterns"
+        roots = [PatternRoot("fabric", fabric)]
+        first = make_server(roots=roots)
+        await first.load_patterns()
+        await first.save_snapshot()
+
+        cache_dir = tmp_path / "home" / ".cache" / "pattern-mcp-server"
+        assert first.snapshot_path.parent == cache_dir
+        assert first.snapshot_path.exists()
+        assert not (fabric / first.SNAPSHOT_NAME).exists()
+
+        second = make_server(roots=roots)
+        reads = self.count_reads(second, monkeypatch)
+        await second.load_patterns()
+        assert reads == []
+        assert set(second.patterns_cache) == {"test_pattern"}
+
+    @pytest.mark.asyncio
+    async def test_corrupt_snapshot_ignored(self, make_server):
+        """Test that an unreadable snapshot falls back to a full load"""
+        server = make_server()
+        server.snapshot_path.write_bytes(b"not a snapshot")
+
+        await server.load_patterns()
+        assert len(server.patterns_cache) == 2
+
+
+class TestRenderedPatterns:
+    """Test the pre-rendered response cache"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server()
+
+    @pytest.mark.asyncio
+    async def test_hot_pattern_served_from_render_cache(self, server, monkeypatch):
+        """Test that repeated gets reuse the rendered payload"""
+        first = await server.get_pattern("test_pattern")
+
+        def fail(*args):
+            raise AssertionError("pattern was re-rendered")
+
+        monkeypatch.setattr(server, "_format_content", fail)
+        second = await server.get_pattern("test_pattern")
+        assert second.text == first.text
+        assert server.render_cache.hits == 1
+
+    @pytest.mark.asyncio
+    async def test_render_cache_follows_file_changes(self, server):
+        """Test that an edited pattern is rendered again"""
+        await server.get_pattern("custom_test")
+        (server.custom_patterns_dir / "custom_test.md").write_text("Changed")
+
+        result = await server.get_pattern("custom_test")
+        assert json.loads(result.text)["content"] == "Changed"
+
+    @pytest.mark.asyncio
+    async def test_read_resource_returns_markdown(self, server):
+        """Test that resources are served as markdown, not JSON"""
+        handler = server.server.request_handlers[ReadResourceRequest]
+        request = ReadResourceRequest(
+            method="resources/read",
+            params=ReadResourceRequestParams(uri=AnyUrl("pattern://test_pattern")),
+        )
+        result = (await handler(request)).root
+        contents = result.contents[0]
+        assert contents.mimeType == "text/markdown"
+        assert contents.text.startswith("# System Prompt\n\nSystem prompt content")
+
+
+class TestPartialRetrieval:
+    """Test section and character range retrieval in get_pattern"""
+
+    BODY = (
+        "# IDENTITY and PURPOSE\n\nYou summarize.\n\n"
+        "# STEPS\n\n- Read\n\n## Details\n\n```\n# not a heading\n```\n\n"
+        "# OUTPUT INSTRUCTIONS\n\nUse bullets.\n"
+    )
+
+    @pytest.fixture
+    def server(self, make_server):
+        server = make_server()
+        (server.custom_patterns_dir / "long.md").write_text(self.BODY)
+        return server
+
+    async def get(self, server, **arguments):
+        return json.loads((await server.get_pattern("long", **arguments)).text)
+
+    @pytest.mark.asyncio
+    async def test_section_spans_subheadings(self, server):
+        """Test that a section runs to the next heading of its level"""
+        result = await self.get(server, section="# steps")
+        assert result["section"] == "STEPS"
+        assert result["content"].startswith("# STEPS\n")
+        assert "## Details" in result["content"]
+        assert "# not a heading" in result["content"]
+        assert "OUTPUT" not in result["content"]
+        assert result["content_length"] == len(self.BODY)
+
+        result = await self.get(server, section="Output Instructions")
+        assert result["content"] == "# OUTPUT INSTRUCTIONS\n\nUse bullets.\n"
+
+        result = await self.get(server, section="not a heading")
+        assert "not found" in result["error"]
+        assert result["sections"] == [
+            "IDENTITY and PURPOSE",
+            "STEPS",
+            "Details",
+            "OUTPUT INSTRUCTIONS",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_character_ranges(self, server):
+        """Test ranges over the whole pattern and within a section"""
+        result = await self.get(server, start=2, end=10)
+        assert result["content"] == self.BODY[2:10]
+        assert result["range"] == [2, 10]
+
+        result = await self.get(server, end=0)
+        assert result["content"] == ""
+        assert result["content_length"] == len(self.BODY)
+
+        result = await self.get(server, section="STEPS", start=2, end=1000)
+        steps = self.BODY.index("# STEPS")
+        assert result["content"].startswith("STEPS")
+        assert result["range"][0] == steps + 2
+        assert not result["content"].endswith("# OUTPUT INSTRUCTIONS")
+
+        full = await self.get(server)
+        assert full["content"] == self.BODY
+        assert full["content_length"] == len(self.BODY)
+
+
+class TestRenderPattern:
+    """Test template compilation and the render_pattern tool"""
+
+    @pytest.fixture
+    def server(self, make_server, mock_patterns_dir):
+        custom_dir = mock_patterns_dir / ".config" / "custom_patterns"
+        (custom_dir / "letter.md").write_text(
+            "Dear {{ recipient }},\n\n{{input}}\n\nFrom {{sender}} {{plugin:x}}"
+        )
+        return make_server()
+
+    def test_template_render(self):
+        """Test placeholder parsing, substitution and missing names"""
+        template = PromptTemplate("{{a}} and {{ b }} and {{a}} {{x:y}}")
+        assert template.variables == {"a", "b"}
+        text, missing = template.render({"a": "1"})
+        assert text == "1 and {{b}} and 1 {{x:y}}"
+        assert missing == ["b"]
+
+    @pytest.mark.asyncio
+    async def test_render_fills_variables(self, server):
+        """Test that variables and input are substituted"""
+        result = await server.render_pattern(
+            "letter", {"recipient": "Ada", "sender": "Bob"}, input="Hello"
+        )
+        data = json.loads(result.text)
+        assert data["content"] == "Dear Ada,\n\nHello\n\nFrom Bob {{plugin:x}}"
+        assert data["variables"] == ["input", "recipient", "sender"]
+        assert data["missing"] == []
+
+        result = await server.render_pattern("letter", strict=True)
+        data = json.loads(result.text)
+        assert data["missing"] == ["input", "recipient", "sender"]
+        assert "error" in data
+
+    @pytest.mark.asyncio
+    async def test_input_appended_without_placeholder(self, server):
+        """Test the Fabric convention of appending input to the prompt"""
+        result = await server.render_pattern("custom_test", input="My text")
+        data = json.loads(result.text)
+        assert data["content"] == "Custom pattern content\n\nMy text"
+
+    @pytest.mark.asyncio
+    async def test_template_compiled_once_per_version(self, server):
+        """Test that hot renders reuse the template until the file changes"""
+        await server.render_pattern("letter", input="one")
+        await server.render_pattern("letter", input="two")
+        assert server.template_cache.misses == 1
+        assert server.template_cache.hits == 1
+
+        (server.custom_patterns_dir / "letter.md").write_text("New {{input}}")
+        result = await server.render_pattern("letter", input="three")
+        assert json.loads(result.text)["content"] == "New three"
+
+
+class TestIncludes:
+    """Test include directives and invalidation of composed patterns"""
+
+    @pytest.fixture
+    def server(self, make_server, mock_patterns_dir):
+        custom_dir = mock_patterns_dir / ".config" / "custom_patterns"
+        (custom_dir / "footer.md").write_text("## FORMAT\n\nUse bullets.\n")
+        (custom_dir / "safety.md").write_text("Be careful.\n\n{{include:footer}}")
+        (custom_dir / "report.md").write_text(
+            "# Report\n\n{{include:safety}}\n\n{{ include: test_pattern#user prompt }}"
+        )
+        return make_server(persist_catalog=False)
+
+    @pytest.mark.asyncio
+    async def test_includes_expanded(self, server):
+        """Test nested includes and section includes"""
+        data = json.loads((await server.get_pattern("report")).text)
+        assert data["content"] == (
+            "# Report\n\nBe careful.\n\n## FORMAT\n\nUse bullets."
+            "\n\n# User Prompt\n\nUser prompt content"
+        )
+        assert data["content_length"] == len(data["content"])
+
+    @pytest.mark.asyncio
+    async def test_upstream_change_invalidates_transitively(self, server):
+        """Test that only patterns downstream of a change are re-rendered"""
+        await server.get_pattern("report")
+        misses = server.render_cache.misses
+        await server.get_pattern("report")
+        assert server.render_cache.misses == misses
+
+        await server.update_pattern("custom_test", "Unrelated change")
+        await server.get_pattern("report")
+        assert server.render_cache.misses == misses
+
+        await server.update_pattern("footer", "## FORMAT\n\nUse a table.")
+        assert server.patterns_cache["safety"].path not in server.render_cache
+        assert server.patterns_cache["report"].path not in server.render_cache
+        data = json.loads((await server.get_pattern("report")).text)
+        assert "Use a table." in data["content"]
+
+    @pytest.mark.asyncio
+    async def test_shadowing_change_invalidates(self, server):
+        """Test that an include follows the name to its new winning record"""
+        await server.get_pattern("report")
+        await server.create_pattern("test_pattern", "# User Prompt\n\nMine", {})
+        data = json.loads((await server.get_pattern("report")).text)
+        assert data["content"].endswith("# User Prompt\n\nMine")
+
+    @pytest.mark.asyncio
+    async def test_estimates_cover_includes(self, server):
+        """Test that size estimates and max_tokens see expanded includes"""
+        custom_dir = server.custom_patterns_dir
+        (custom_dir / "big.md").write_text("Lengthy guidance. " * 1000)
+        (custom_dir / "wrapper.md").write_text("Intro\n\n{{include:big}}")
+
+        result = await server.list_patterns(max_tokens=50)
+        names = {p["name"] for p in json.loads(result.text)["patterns"]}
+        assert "wrapper" not in names
+        result = await server.search_patterns("intro", max_tokens=50)
+        assert json.loads(result.text)["results"] == []
+
+        data = json.loads((await server.get_pattern("wrapper")).text)
+        record = server.patterns_cache["wrapper"]
+        assert record.chars == data["content_length"]
+
+        await server.update_pattern("big", "Short now.")
+        result = await server.list_patterns(max_tokens=50)
+        items = {p["name"]: p for p in json.loads(result.text)["patterns"]}
+        assert items["wrapper"]["chars"] == len("Intro\n\nShort now.")
+
+    @pytest.mark.asyncio
+    async def test_include_errors(self, server):
+        """Test that cycles, unknown patterns and sections are reported"""
+        await server.update_pattern("footer", "{{include:report}}")
+        data = json.loads((await server.get_pattern("report")).text)
+        assert data["error"] == "Include cycle: report -> safety -> footer -> report"
+
+        await server.update_pattern("footer", "{{include:nope}}")
+        data = json.loads((await server.get_pattern("safety")).text)
+        assert "unknown pattern 'nope'" in data["error"]
+
+        await server.update_pattern("footer", "{{include:custom_test#Missing}}")
+        result = await server.render_pattern("safety")
+        assert "Section 'Missing' not found" in json.loads(result.text)["error"]
+
+
+class TestTokenEstimates:
+    """Test per-pattern size estimates and the max_tokens filters"""
+
+    @pytest.fixture
+    def server(self, make_server, mock_patterns_dir):
+        custom_dir = mock_patterns_dir / ".config" / "custom_patterns"
+        (custom_dir / "long_summary.md").write_text("Summarize the content. " * 200)
+        return make_server()
+
+    def test_estimate_tokens(self):
+        """Test the heuristic on words, long words, numbers and symbols"""
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("Hello, world!") == 4
+        assert estimate_tokens("internationalization") == 4
+        assert estimate_tokens("1234567") == 3
+        assert estimate_tokens("## {{input}}") == 7
+
+    @pytest.mark.asyncio
+    async def test_estimates_stored_on_records(self, server):
+        """Test that records carry the size of the content get_pattern returns"""
+        await server.load_patterns()
+        record = server.patterns_cache["test_pattern"]
+        result = await server.get_pattern("test_pattern")
+        content = json.loads(result.text)["content"]
+        assert record.chars == len(content)
+        assert record.tokens == estimate_tokens(content)
+
+        result = await server.list_patterns()
+        items = {p["name"]: p for p in json.loads(result.text)["patterns"]}
+        assert items["long_summary"]["tokens"] > 500
+        assert items["custom_test"]["chars"] == len("Custom pattern content")
+
+    @pytest.mark.asyncio
+    async def test_max_tokens_filters(self, server):
+        """Test that max_tokens drops large patterns from listings and search"""
+        result = await server.list_patterns(max_tokens=100)
+        names = {p["name"] for p in json.loads(result.text)["patterns"]}
+        assert names == {"test_pattern", "custom_test"}
+
+        result = await server.search_patterns("content", limit=1, max_tokens=100)
+        results = json.loads(result.text)["results"]
+        assert len(results) == 1
+        assert results[0]["name"] != "long_summary"
+        assert results[0]["tokens"] <= 100
+
+        result = await server.search_patterns("long_sumary", fuzzy=True, max_tokens=100)
+        assert json.loads(result.text)["results"] == []
+
+    @pytest.mark.asyncio
+    async def test_estimates_follow_updates(self, server):
+        """Test that rewriting a pattern refreshes its estimates"""
+        await server.load_patterns()
+        assert server.patterns_cache["custom_test"].tokens == 5
+        await server.update_pattern("custom_test", "word " * 50)
+        assert server.patterns_cache["custom_test"].tokens == 50
+
+
+class TestBatchRetrieval:
+    """Test fetching several patterns in one call"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server()
+
+    @pytest.mark.asyncio
+    async def test_missing_names_reported_per_item(self, server):
+        """Test that one unknown name does not fail the batch"""
+        result = await server.get_patterns(["test_pattern", "nope", "custom_test"])
+        data = json.loads(result.text)
+
+        assert data["found"] == 2
+        assert data["missing"] == 1
+        names = [item["name"] for item in data["patterns"]]
+        assert names == ["test_pattern", "nope", "custom_test"]
+        assert "error" in data["patterns"][1]
+        assert data["patterns"][2]["content"] == "Custom pattern content"
+        assert data["patterns"][2]["metadata"]["tags"] == ["test", "custom"]
+
+    @pytest.mark.asyncio
+    async def test_selected_sections(self, server):
+        """Test returning only the requested parts"""
+        result = await server.get_patterns(
+            ["test_pattern"], sections=["system"], compact=True
+        )
+        item = json.loads(result.text)["patterns"][0]
+        assert item == {
+            "name": "test_pattern",
+            "source": "fabric",
+            "system": "System prompt content",
+        }
+
+        result = await server.get_patterns(["test_pattern"], sections=["bogus"])
+        assert "error" in json.loads(result.text)
+
+    @pytest.mark.asyncio
+    async def test_single_refresh_per_batch(self, server, monkeypatch):
+        """Test that a batch resolves against one catalog refresh"""
+        calls = []
+        original_refresh = server._refresh_patterns
+
+        async def counting_refresh(*args):
+            calls.append(1)
+            await original_refresh(*args)
+
+        monkeypatch.setattr(server, "_refresh_patterns", counting_refresh)
+        await server.get_patterns(["test_pattern", "custom_test", "test_pattern"])
+        assert len(calls) == 1
+
+
+class TestPagination:
+    """Test cursor pagination of pattern listings"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server(resource_page_size=1)
+
+    @pytest.mark.asyncio
+    async def test_list_patterns_pages(self, server):
+        """Test walking list_patterns one page at a time"""
+        result = await server.list_patterns(page_size=1, compact=True)
+        assert "\n" not in result.text
+        first = json.loads(result.text)
+        assert [p["name"] for p in first["patterns"]] == ["custom_test"]
+        assert first["total"] == 2
+
+        result = await server.list_patterns(page_size=1, cursor=first["next_cursor"])
+        second = json.loads(result.text)
+        assert [p["name"] for p in second["patterns"]] == ["test_pattern"]
+        assert "next_cursor" not in second
+
+    @pytest.mark.asyncio
+    async def test_stale_cursor_rejected(self, server):
+        """Test that a cursor from an older catalog generation is refused"""
+        result = await server.list_patterns(page_size=1)
+        cursor = json.loads(result.text)["next_cursor"]
+
+        (server.custom_patterns_dir / "added.md").write_text("Added")
+        result = await server.list_patterns(page_size=1, cursor=cursor)
+        assert "stale" in json.loads(result.text)["error"]
+
+        result = await server.list_patterns(cursor="garbage")
+        assert "Invalid cursor" in json.loads(result.text)["error"]
+
+    @pytest.mark.asyncio
+    async def test_page_size_must_be_positive(self, server):
+        """Test that empty or negative pages are refused"""
+        for page_size in (0, -1):
+            result = await server.list_patterns(page_size=page_size)
+            assert "page_size" in json.loads(result.text)["error"]
+
+    @pytest.mark.asyncio
+    async def test_list_resources_pages(self, server):
+        """Test that the MCP resource listing follows nextCursor"""
+        handler = server.server.request_handlers[ListResourcesRequest]
+
+        names: List[str] = []
+        cursor = None
+        while True:
+            request = ListResourcesRequest(
+                method="resources/list",
+                params=PaginatedRequestParams(cursor=cursor) if cursor else None,
+            )
+            result = (await handler(request)).root
+            names.extend(resource.name for resource in result.resources)
+            cursor = result.nextCursor
+            if cursor is None:
+                break
+
+        assert names == ["custom_test", "test_pattern"]
+
+
+class TestServerStats:
+    """Test handler instrumentation and the server_stats tool"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server()
+
+    async def call(self, server, name, arguments):
+        handler = server.server.request_handlers[CallToolRequest]
+        request = CallToolRequest(
+            method="tools/call",
+            params=CallToolRequestParams(name=name, arguments=arguments),
+        )
+        return (await handler(request)).root
+
+    @pytest.mark.asyncio
+    async def test_handlers_recorded(self, server):
+        """Test that tool calls, refreshes and I/O are counted"""
+        await self.call(server, "get_pattern", {"name": "test_pattern"})
+        await self.call(server, "get_pattern", {"name": "test_pattern"})
+        await self.call(server, "get_pattern", {"name": "missing"})
+
+        result = await self.call(server, "server_stats", {})
+        stats = json.loads(result.content[0].text)
+        assert stats["operations"]["tool:get_pattern"]["count"] == 3
+        assert stats["operations"]["load_patterns"]["count"] >= 1
+        assert stats["counters"]["files_read"] >= 2
+        assert stats["counters"]["bytes_read"] > 0
+        assert stats["caches"]["render"]["hits"] == 1
+        assert stats["catalog"]["patterns"] == 2
+
+    @pytest.mark.asyncio
+    async def test_unknown_tools_share_a_label(self, server):
+        """Test that arbitrary tool names do not create new operations"""
+        await self.call(server, "no_such_tool", {})
+        assert "tool:no_such_tool" not in server.stats.operations
+        assert server.stats.operations["tool:unknown"].errors == 1
+
+    @pytest.mark.asyncio
+    async def test_disabled_stats_record_nothing(self, make_server):
+        """Test that disabled instrumentation leaves no trace"""
+        server = make_server(enable_stats=False)
+        await self.call(server, "list_patterns", {})
+        assert server.stats.operations == {}
+        assert server.stats.counters == {}
+
+    def test_prometheus_text(self, server, tmp_path):
+        """Test the Prometheus rendering and the atomic stats file"""
+        stats = ServerStats()
+        with stats.timer("read_resource"):
+            pass
+        stats.count("files_read", 3)
+        text = stats.to_prometheus({"body_cache_hits": 5}, {"patterns": 2})
+        assert (
+            'pattern_server_request_duration_seconds_count{op="read_resource"} 1'
+            in text
+        )
+        assert 'le="+Inf"} 1' in text
+        assert "pattern_server_files_read_total 3" in text
+        assert "pattern_server_body_cache_hits_total 5" in text
+        assert "pattern_server_patterns 2" in text
+
+        server.stats_file = tmp_path / "stats.prom"
+        server.write_stats_file()
+        assert "pattern_server_uptime_seconds" in server.stats_file.read_text()
+        assert not (tmp_path / "stats.prom.tmp").exists()
+
+
+class TestFilteredListing:
+    """Test source and tag filtering through the secondary indexes"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        server = make_server()
+        (server.custom_patterns_dir / "tagged.md").write_text("Tagged")
+        (server.custom_patterns_dir / "tagged.json").write_text(
+            json.dumps({"tags": [" Test ", "Writing"]})
+        )
+        return server
+
+    async def names(self, server, **filters):
+        result = await server.list_patterns(**filters)
+        return [p["name"] for p in json.loads(result.text)["patterns"]]
+
+    @pytest.mark.asyncio
+    async def test_tag_match_any_and_all(self, server):
+        """Test case-insensitive tags with any/all semantics"""
+        assert await self.names(server, tags=["TEST"]) == ["custom_test", "tagged"]
+        assert await self.names(server, tags=["custom", "writing"]) == [
+            "custom_test",
+            "tagged",
+        ]
+        assert await self.names(server, tags=["test", "writing"], tag_match="all") == [
+            "tagged"
+        ]
+        assert await self.names(server, tags=["nope"]) == []
+
+        result = await server.list_patterns(tags=["test"], tag_match="some")
+        assert "error" in json.loads(result.text)
+
+    @pytest.mark.asyncio
+    async def test_source_and_tags_intersect(self, server):
+        """Test combining the source filter with tags and pagination"""
+        assert await self.names(server, source="fabric") == ["test_pattern"]
+        assert await self.names(server, source="fabric", tags=["test"]) == []
+
+        result = await server.list_patterns(source="custom", page_size=1)
+        first = json.loads(result.text)
+        result = await server.list_patterns(
+            source="custom", page_size=1, cursor=first["next_cursor"]
+        )
+        assert [p["name"] for p in json.loads(result.text)["patterns"]] == ["tagged"]
+
+    @pytest.mark.asyncio
+    async def test_indexes_follow_catalog_changes(self, server):
+        """Test that edited and deleted patterns leave the indexes"""
+        assert await self.names(server, tags=["writing"]) == ["tagged"]
+
+        (server.custom_patterns_dir / "tagged.json").write_text(
+            json.dumps({"tags": ["review"]})
+        )
+        (server.custom_patterns_dir / "custom_test.md").unlink()
+        (server.custom_patterns_dir / "custom_test.json").unlink()
+        assert await self.names(server, tags=["writing"]) == []
+        assert await self.names(server, tags=["test"]) == []
+        assert await self.names(server, tags=["review"]) == ["tagged"]
+        assert "test" not in server.catalog_index.by_tag
+        assert server.catalog_index.by_source["custom"] == {"tagged"}
+
+
+class TestFuzzyLookup:
+    """Test trigram-based name suggestions and fuzzy search"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        server = make_server()
+        for name in ("summarize_paper", "summarize_meeting", "extract_wisdom"):
+            (server.custom_patterns_dir / f"{name}.md").write_text(name)
+        return server
+
+    def test_suggestions_ranked_by_closeness(self):
+        """Test that misspellings find the intended name first"""
+        index = TrigramIndex()
+        for name in ("summarize_paper", "summarize_meeting", "create_paper"):
+            index.add(name)
+        assert index.suggest("summarise_paper")[0] == "summarize_paper"
+        assert index.suggest("Summarize Meetings")[0] == "summarize_meeting"
+        assert index.suggest("zzzz") == []
+
+        index.remove("summarize_paper")
+        assert "summarize_paper" not in index.suggest("summarise_paper")
+
+    @pytest.mark.asyncio
+    async def test_get_pattern_did_you_mean(self, server):
+        """Test that unknown names come back with suggestions"""
+        result = await server.get_pattern("summarise_paper")
+        error = json.loads(result.text)
+        assert "did you mean 'summarize_paper'" in error["error"]
+        assert error["suggestions"][0] == "summarize_paper"
+
+        result = await server.get_patterns(["extract_wisdon"])
+        item = json.loads(result.text)["patterns"][0]
+        assert item["suggestions"][0] == "extract_wisdom"
+
+    @pytest.mark.asyncio
+    async def test_fuzzy_search_follows_catalog(self, server):
+        """Test fuzzy search over names, including removed patterns"""
+        result = await server.search_patterns("sumarize", fuzzy=True)
+        names = [r["name"] for r in json.loads(result.text)["results"]]
+        assert set(names[:2]) == {"summarize_paper", "summarize_meeting"}
+
+        (server.custom_patterns_dir / "summarize_paper.md").unlink()
+        result = await server.search_patterns("summarize paper", fuzzy=True)
+        names = [r["name"] for r in json.loads(result.text)["results"]]
+        assert "summarize_paper" not in names
+        assert names[0] == "summarize_meeting"
+
+
+class TestSimilarPatterns:
+    """Test TF-IDF related-pattern lookup"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        pytest.importorskip("numpy")
+        pytest.importorskip("scipy")
+        server = make_server()
+        bodies = {
+            "summarize_paper": "Summarize the research paper into key findings",
+            "summarize_article": "Summarize the news article into key points",
+            "threat_model": "Build a threat model of the system architecture",
+        }
+        for name, body in bodies.items():
+            (server.custom_patterns_dir / f"{name}.md").write_text(body)
+        return server
+
+    async def similar(self, server, **arguments):
+        result = await server.similar_patterns(**arguments)
+        return [r["name"] for r in json.loads(result.text)["results"]]
+
+    @pytest.mark.asyncio
+    async def test_similar_to_pattern_and_text(self, server):
+        """Test ranking by cosine similarity, excluding the pattern itself"""
+        names = await self.similar(server, name="summarize_paper", limit=1)
+        assert names == ["summarize_article"]
+
+        names = await self.similar(server, text="threat model for my architecture")
+        assert names[0] == "threat_model"
+        assert await self.similar(server, text="zzzz") == []
+
+        result = await server.similar_patterns(name="summarise_paper")
+        assert "did you mean" in json.loads(result.text)["error"]
+        result = await server.similar_patterns()
+        assert "exactly one" in json.loads(result.text)["error"]
+
+    @pytest.mark.asyncio
+    async def test_vectors_follow_catalog_changes(self, server):
+        """Test that edited and removed patterns are re-vectorized"""
+        assert await self.similar(server, name="summarize_paper", limit=1) == [
+            "summarize_article"
+        ]
+        (server.custom_patterns_dir / "summarize_article.md").unlink()
+        (server.custom_patterns_dir / "threat_model.md").write_text(
+            "Summarize the research paper findings"
+        )
+        assert await self.similar(server, name="summarize_paper", limit=1) == [
+            "threat_model"
+        ]
+        assert len(server.tfidf_index) == len(server.search_index)
+
+    @pytest.mark.asyncio
+    async def test_unavailable_without_numpy(self, server, monkeypatch):
+        """Test the error returned when numpy or scipy is missing"""
+        monkeypatch.setattr("pattern_mcp_server.np", None)
+        result = await server.similar_patterns(text="summarize")
+        assert "requires numpy" in json.loads(result.text)["error"]
+
+        monkeypatch.undo()
+        monkeypatch.setattr("pattern_mcp_server.sparse", None)
+        result = await server.similar_patterns(text="summarize")
+        assert "requires numpy and scipy" in json.loads(result.text)["error"]
+
+
+class TestFindDuplicates:
+    """Test MinHash near-duplicate detection"""
+
+    PROMPT = (
+        "You are an expert analyst. Read the input carefully and extract the "
+        "main ideas, the supporting evidence and any open questions. Write "
+        "each idea as a bullet of at most twenty words, then list the "
+        "evidence for it, then the open questions, in that order."
+    )
+
+    @pytest.fixture
+    def server(self, make_server):
+        pytest.importorskip("numpy")
+        server = make_server(persist_catalog=False)
+        bodies = {
+            "extract_ideas": self.PROMPT,
+            "extract_ideas_copy": self.PROMPT.replace("expert", "experienced"),
+            "threat_model": "Build a threat model of the system architecture",
+        }
+        for name, body in bodies.items():
+            (server.custom_patterns_dir / f"{name}.md").write_text(body)
+        return server
+
+    @pytest.mark.asyncio
+    async def test_reports_near_duplicates(self, server):
+        """Test that edited copies pair up and unrelated patterns do not"""
+        data = json.loads((await server.find_duplicates()).text)
+        assert data["total"] == 1
+        pair = data["duplicates"][0]
+        assert pair["patterns"] == ["extract_ideas", "extract_ideas_copy"]
+        assert pair["sources"] == ["custom", "custom"]
+        assert 0.8 <= pair["similarity"] < 1.0
+
+        data = json.loads((await server.find_duplicates(name="threat_model")).text)
+        assert data["duplicates"] == []
+
+        result = await server.find_duplicates(threshold=0)
+        assert "error" in json.loads(result.text)
+        result = await server.find_duplicates(limit=0)
+        assert "error" in json.loads(result.text)
+
+    @pytest.mark.asyncio
+    async def test_total_counts_pairs_past_limit(self, server):
+        """Test that total covers every live pair, not just the returned page"""
+        (server.custom_patterns_dir / "extract_ideas_again.md").write_text(
+            self.PROMPT.replace("carefully", "closely")
+        )
+        data = json.loads((await server.find_duplicates(threshold=0.5)).text)
+        assert data["total"] == 3
+        data = json.loads((await server.find_duplicates(threshold=0.5, limit=1)).text)
+        assert len(data["duplicates"]) == 1
+        assert data["total"] == 3
+
+    @pytest.mark.asyncio
+    async def test_signatures_updated_incrementally(self, server):
+        """Test that only changed patterns are hashed again"""
+        await server.find_duplicates()
+        assert server.stats.counters["minhash_signatures"] == 5
+
+        await server.update_pattern("extract_ideas_copy", "Something else entirely")
+        data = json.loads((await server.find_duplicates(name="extract_ideas")).text)
+        assert data["duplicates"] == []
+        assert server.stats.counters["minhash_signatures"] == 6
+
+        await server.delete_pattern("extract_ideas_copy")
+        data = json.loads((await server.find_duplicates()).text)
+        assert data["compared"] == 4
+
+
+class TestPatternRoots:
+    """Test ordered pattern roots, shadowing and per-root refreshes"""
+
+    @pytest.fixture
+    def server(self, make_server, mock_patterns_dir):
+        team = mock_patterns_dir / "team"
+        team.mkdir()
+        (team / "test_pattern.md").write_text("Team version")
+        (team / "team_only.md").write_text("Team pattern")
+        roots = [
+            PatternRoot("custom", mock_patterns_dir / ".config" / "custom_patterns"),
+            PatternRoot("team", team),
+            PatternRoot(
+                "fabric", mock_patterns_dir / ".config" / "fabric" / "patterns"
+            ),
+        ]
+        return make_server(roots=roots, persist_catalog=False)
+
+    def test_parse_root_specs(self, tmp_path):
+        """Test NAME[:LAYOUT]=PATH parsing and layout defaults"""
+        roots = parse_pattern_roots(
+            [f"mine={tmp_path}", f"fabric={tmp_path}/f", f"vendor:fabric={tmp_path}"]
+        )
+        assert [(root.name, root.layout) for root in roots] == [
+            ("mine", "custom"),
+            ("fabric", "fabric"),
+            ("vendor", "fabric"),
+        ]
+        for bad in (["no-path"], [f"a={tmp_path}", f"a={tmp_path}"], ["a:zip=/x"]):
+            with pytest.raises(ValueError):
+                parse_pattern_roots(bad)
+
+    @pytest.mark.asyncio
+    async def test_precedence_and_qualified_names(self, server):
+        """Test that earlier roots shadow later ones and both stay addressable"""
+        result = await server.list_patterns()
+        patterns = {p["name"]: p for p in json.loads(result.text)["patterns"]}
+        assert patterns["test_pattern"]["source"] == "team"
+        assert patterns["test_pattern"]["shadows"] == ["fabric"]
+        assert "shadows" not in patterns["team_only"]
+
+        data = json.loads((await server.get_pattern("test_pattern")).text)
+        assert data["content"] == "Team version"
+        data = json.loads((await server.get_pattern("fabric:test_pattern")).text)
+        assert data["source"] == "fabric"
+        assert "System prompt content" in data["content"]
+        data = json.loads((await server.get_pattern("custom:team_only")).text)
+        assert "error" in data
+
+        result = await server.list_patterns(source="team")
+        names = [p["name"] for p in json.loads(result.text)["patterns"]]
+        assert names == ["team_only", "test_pattern"]
+
+    @pytest.mark.asyncio
+    async def test_writes_respect_precedence(self, server):
+        """Test that custom writes shadow and then uncover other roots"""
+        await server.load_patterns()
+        await server.create_pattern("test_pattern", "Personal version", {})
+        assert server.patterns_cache["test_pattern"].source == "custom"
+
+        await server.delete_pattern("test_pattern")
+        assert server.patterns_cache["test_pattern"].source == "team"
+
+        result = await server.create_pattern("team:x", "Bad", {})
+        assert "error" in json.loads(result.text)
+
+    @pytest.mark.asyncio
+    async def test_refresh_only_scans_selected_roots(self, server, monkeypatch):
+        """Test that refreshing one root leaves the others untouched"""
+        await server.load_patterns()
+        scanned = []
+        original = server._scan_root
+
+        def recording_scan(root):
+            scanned.append(root.name)
+            return original(root)
+
+        monkeypatch.setattr(server, "_scan_root", recording_scan)
+        (server.roots[1].path / "team_only.md").unlink()
+        await server.load_patterns(force=True, roots=["team"])
+
+        assert scanned == ["team"]
+        assert "team_only" not in server.patterns_cache
+        assert server.patterns_cache["custom_test"].source == "custom"
+        assert server.patterns_cache["test_pattern"].source == "team"
+
+    @pytest.mark.asyncio
+    async def test_moved_root_rescanned_alone(self, server, monkeypatch, tmp_path):
+        """Test that changing one root's path drops only that root's entries"""
+        server.refresh_interval = 3600
+        await server.load_patterns()
+        scanned = []
+        original = server._scan_root
+
+        def counting_scan(root):
+            scanned.append(root.name)
+            return original(root)
+
+        monkeypatch.setattr(server, "_scan_root", counting_scan)
+        other = tmp_path / "other_team"
+        other.mkdir()
+        (other / "moved.md").write_text("Moved")
+        server.roots[1].path = other
+        await server.load_patterns()
+
+        assert scanned == ["team"]
+        assert "moved" in server.patterns_cache
+        assert "team_only" not in server.patterns_cache
+        assert server.patterns_cache["test_pattern"].source == "fabric"
+
+
+class TestPatternPacks:
+    """Test exporting roots to a pattern pack and serving from it"""
+
+    @pytest.fixture
+    def roots(self, mock_patterns_dir):
+        config = mock_patterns_dir / ".config"
+        return [
+            PatternRoot("custom", config / "custom_patterns"),
+            PatternRoot("fabric", config / "fabric" / "patterns"),
+        ]
+
+    @pytest.fixture
+    def pack_path(self, make_server, roots, tmp_path):
+        path = tmp_path / "patterns.pack"
+        server = make_server(roots=roots, persist_catalog=False)
+        summary = asyncio.run(server.export_pack(path))
+        assert summary["roots"] == {"custom": 1, "fabric": 1}
+        assert summary["bytes"] == path.stat().st_size
+        return path
+
+    def test_rejects_other_files(self, tmp_path):
+        """Test that a file without the pack header is refused"""
+        path = tmp_path / "not.pack"
+        path.write_bytes(b"plain text, not a pack")
+        with pytest.raises(ValueError):
+            PatternPack(path)
+
+    @pytest.mark.asyncio
+    async def test_served_from_pack(self, make_server, roots, pack_path):
+        """Test that packed roots serve the same content and metadata"""
+        packed = [PatternRoot(root.name, pack_path, "pack") for root in roots]
+        server = make_server(roots=packed, persist_catalog=False)
+
+        data = json.loads((await server.get_pattern("test_pattern")).text)
+        assert data["source"] == "fabric"
+        assert data["content"] == (
+            "# System Prompt\n\nSystem prompt content\n\n"
+            "# User Prompt\n\nUser prompt content"
+        )
+        data = json.loads((await server.get_pattern("custom_test")).text)
+        assert data["content"] == "Custom pattern content"
+        assert data["metadata"]["author"] == "Test Author"
+
+        result = await server.search_patterns("custom")
+        names = [r["name"] for r in json.loads(result.text)["results"]]
+        assert names[0] == "custom_test"
+
+    @pytest.mark.asyncio
+    async def test_packed_roots_keep_custom_writable(
+        self, make_server, roots, pack_path
+    ):
+        """Test that the writable root stays on disk when serving a pack"""
+        packed = packed_roots(roots, pack_path)
+        assert [root.layout for root in packed] == ["custom", "pack"]
+
+        server = make_server(roots=packed, persist_catalog=False)
+        await server.load_patterns()
+        assert server.patterns_cache["test_pattern"].path.startswith(str(pack_path))
+        await server.create_pattern("fresh", "New content", {})
+        assert server.patterns_cache["fresh"].source == "custom"
+
+    @pytest.mark.asyncio
+    async def test_replaced_pack_is_reloaded(self, make_server, roots, pack_path):
+        """Test that re-exporting a pack updates a server reading it"""
+        server = make_server(
+            roots=[PatternRoot("fabric", pack_path, "pack")], persist_catalog=False
+        )
+        await server.get_pattern("test_pattern")
+
+        (roots[1].path / "test_pattern" / "user.md").write_text("Revised")
+        await make_server(roots=roots, persist_catalog=False).export_pack(pack_path)
+
+        data = json.loads((await server.get_pattern("test_pattern")).text)
+        assert data["content"].endswith("# User Prompt\n\nRevised")
+
+
+class TestHttpTransport:
+    """Test the shared-server HTTP transport and the concurrency limit"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server(max_concurrency=1)
+
+    def test_concurrency_limit_must_be_positive(self, make_server, capsys):
+        """Test that a limit below one is rejected by the CLI and the server"""
+        assert parse_args(["--max-concurrency", "2"]).max_concurrency == 2
+        for value in ("0", "-1"):
+            with pytest.raises(SystemExit):
+                parse_args(["--max-concurrency", value])
+            assert "must be at least 1" in capsys.readouterr().err
+        with pytest.raises(ValueError):
+            make_server(max_concurrency=0)
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limit_queues_requests(self, server, monkeypatch):
+        """Test that requests beyond the limit wait for a free slot"""
+        active = []
+        peak = []
+        original = server.get_pattern
+
+        async def slow_get_pattern(*args, **kwargs):
+            active.append(1)
+            peak.append(len(active))
+            await asyncio.sleep(0.05)
+            active.pop()
+            return await original(*args, **kwargs)
+
+        monkeypatch.setattr(server, "get_pattern", slow_get_pattern)
+        handler = server.server.request_handlers[CallToolRequest]
+        request = CallToolRequest(
+            method="tools/call",
+            params=CallToolRequestParams(
+                name="get_pattern", arguments={"name": "test_pattern"}
+            ),
+        )
+        results = await asyncio.gather(*(handler(request) for _ in range(3)))
+
+        assert max(peak) == 1
+        assert all(not result.root.isError for result in results)
+        assert server.stats.counters["requests_queued"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_clients_share_one_catalog(self, server):
+        """Test that loopback HTTP clients are served from one warm cache"""
+        uvicorn = pytest.importorskip("uvicorn")
+        from mcp import ClientSession
+        from mcp.client import streamable_http
+
+        # Releases before the rename only have the old spelling
+        http_client = getattr(
+            streamable_http,
+            "streamable_http_client",
+            streamable_http.streamablehttp_client,
+        )
+
+        server.refresh_interval = 3600
+
+        config = uvicorn.Config(
+            server.http_app(), host="127.0.0.1", port=0, log_level="warning"
+        )
+        http = uvicorn.Server(config)
+        serve_task = asyncio.ensure_future(http.serve())
+        try:
+            assert await wait_for(lambda: http.started)
+            port = http.servers[0].sockets[0].getsockname()[1]
+            url = f"http://127.0.0.1:{port}/mcp"
+
+            async def list_names():
+                async with http_client(url) as (read, write, _):
+                    async with ClientSession(read, write) as session:
+                        await session.initialize()
+                        result = await session.call_tool("list_patterns", {})
+                        content = result.content[0]
+                        assert isinstance(content, TextContent)
+                        data = json.loads(content.text)
+                        return sorted(p["name"] for p in data["patterns"])
+
+            first, second = await asyncio.gather(list_names(), list_names())
+        finally:
+            http.should_exit = True
+            await serve_task
+
+        assert first == second == ["custom_test", "test_pattern"]
+        assert server.stats.operations["load_patterns"].count == 1
+        assert server.stats.operations["tool:list_patterns"].count == 2
+
+
+async def wait_for(predicate, timeout=5.0):
+    """Poll ``predicate`` until it holds or ``timeout`` expires"""
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_event_loop().time() > deadline:
+            return False
+        await asyncio.sleep(0.02)
+    return True
+
+
+class TestPatternWatcher:
+    """Test the background filesystem watcher"""
+
+    @pytest.fixture
+    def server(self, make_server):
+        return make_server(refresh_interval=3600)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("use_inotify", [True, False])
+    async def test_changes_applied_in_background(self, server, use_inotify):
+        """Test that adds, edits and deletes reach the cache without a request"""
+        server.watcher = PatternWatcher(
+            server, debounce=0.05, poll_interval=0.05, use_inotify=use_inotify
+        )
+        await server.watcher.start()
+        try:
+            if use_inotify and sys.platform.startswith("linux"):
+                assert server.watcher.mode == "inotify"
+
+            new_pattern = server.fabric_patterns_dir / "new_pattern"
+            new_pattern.mkdir()
+            (new_pattern / "system.md").write_text("New system prompt")
+            assert await wait_for(lambda: "new_pattern" in server.patterns_cache)
+
+            (new_pattern / "system.md").write_text("Edited system prompt")
+            assert await wait_for(
+                lambda: server.patterns_cache["new_pattern"].size
+                == len("Edited system prompt")
+            )
+
+            (server.custom_patterns_dir / "custom_test.md").unlink()
+            assert await wait_for(lambda: "custom_test" not in server.patterns_cache)
+        finally:
+            await server.watcher.stop()
+        assert not server.watcher.running
+
+    @pytest.mark.asyncio
+    async def test_bursts_are_debounced(self, server):
+        """Test that a burst of events results in a single refresh"""
+        server.watcher = PatternWatcher(server, debounce=0.2)
+        await server.watcher.start()
+        try:
+            if server.watcher.mode != "inotify":
+                pytest.skip("inotify not available")
+
+            for i in range(50):
+                (server.custom_patterns_dir / f"burst_{i}.md").write_text(str(i))
+            assert await wait_for(lambda: "burst_49" in server.patterns_cache)
+            await asyncio.sleep(0.3)
+            assert server.watcher.refresh_count == 1
+        finally:
+            await server.watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_events_rescan_only_their_root(self, server, monkeypatch):
+        """Test that a change in one root does not rescan the others"""
+        server.watcher = PatternWatcher(server, debounce=0.05)
+        await server.watcher.start()
+        try:
+            if server.watcher.mode != "inotify":
+                pytest.skip("inotify not available")
+
+            scanned = []
+            original = server._scan_root
+
+            def counting_scan(root):
+                scanned.append(root.name)
+                return original(root)
+
+            monkeypatch.setattr(server, "_scan_root", counting_scan)
+            (server.custom_patterns_dir / "fresh.md").write_text("Fresh")
+            assert await wait_for(lambda: "fresh" in server.patterns_cache)
+            assert scanned == ["custom"]
+        finally:
+            await server.watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_shared_pack_refreshes_every_root(
+        self, make_server, mock_patterns_dir, tmp_path
+    ):
+        """Test that re-exporting a pack refreshes all the roots it serves"""
+        config = mock_patterns_dir / ".config"
+        team = mock_patterns_dir / "team"
+        team.mkdir()
+        (team / "team_only.md").write_text("Team v1")
+        roots = [
+            PatternRoot("custom", config / "custom_patterns"),
+            PatternRoot("team", team),
+            PatternRoot("fabric", config / "fabric" / "patterns"),
+        ]
+        pack_path = tmp_path / "patterns.pack"
+        await make_server(roots=roots, persist_catalog=False).export_pack(pack_path)
+        packed = packed_roots(roots, pack_path)
+        assert [root.layout for root in packed] == ["custom", "pack", "pack"]
+
+        server = make_server(roots=packed, refresh_interval=3600, persist_catalog=False)
+        await server.load_patterns()
+        server.watcher = PatternWatcher(server, debounce=0.05)
+        await server.watcher.start()
+        try:
+            if server.watcher.mode != "inotify":
+                pytest.skip("inotify not available")
+
+            fabric_size = server.patterns_cache["test_pattern"].size
+            (team / "team_only.md").write_text("Team v2")
+            user_md = roots[2].path / "test_pattern" / "user.md"
+            user_md.write_text("Fabric v2")
+            await make_server(roots=roots, persist_catalog=False).export_pack(pack_path)
+
+            async def content(name):
+                data = json.loads((await server.get_pattern(name)).text)
+                return data["content"]
+
+            assert await wait_for(
+                lambda: server.patterns_cache["team_only"].size == len("Team v2")
+                and server.patterns_cache["test_pattern"].size != fabric_size
+            )
+            assert await content("team_only") == "Team v2"
+            assert (await content("test_pattern")).endswith("Fabric v2")
+        finally:
+            await server.watcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_requests_skip_disk_while_watching(self, server, monkeypatch):
+        """Test that handlers rely on the watcher instead of scanning"""
+        server.refresh_interval = 0
+        server.watcher = PatternWatcher(server, use_inotify=False, poll_interval=3600)
+        await server.watcher.start()
+        try:
+            (server.custom_patterns_dir / "unseen.md").write_text("Not yet")
+            await server.load_patterns()
+            assert "unseen" not in server.patterns_cache
+        finally:
+            await server.watcher.stop()
+
+
+class TestSearchIndex:
+    """Test the BM25 inverted index behind search_patterns"""
+
+    def test_ranking_prefers_weighted_fields(self):
+        """Test that name and tag matches outrank body-only matches"""
+        index = SearchIndex()
+        index.add("summarize", {"name": "summarize", "content": "Write a summary"})
+        index.add("tagged", {"name": "other", "tags": "summarize"})
+        index.add("body_only", {"name": "misc", "content": "you may summarize it"})
+
+        ranked = [doc for doc, _ in index.search("summarize")]
+        assert ranked == ["summarize", "tagged", "body_only"]
+        assert len(index.search("summarize", limit=2)) == 2
+        assert index.search("absent") == []
+
+    def test_remove_and_replace(self):
+        """Test that documents can be replaced and removed"""
+        index = SearchIndex()
+        index.add("doc", {"content": "alpha"})
+        index.add("doc", {"content": "beta"})
+        assert index.search("alpha") == []
+        assert [doc for doc, _ in index.search("beta")] == ["doc"]
+
+        index.remove("doc")
+        assert len(index) == 0
+        assert index.search("beta") == []
+
+    @pytest.mark.asyncio
+    async def test_index_follows_catalog_changes(self, make_server):
+        """Test that search reflects edits without rebuilding the index"""
+        server = make_server()
+
+        result = await server.search_patterns("edited")
+        assert json.loads(result.text)["results"] == []
+
+        (server.custom_patterns_dir / "custom_test.md").write_text("Edited prompt")
+        result = await server.search_patterns("edited")
+        data = json.loads(result.text)
+        assert [r["name"] for r in data["results"]] == ["custom_test"]
+        assert data["results"][0]["score"] > 0
+
+    @pytest.mark.asyncio
+    async def test_malformed_metadata_is_tolerated(self, make_server):
+        """Test that null or non-string metadata does not break loading"""
+        server = make_server(persist_catalog=False)
+        await server.create_pattern("evil", "Odd metadata", {"description": None})
+        (server.custom_patterns_dir / "odd.md").write_text("Odd tags")
+        (server.custom_patterns_dir / "odd.json").write_text(
+            json.dumps({"description": 42, "tags": [None, 7, "kept"]})
+        )
+
+        fresh = make_server(persist_catalog=False)
+        result = await fresh.list_patterns()
+        names = {p["name"] for p in json.loads(result.text)["patterns"]}
+        assert {"evil", "odd", "custom_test", "test_pattern"} <= names
+        data = json.loads((await fresh.get_pattern("custom_test")).text)
+        assert data["content"] == "Custom pattern content"
+        result = await fresh.search_patterns("kept")
+        assert [r["name"] for r in json.loads(result.text)["results"]] == ["odd"]
+
+
 class TestPatternMethods:
     """Test individual pattern methods"""
 